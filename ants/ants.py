@@ -1,16 +1,26 @@
 #!/usr/bin/env python
-from random import randrange, choice, shuffle, randint, seed, random
+from random import randrange, choice, shuffle, randint, seed, random, getstate, setstate
 from math import sqrt
 from collections import deque, defaultdict
+from array import array
 
 from fractions import Fraction
 import operator
+import struct
+import time
+import re
+import json
+from tempfile import SpooledTemporaryFile
 from game import Game
-from copy import deepcopy
+import mapcache
 try:
     from sys import maxint
 except ImportError:
     from sys import maxsize as maxint
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 ANTS = 0
 DEAD = -1
@@ -24,6 +34,9 @@ HILL_ANT = string = 'ABCDEFGHI'
 PLAYER_HILL = string = '0123456789'
 MAP_OBJECT = '?%*.!'
 MAP_RENDER = PLAYER_ANT + HILL_ANT + PLAYER_HILL + MAP_OBJECT
+if numpy is not None:
+    # used by the numpy board to render a whole map at once
+    MAP_RENDER_ARRAY = numpy.frombuffer(MAP_RENDER.encode('ascii'), dtype=numpy.uint8)
 
 HILL_POINTS = 2
 RAZE_POINTS = -1
@@ -34,6 +47,23 @@ AIM = {'n': (-1, 0),
        's': (1, 0),
        'w': (0, -1)}
 
+# stands for None in the player switch lists of a snapshot
+SWITCH_NONE = -100
+
+# order lines in the usual form, which need no other parsing
+#   ORDER_LINE matches one line, ORDER_BATCH a batch of lines each
+#   ending with a newline
+ORDER_LINE = re.compile(r'o ([0-9]+) ([0-9]+) ([nesw])\Z')
+ORDER_BATCH = re.compile(r'(?:o [0-9]+ [0-9]+ [nesw]\n)*\Z')
+
+# phases of finish_turn, in the order they run, timed for the stats
+PHASES = ('orders', 'attack', 'raze_hills', 'spawn', 'gather', 'food',
+          'vision', 'revealed')
+
+# replay entries of finished ants and food kept in memory before the
+#   spool of a game goes to disk
+REPLAY_SPOOL_SIZE = 1024 * 1024
+
 # precalculated sqrt
 SQRT = [int(sqrt(r)) for r in range(101)]
 
@@ -69,10 +99,14 @@ class Ants(Game):
 
         self.do_attack = {
             'focus':   self.do_attack_focus,
+            'focus_batch': self.do_attack_focus_batch,
             'closest': self.do_attack_closest,
             'support': self.do_attack_support,
             'damage':  self.do_attack_damage
         }.get(options.get('attack'), self.do_attack_focus)
+        if self.do_attack == self.do_attack_focus_batch and numpy is None:
+            raise Exception("attack",
+                            "focus_batch attack requested but numpy is not installed")
 
         self.do_food = {
             'none':      self.do_food_none,
@@ -80,23 +114,64 @@ class Ants(Game):
             'sections':  self.do_food_sections,
             'symmetric': self.do_food_symmetric
         }.get(options.get('food'), self.do_food_sections)
+        # draw random food from the index of free land, which is faster
+        #   on crowded maps but draws different numbers, so a seed
+        #   plays a different game than without it
+        self.food_index = options.get('food_index', False)
 
         self.scenario = options.get('scenario', False)
 
-        map_data = self.parse_map(map_text)
+        # board storage, 'list' uses nested python lists
+        #   'numpy' uses contiguous arrays and whole array operations
+        self.board = options.get('board', 'list')
+        if self.board == 'numpy' and numpy is None:
+            raise Exception("board",
+                            "numpy board requested but numpy is not installed")
+
+        # directory of the on-disk cache of structures derived from maps
+        #   None disables the cache
+        self.map_cache = options.get('map_cache')
+        # symmetry and food sets read from the cache, see read_map_cache
+        self.symmetry_cache = None
+        cached = None
+        if self.map_cache:
+            self.map_cache_key = mapcache.cache_key(map_text, self.viewradius, self.scenario)
+            arrays = mapcache.load(self.map_cache, self.map_cache_key)
+            if arrays is not None:
+                cached = self.read_map_cache(arrays)
+
+        if cached is None:
+            map_data = self.parse_map(map_text)
+        else:
+            map_data = cached['map_data']
 
         self.turn = 0
         self.num_players = map_data['num_players']
 
         self.current_ants = {} # ants that are currently alive
+        # current ants of each player keyed by location
+        self.owner_ants = [{} for _ in range(self.num_players)]
         self.killed_ants = []  # ants which were killed this turn
         self.all_ants = []     # all ants that have been created
 
         self.all_food = []     # all food created
         self.current_food = {} # food currently in game
+        # write the replay entries of dead ants and removed food to
+        #   spools as the game goes, and drop them from all_ants and
+        #   all_food, see spool_entries
+        self.spool_replay = options.get('spool_replay', False)
+        if self.spool_replay:
+            self.ant_spool = SpooledTemporaryFile(REPLAY_SPOOL_SIZE, 'w+')
+            self.food_spool = SpooledTemporaryFile(REPLAY_SPOOL_SIZE, 'w+')
         self.pending_food = defaultdict(int)
+        # pending food locations queued or freed since place_food last ran
+        self.pending_ready = set()
 
         self.hills = {}        # all hills
+        self.hill_count = [0]*self.num_players # hills not razed for each player
+        # sorted changes shared by get_state and render_changes
+        #   reset to None whenever the objects on the map change
+        self.state_changes = None
         self.hive_food = [0]*self.num_players # food waiting to spawn for player
         self.hive_history = [[0] for _ in range(self.num_players)]
 
@@ -111,18 +186,57 @@ class Ants(Game):
         self.ranking_bots = None
         self.ranking_turn = 0
 
+        # seconds spent in each phase of finish_turn, last turn and in total
+        self.turn_phase_time = dict((phase, 0.0) for phase in PHASES)
+        self.phase_time = dict((phase, 0.0) for phase in PHASES)
+
         # initialize size
         self.height, self.width = map_data['size']
         self.land_area = self.height*self.width - len(map_data['water'])
 
         # initialize map
         # this matrix does not track hills, just ants
-        self.map = [[LAND]*self.width for _ in range(self.height)]
+        if self.board == 'numpy':
+            self.map = numpy.empty((self.height, self.width), dtype=numpy.int8)
+            self.map.fill(LAND)
+        else:
+            self.map = [[LAND]*self.width for _ in range(self.height)]
 
         # initialize water
         for row, col in map_data['water']:
             self.map[row][col] = WATER
 
+        # flat location encoding used by moves and searches
+        #   square (row, col) is numbered row * width + col
+        #   self.locs maps a number back to its (row, col) tuple
+        #   self.neighbours maps a direction to the number of the
+        #     adjacent square in that direction for each square
+        #   self.adjacent lists the 4 adjacent squares in AIM order
+        self.locs = [divmod(loc, self.width) for loc in range(self.height * self.width)]
+        self.neighbours = {}
+        for direction, (d_row, d_col) in AIM.items():
+            self.neighbours[direction] = [((row + d_row) % self.height) * self.width
+                                          + (col + d_col) % self.width
+                                          for row, col in self.locs]
+        self.adjacent = list(zip(*[self.neighbours[direction] for direction in AIM]))
+        # the text of each row and col number, for parsing orders
+        self.order_numbers = dict((str(number), number)
+                                  for number in range(max(self.height, self.width)))
+        self.passable = [True] * len(self.locs)
+        for row, col in map_data['water']:
+            self.passable[row * self.width + col] = False
+        self.init_free_squares()
+
+        # spatial index of the current ants used by nearby_ants
+        #   the map is split into square buckets and each bucket maps an
+        #   owner to that owner's ants in the bucket, keyed by location
+        #   empty buckets are removed so only occupied ones are visited
+        self.bucket_size = 2 * int(sqrt(max(self.attackradius, self.spawnradius))) + 1
+        self.bucket_cols = -(-self.width // self.bucket_size)
+        self.ant_buckets = {}
+        # cache used by nearby_ants() to determine the buckets to search
+        self.nearby_cache = {}
+
         # for new games
         # ants are ignored and 1 ant is created per hill
         # food is ignored
@@ -149,10 +263,15 @@ class Ants(Game):
         self.score = [len(map_data['hills'][0])]*self.num_players
         self.bonus = [0]*self.num_players
         self.score_history = [[s] for s in self.score]
+        self.update_score_bounds()
 
         # used to remember where the ants started
         self.initial_ant_list = sorted(self.current_ants.values(), key=operator.attrgetter('owner'))
-        self.initial_access_map = self.access_map()
+        if cached is None:
+            self.initial_access_map = self.access_map()
+        else:
+            self.initial_access_map = cached['access_map']
+            self.symmetry_cache = cached['symmetry']
 
         # cache used by neighbourhood_offsets() to determine nearby squares
         self.offsets_cache = {}
@@ -166,15 +285,128 @@ class Ants(Game):
         for i in range(self.num_players):
             self.switch[i][i] = 0
         # used to track water and land already reveal to player
-        self.revealed = [[[False for col in range(self.width)]
-                          for row in range(self.height)]
-                         for _ in range(self.num_players)]
+        if self.board == 'numpy':
+            self.revealed = [numpy.zeros((self.height, self.width), dtype=bool)
+                             for _ in range(self.num_players)]
+        else:
+            self.revealed = [[[False for col in range(self.width)]
+                              for row in range(self.height)]
+                             for _ in range(self.num_players)]
         # used to track what a player can see
         self.init_vision()
 
         # the engine may kill players before the game starts and this is needed to prevent errors
         self.orders = [[] for i in range(self.num_players)]
-        
+
+        if self.map_cache and cached is None:
+            self.save_map_cache(map_data)
+
+    def save_map_cache(self, map_data):
+        """ Compute the map symmetry and food sets and write the map cache
+
+            Food sets are found for every valid orientation since the one
+              used is chosen at random later.
+            No random numbers are drawn, so games play the same whether
+              or not they use the cache.
+        """
+        status, error, orientations, food_sets = 0, '', [], []
+        try:
+            orientations = self.get_map_symmetry()
+        except Exception as e:
+            if e.args[0] != "Invalid map":
+                # leave unexpected errors to be raised during the game
+                status = 2
+            else:
+                status, error = 1, e.args[1]
+        for orientation in orientations:
+            self.map_symmetry = orientation
+            food_sets.append((self.get_symmetric_food_sets(),
+                              self.get_symmetric_food_sets(True)))
+            del self.map_symmetry
+        if status != 2:
+            self.symmetry_cache = (orientations, error, food_sets)
+
+        def flat(locs):
+            return [row * self.width + col for row, col in locs]
+        arrays = [
+            [self.height, self.width, self.num_players],
+            mapcache.pack_lists([[owner] + flat(locs)
+                                 for owner, locs in map_data['hills'].items()]),
+            mapcache.pack_lists([[owner] + flat(locs)
+                                 for owner, locs in map_data['ants'].items()]),
+            flat(map_data['food']),
+            flat(map_data['water']),
+            mapcache.pack_lists([[player] + flat(locs)
+                                 for player, locs in self.initial_access_map.items()]),
+            [status],
+            [ord(c) for c in error]
+        ]
+        for orientation, (sets, visible_sets) in zip(orientations, food_sets):
+            arrays.append(self.pack_orientation(orientation))
+            arrays.append(mapcache.pack_lists([flat(s) for s in sets]))
+            arrays.append(mapcache.pack_lists([flat(s) for s in visible_sets]))
+        try:
+            mapcache.save(self.map_cache, self.map_cache_key, arrays)
+        except (IOError, OSError):
+            # the game can still be played, the cache is rebuilt next time
+            pass
+
+    def read_map_cache(self, arrays):
+        """ Rebuild the map data, access map, symmetry and food sets
+
+            Returns None if the arrays don't hold a complete cache
+        """
+        try:
+            height, width, num_players = arrays[0]
+            def locs(flat):
+                return [divmod(loc, width) for loc in flat]
+            def groups(flat):
+                result = defaultdict(list)
+                for values in mapcache.unpack_lists(flat):
+                    result[values[0]] = locs(values[1:])
+                return result
+
+            map_data = {
+                'size':        (height, width),
+                'num_players': num_players,
+                'hills':       groups(arrays[1]),
+                'ants':        groups(arrays[2]),
+                'food':        locs(arrays[3]),
+                'water':       locs(arrays[4])
+            }
+            access_map = groups(arrays[5])
+
+            status = arrays[6][0]
+            error = ''.join(chr(c) for c in arrays[7])
+            orientations, food_sets = [], []
+            for i in range(8, len(arrays), 3):
+                orientations.append(self.unpack_orientation(arrays[i], width))
+                food_sets.append(([locs(s) for s in mapcache.unpack_lists(arrays[i+1])],
+                                  [locs(s) for s in mapcache.unpack_lists(arrays[i+2])]))
+        except (IndexError, ValueError):
+            return None
+        return {
+            'map_data':   map_data,
+            'access_map': access_map,
+            'symmetry':   None if status == 2 else (orientations, error, food_sets)
+        }
+
+    def pack_orientation(self, orientation):
+        """ Flatten a map symmetry orientation into a list of ints """
+        return mapcache.pack_lists(
+            [[loc[0] * self.width + loc[1], aim]
+             + [i for item in enemy_map.items() for i in item]
+             for loc, aim, enemy_map in orientation])
+
+    def unpack_orientation(self, packed, width):
+        """ Reverse of pack_orientation """
+        orientation = []
+        for values in mapcache.unpack_lists(packed):
+            enemy_map = {}
+            for j in range(2, len(values), 2):
+                enemy_map[values[j]] = values[j+1]
+            orientation.append((divmod(values[0], width), values[1], enemy_map))
+        return orientation
 
     def distance(self, a_loc, b_loc):
         """ Returns distance between x and y squared """
@@ -327,12 +559,40 @@ class Ants(Game):
                 for r,c in locs
             )
             cache[d] = [list(p_locs), list(locs-p_locs), list(p_locs-locs)]
-        self.vision_offsets_cache = cache
 
         # create vision arrays
         self.vision = []
-        for _ in range(self.num_players):
-            self.vision.append([[0]*self.width for __ in range(self.height)])
+        # squares that each player has started to see since the last
+        #   call to update_revealed
+        self.newly_visible = [[] for _ in range(self.num_players)]
+        if self.board == 'numpy':
+            # the offsets are concatenated into one table and the cache
+            #   holds the index of each list in the table, so the
+            #   squares of all ants are found at once
+            lists = [(cache['new'], 1)]
+            cache['new'] = 0
+            for key in list(AIM) + ['-']:
+                groups = []
+                # only the squares gained by a move, at index 1, are added
+                for i, offsets in enumerate(cache[key]):
+                    groups.append(len(lists))
+                    lists.append((offsets, 1 if i == 1 else -1))
+                cache[key] = groups
+            lengths = numpy.array([len(offsets) for offsets, _ in lists], dtype=numpy.intp)
+            self.vision_offset_table = (
+                numpy.array([o[0] for offsets, _ in lists for o in offsets], dtype=numpy.intp),
+                numpy.array([o[1] for offsets, _ in lists for o in offsets], dtype=numpy.intp),
+                numpy.cumsum(lengths) - lengths,
+                lengths,
+                numpy.array([delta for _, delta in lists], dtype=numpy.int16))
+            # one array for all players, with a view of it for each player
+            self.vision_array = numpy.zeros((self.num_players, self.height, self.width),
+                                            dtype=numpy.int16)
+            self.vision = list(self.vision_array)
+        else:
+            for _ in range(self.num_players):
+                self.vision.append([[0]*self.width for __ in range(self.height)])
+        self.vision_offsets_cache = cache
 
         # initialise the data based on the initial ants
         self.update_vision()
@@ -340,32 +600,97 @@ class Ants(Game):
 
     def update_vision(self):
         """ Incrementally updates the vision data """
+        if self.board == 'numpy':
+            return self.update_vision_numpy()
         for ant in self.current_ants.values():
             if not ant.orders:
                 # new ant
                 self.update_vision_ant(ant, self.vision_offsets_cache['new'], 1)
             else:
-                order = ant.orders[-1]
+                order = ant.last_order()
                 if order in AIM:
                     # ant moved
                     self.update_vision_ant(ant, self.vision_offsets_cache[order][1], 1)
                     self.update_vision_ant(ant, self.vision_offsets_cache[order][-1], -1)
                 # else: ant stayed where it was
         for ant in self.killed_ants:
-            order = ant.orders[-1]
+            order = ant.last_order()
             self.update_vision_ant(ant, self.vision_offsets_cache[order][0], -1)
 
+    def update_vision_numpy(self):
+        """ Whole array version of update_vision for the numpy board
+
+            One index array of the squares whose count changes is built
+              for all the ants of the turn, and the counts of all the
+              players are updated with it at once.
+            Squares that go from unseen to seen are recorded in
+              self.newly_visible as flat indexes for update_revealed.
+        """
+        cache = self.vision_offsets_cache
+        entries = []
+        for ant in self.current_ants.values():
+            if not ant.orders:
+                # new ant
+                entries.append(ant.loc + (ant.owner, cache['new']))
+            else:
+                order = ant.last_order()
+                if order in AIM:
+                    # ant moved
+                    entries.append(ant.loc + (ant.owner, cache[order][1]))
+                    entries.append(ant.loc + (ant.owner, cache[order][-1]))
+                # else: ant stayed where it was
+        for ant in self.killed_ants:
+            entries.append(ant.loc + (ant.owner, cache[ant.last_order()][0]))
+        if not entries:
+            return
+
+        # flat index of each square in the vision of all players
+        rows, cols, owners, groups = numpy.array(entries, dtype=numpy.intp).T
+        offset_rows, offset_cols, starts, lengths, deltas = self.vision_offset_table
+        lengths = lengths[groups]
+        ends = numpy.cumsum(lengths)
+        offsets = numpy.arange(ends[-1]) + numpy.repeat(starts[groups] - (ends - lengths), lengths)
+        area = self.height * self.width
+        squares = (numpy.repeat(owners, lengths) * area
+                   + (numpy.repeat(rows, lengths) + offset_rows[offsets]) % self.height * self.width
+                   + (numpy.repeat(cols, lengths) + offset_cols[offsets]) % self.width)
+
+        vision = self.vision_array.reshape(-1)
+        old = vision[squares]
+        numpy.add.at(vision, squares, numpy.repeat(deltas[groups], lengths))
+        seen = squares[(old == 0) & (vision[squares] > 0)]
+        if not len(seen):
+            return
+        # unique squares are sorted, so each player's squares are together
+        seen = numpy.unique(seen)
+        bounds = numpy.searchsorted(seen, numpy.arange(self.num_players + 1) * area)
+        for player in range(self.num_players):
+            if bounds[player] < bounds[player + 1]:
+                self.newly_visible[player].append(
+                    seen[bounds[player]:bounds[player + 1]] - player * area)
+
     def update_vision_ant(self, ant, offsets, delta):
         """ Update the vision data for a single ant
 
             Increments all the given offsets by delta for the vision
               data for ant.owner
+            Squares that go from unseen to seen are recorded in
+              self.newly_visible for update_revealed
         """
         a_row, a_col = ant.loc
         vision = self.vision[ant.owner]
-        for v_row, v_col in offsets:
-            # offsets are such that there is never an IndexError
-            vision[a_row+v_row][a_col+v_col] += delta
+        if delta > 0:
+            newly_visible = self.newly_visible[ant.owner]
+            for v_row, v_col in offsets:
+                # offsets are such that there is never an IndexError
+                squares = vision[a_row+v_row]
+                if not squares[a_col+v_col]:
+                    newly_visible.append((a_row+v_row, a_col+v_col))
+                squares[a_col+v_col] += delta
+        else:
+            for v_row, v_col in offsets:
+                # offsets are such that there is never an IndexError
+                vision[a_row+v_row][a_col+v_col] += delta
 
     def update_revealed(self):
         """ Make updates to state based on what each player can see
@@ -373,35 +698,107 @@ class Ants(Game):
             Update self.revealed to reflect the updated vision
             Update self.switch for any new enemies
             Update self.revealed_water
+
+            Only squares recorded in self.newly_visible since the last
+              update can be visible but not yet revealed, so those are
+              the only squares checked.
         """
+        if self.board == 'numpy':
+            return self.update_revealed_numpy()
         self.revealed_water = []
         for player in range(self.num_players):
             water = []
+            vision = self.vision[player]
             revealed = self.revealed[player]
-            switch = self.switch[player]
 
-            for row, squares in enumerate(self.vision[player]):
-                for col, visible in enumerate(squares):
-                    if not visible:
-                        continue
+            # offsets may leave locations as negative indexes
+            squares = set((row % self.height, col % self.width)
+                          for row, col in self.newly_visible[player])
+            self.newly_visible[player] = []
+
+            # mark squares as revealed and determine if we see any
+            #   new water, in the same row by row order as the map
+            for row, col in sorted(squares):
+                if vision[row][col] and not revealed[row][col]:
+                    revealed[row][col] = True
+                    if self.map[row][col] == WATER:
+                        water.append((row,col))
 
-                    value = self.map[row][col]
+            self.update_switch(player)
 
-                    # if this player encounters a new enemy then
-                    #   assign the enemy the next index
-                    if value >= ANTS and switch[value] is None:
-                        switch[value] = self.num_players - switch.count(None)
+            # update the water which was revealed this turn
+            self.revealed_water.append(water)
+
+    def update_revealed_numpy(self):
+        """ Whole array version of update_revealed for the numpy board """
+        self.revealed_water = []
+        # flat locations and owners of all ants, for update_switch_numpy
+        ants = None
+        for player in range(self.num_players):
+            vision = self.vision[player]
+            revealed = self.revealed[player]
 
-                    # mark square as revealed and determine if we see any
-                    #   new water
-                    if not revealed[row][col]:
-                        revealed[row][col] = True
-                        if value == WATER:
-                            water.append((row,col))
+            # unique flat indexes are sorted in the same row by row order as the map
+            water = []
+            if self.newly_visible[player]:
+                squares = self.newly_visible[player]
+                if len(squares) == 1:
+                    squares = squares[0]
+                else:
+                    squares = numpy.unique(numpy.concatenate(squares))
+                rows, cols = numpy.divmod(squares, self.width)
+                new_squares = (vision[rows, cols] > 0) & ~revealed[rows, cols]
+                rows, cols = rows[new_squares], cols[new_squares]
+                revealed[rows, cols] = True
+                is_water = self.map[rows, cols] == WATER
+                water = list(zip(rows[is_water].tolist(), cols[is_water].tolist()))
+            self.newly_visible[player] = []
+
+            if None in self.switch[player]:
+                if ants is None:
+                    ants = numpy.array([(row * self.width + col, ant.owner)
+                                        for (row, col), ant in self.current_ants.items()],
+                                       dtype=numpy.intp).reshape(-1, 2).T
+                self.update_switch_numpy(player, ants[0], ants[1])
 
             # update the water which was revealed this turn
             self.revealed_water.append(water)
 
+    def update_switch_numpy(self, player, squares, owners):
+        """ Whole array version of update_switch for the numpy board
+
+            squares and owners are the flat locations and the owners
+              of all the ants.
+        """
+        switch = self.switch[player]
+        unnumbered = numpy.array([number is None for number in switch])
+        visible = unnumbered[owners] & (self.vision_array[player].reshape(-1)[squares] > 0)
+        first_seen = {}
+        for square, owner in zip(squares[visible].tolist(), owners[visible].tolist()):
+            if owner not in first_seen or square < first_seen[owner]:
+                first_seen[owner] = square
+        for owner in sorted(first_seen, key=first_seen.get):
+            switch[owner] = self.num_players - switch.count(None)
+
+    def update_switch(self, player):
+        """ Assign player numbers to enemies that are seen for the first time
+
+            Enemies are numbered in the order they are first found when
+              scanning the visible squares row by row.
+        """
+        switch = self.switch[player]
+        if None not in switch:
+            return
+        vision = self.vision[player]
+        first_seen = {}
+        for loc, ant in self.current_ants.items():
+            owner = ant.owner
+            if switch[owner] is None and vision[loc[0]][loc[1]]:
+                if owner not in first_seen or loc < first_seen[owner]:
+                    first_seen[owner] = loc
+        for owner in sorted(first_seen, key=first_seen.get):
+            switch[owner] = self.num_players - switch.count(None)
+
     def get_perspective(self, player=None):
         """ Get the map from the perspective of the given player
 
@@ -411,6 +808,8 @@ class Ants(Game):
             Enemy identifiers are changed to reflect the order in
                which the player first saw them.
         """
+        if self.board == 'numpy':
+            return self.perspective_array(player).tolist()
         if player is not None:
             v = self.vision[player]
         result = []
@@ -432,6 +831,18 @@ class Ants(Game):
             result.append(map_row)
         return result
 
+    def perspective_array(self, player=None):
+        """ Whole array version of get_perspective for the numpy board """
+        result = self.map.copy()
+        if self.hills:
+            rows, cols = zip(*self.hills)
+            squares = result[rows, cols]
+            # assume ant is hill owner
+            result[rows, cols] = numpy.where(squares >= ANTS, squares + 10, squares + 20)
+        if player is not None:
+            result[self.vision[player] == 0] = UNSEEN
+        return result
+
     def render_changes(self, player):
         """ Create a string which communicates the updates to the state
 
@@ -453,16 +864,16 @@ class Ants(Game):
             # only include updates to squares which are visible
             # and the current players dead ants
             if v[row][col] or (ilk == 'd' and update[-1] == player):
-                visible_updates.append(update)
-
                 # switch player perspective of player numbers
+                #   the shared updates are copied rather than changed
                 if ilk in ['a', 'd', 'h']:
                     # an ant can appear in a bots vision and die the same turn
                     # in this case the ant has not been assigned a number yet
                     #   assign the enemy the next index
                     if self.switch[player][update[-1]] is None:
                         self.switch[player][update[-1]] = self.num_players - self.switch[player].count(None)
-                    update[-1] = self.switch[player][update[-1]]
+                    update = update[:-1] + (self.switch[player][update[-1]],)
+                visible_updates.append(update)
 
         visible_updates.append([]) # newline
         return '\n'.join(' '.join(map(str,s)) for s in visible_updates)
@@ -472,32 +883,37 @@ class Ants(Game):
 
             Food, living ants, ants killed this turn
             Changes are sorted so that the same state will result in the same output
+            Each change is a tuple and the list is built once and shared
+              until the map changes, so callers must not modify it
         """
+        if self.state_changes is not None:
+            return self.state_changes
         changes = []
 
         # hills not razed
         changes.extend(sorted(
-            [['h', hill.loc[0], hill.loc[1], hill.owner]
+            [('h', hill.loc[0], hill.loc[1], hill.owner)
              for _, hill in self.hills.items()
              if hill.killed_by is None]
         ))
 
         # current ants
         changes.extend(sorted(
-            ['a', ant.loc[0], ant.loc[1], ant.owner]
+            ('a', ant.loc[0], ant.loc[1], ant.owner)
             for ant in self.current_ants.values()
         ))
         # current food
         changes.extend(sorted(
-            ['f', row, col]
+            ('f', row, col)
             for row, col in self.current_food
         ))
         # ants killed this turn
         changes.extend(sorted(
-            ['d', ant.loc[0], ant.loc[1], ant.owner]
+            ('d', ant.loc[0], ant.loc[1], ant.owner)
             for ant in self.killed_ants
         ))
 
+        self.state_changes = changes
         return changes
 
     def get_map_output(self, player=None):
@@ -506,6 +922,10 @@ class Ants(Game):
             If player is None, then no squares are hidden and player ids
               are not reordered.
         """
+        if self.board == 'numpy':
+            chars = MAP_RENDER_ARRAY[self.perspective_array(player) % len(MAP_RENDER)]
+            text = str(chars.tobytes().decode('ascii'))
+            return [text[i:i+self.width] for i in range(0, len(text), self.width)]
         result = []
         for row in self.get_perspective(player):
             result.append(''.join([MAP_RENDER[col] for col in row]))
@@ -516,28 +936,111 @@ class Ants(Game):
 
             If exclude is not None, ants with owner == exclude
               will be ignored.
+            Only the occupied buckets of the spatial index that overlap
+              the neighbourhood of loc are searched.
         """
-        ants = []
+        if max_dist not in self.nearby_cache:
+            self.nearby_cache[max_dist] = self.nearby_buckets(max_dist)
+        row_buckets, col_buckets, offsets = self.nearby_cache[max_dist]
         row, col = loc
-        for d_row, d_col in self.neighbourhood_offsets(max_dist):
-            if ANTS <= self.map[row+d_row][col+d_col] != exclude:
-                n_loc = self.destination(loc, (d_row, d_col))
-                ants.append(self.current_ants[n_loc])
+        height, width = self.height, self.width
+        ants = []
+        for b_row in row_buckets[row]:
+            for b_col in col_buckets[col]:
+                owners = self.ant_buckets.get(b_row + b_col)
+                if owners is None:
+                    continue
+                for owner, bucket in owners.items():
+                    if owner == exclude:
+                        continue
+                    for (n_row, n_col), ant in bucket.items():
+                        # an offset repeats when the map is smaller than
+                        #   the neighbourhood, so the ant is repeated too
+                        count = offsets.get(((n_row - row) % height, (n_col - col) % width))
+                        if count:
+                            ants.extend([ant] * count)
         return ants
 
+    def nearby_buckets(self, max_dist):
+        """ Calculate the buckets and offsets searched by nearby_ants
+
+            Returns the bucket keys for the rows near each row, the bucket
+              keys for the cols near each col and a count of each offset
+              returned by neighbourhood_offsets (normalized to be positive).
+        """
+        mx = int(sqrt(max_dist))
+        size = self.bucket_size
+        row_buckets = [sorted(set(((row + d) % self.height) // size * self.bucket_cols
+                                  for d in range(-mx, mx+1)))
+                       for row in range(self.height)]
+        col_buckets = [sorted(set(((col + d) % self.width) // size
+                                  for d in range(-mx, mx+1)))
+                       for col in range(self.width)]
+        offsets = defaultdict(int)
+        for d_row, d_col in self.neighbourhood_offsets(max_dist):
+            offsets[(d_row % self.height, d_col % self.width)] += 1
+        return row_buckets, col_buckets, dict(offsets)
+
+    def index_ant(self, ant):
+        """ Add an ant to the spatial index and its owner's ants """
+        self.owner_ants[ant.owner][ant.loc] = ant
+        row, col = ant.loc
+        key = row // self.bucket_size * self.bucket_cols + col // self.bucket_size
+        owners = self.ant_buckets.setdefault(key, {})
+        owners.setdefault(ant.owner, {})[ant.loc] = ant
+
+    def unindex_ant(self, ant):
+        """ Remove an ant from the spatial index and its owner's ants """
+        del self.owner_ants[ant.owner][ant.loc]
+        row, col = ant.loc
+        key = row // self.bucket_size * self.bucket_cols + col // self.bucket_size
+        owners = self.ant_buckets[key]
+        bucket = owners[ant.owner]
+        del bucket[ant.loc]
+        if not bucket:
+            del owners[ant.owner]
+            if not owners:
+                del self.ant_buckets[key]
+
     def parse_orders(self, player, lines):
         """ Parse orders from the given player
 
             Orders must be of the form: o row col direction
             row, col must be integers
             direction must be in (n,s,e,w)
+
+            Batches where every line is in the usual form are checked with
+              one regular expression and split into tokens all at once,
+              other batches are parsed by line.
         """
+        text = '\n'.join(lines)
+        if text.count('\n') == len(lines) - 1 and ORDER_BATCH.match(text + '\n'):
+            tokens = text.split()
+            rows = tokens[1::4]
+            cols = tokens[2::4]
+            try:
+                rows = list(map(self.order_numbers.__getitem__, rows))
+                cols = list(map(self.order_numbers.__getitem__, cols))
+            except KeyError:
+                # numbers past the edge of the map or with leading zeros
+                rows = list(map(int, rows))
+                cols = list(map(int, cols))
+            orders = list(zip(zip(rows, cols), tokens[3::4]))
+            return orders, list(lines), [], []
+
         orders = []
         valid = []
         ignored = []
         invalid = []
 
         for line in lines:
+            match = ORDER_LINE.match(line)
+            if match:
+                row, col, direction = match.groups()
+                orders.append(((int(row), int(col)), direction))
+                valid.append(line)
+                continue
+
             line = line.strip().lower()
             # ignore blank lines and comments
             if not line or line[0] == '#':
@@ -582,23 +1085,34 @@ class Ants(Game):
         valid = []
         valid_orders = []
         seen_locations = set()
+        game_map = self.map
+        height = self.height
+        width = self.width
+        locs = self.locs
+        neighbours = self.neighbours
         for line, (loc, direction) in zip(lines, orders):
             # validate orders
             if loc in seen_locations:
                 invalid.append((line,'duplicate order'))
                 continue
-            try:
-                if self.map[loc[0]][loc[1]] != player:
+            row, col = loc
+            if 0 <= row < height and 0 <= col < width:
+                if game_map[row][col] != player:
                     invalid.append((line,'not player ant'))
                     continue
-            except IndexError:
-                invalid.append((line,'out of bounds'))
-                continue
-            if loc[0] < 0 or loc[1] < 0:
+            else:
+                # negative rows and cols index from the end of the map,
+                #   so they may still find an ant of another player
+                try:
+                    if game_map[row][col] != player:
+                        invalid.append((line,'not player ant'))
+                        continue
+                except IndexError:
+                    pass
                 invalid.append((line,'out of bounds'))
                 continue
-            dest = self.destination(loc, AIM[direction])
-            if self.map[dest[0]][dest[1]] in (FOOD, WATER):
+            dest_row, dest_col = locs[neighbours[direction][row * width + col]]
+            if game_map[dest_row][dest_col] in (FOOD, WATER):
                 ignored.append((line,'move blocked'))
                 continue
 
@@ -618,7 +1132,7 @@ class Ants(Game):
         # set old ant locations to land
         for ant in self.current_ants.values():
             row, col = ant.loc
-            self.map[row][col] = LAND
+            self.set_square(row, col, LAND)
 
         # determine the direction that each ant moves
         #  (holding any ants that don't have orders)
@@ -633,12 +1147,16 @@ class Ants(Game):
         # move all the ants
         next_loc = defaultdict(list)
         for ant, direction in move_direction.items():
-            ant.loc = self.destination(ant.loc, AIM.get(direction, (0,0)))
-            ant.orders.append(direction)
+            if direction in self.neighbours:
+                row, col = ant.loc
+                ant.loc = self.locs[self.neighbours[direction][row * self.width + col]]
+            ant.add_order(direction)
             next_loc[ant.loc].append(ant)
 
         # if ant is sole occupant of a new square then it survives
         self.current_ants = {}
+        self.ant_buckets = {}
+        self.owner_ants = [{} for _ in range(self.num_players)]
         colliding_ants = []
         for loc, ants in next_loc.items():
             if len(ants) == 1:
@@ -651,7 +1169,9 @@ class Ants(Game):
         # set new ant locations
         for ant in self.current_ants.values():
             row, col = ant.loc
-            self.map[row][col] = ant.owner
+            self.set_square(row, col, ant.owner)
+            self.index_ant(ant)
+        self.state_changes = None
 
     def do_gather(self):
         """ Gather food
@@ -698,6 +1218,45 @@ class Ants(Game):
                     self.hive_food[player] -= 1
                     self.add_ant(hill)
 
+    def init_free_squares(self):
+        """ Build the index of free land from the map
+
+            free_squares holds the flat location of every square of land
+              with nothing on it, in no particular order, so a random one
+              can be picked in constant time.
+            free_position maps a flat location to its index in free_squares,
+              or -1 if the square is not free.
+        """
+        self.free_squares = []
+        self.free_position = [-1] * (self.height * self.width)
+        for loc, (row, col) in enumerate(self.locs):
+            if self.map[row][col] == LAND:
+                self.free_position[loc] = len(self.free_squares)
+                self.free_squares.append(loc)
+
+    def set_square(self, row, col, value):
+        """ Set a square of the map and update the index of free land
+
+            Pending food at a square that becomes free is queued to be
+              checked by place_food.
+        """
+        self.map[row][col] = value
+        loc = row * self.width + col
+        position = self.free_position[loc]
+        if value == LAND:
+            if position < 0:
+                self.free_position[loc] = len(self.free_squares)
+                self.free_squares.append(loc)
+                if self.pending_food and (row, col) in self.pending_food:
+                    self.pending_ready.add((row, col))
+        elif position >= 0:
+            # move the last free square into the removed one's place
+            last = self.free_squares.pop()
+            if last != loc:
+                self.free_squares[position] = last
+                self.free_position[last] = position
+            self.free_position[loc] = -1
+
     def add_food(self, loc):
         """ Add food to a location
 
@@ -706,10 +1265,11 @@ class Ants(Game):
         if self.map[loc[0]][loc[1]] != LAND:
             raise Exception("Add food error",
                             "Food already found at %s" %(loc,))
-        self.map[loc[0]][loc[1]] = FOOD
+        self.set_square(loc[0], loc[1], FOOD)
         food = Food(loc, self.turn)
         self.current_food[loc] = food
         self.all_food.append(food)
+        self.state_changes = None
         return food
 
     def remove_food(self, loc, owner=None):
@@ -718,11 +1278,12 @@ class Ants(Game):
             An error is raised if no food exists there.
         """
         try:
-            self.map[loc[0]][loc[1]] = LAND
+            self.set_square(loc[0], loc[1], LAND)
             self.current_food[loc].end_turn = self.turn
             if owner is not None:
                 self.current_food[loc].owner = owner
                 self.hive_food[owner] += 1
+            self.state_changes = None
             return self.current_food.pop(loc)
         except KeyError:
             raise Exception("Remove food error",
@@ -731,15 +1292,20 @@ class Ants(Game):
     def add_hill(self, loc, owner):
         hill = Hill(loc, owner)
         self.hills[loc] = hill
+        self.hill_count[owner] += 1
+        self.state_changes = None
         return hill
 
     def raze_hill(self, hill, killed_by):
         hill.end_turn = self.turn
         hill.killed_by = killed_by
+        self.state_changes = None
+        self.hill_count[hill.owner] -= 1
         self.score[killed_by] += HILL_POINTS
         if not hill.raze_points:
             hill.raze_points = True
             self.score[hill.owner] += RAZE_POINTS
+        self.update_score_bounds()
         # reset cutoff_turns
         self.cutoff_turns = 0
 
@@ -755,18 +1321,22 @@ class Ants(Game):
         owner = hill.owner
         ant = Ant(loc, owner, self.turn)
         row, col = loc
-        self.map[row][col] = owner
+        self.set_square(row, col, owner)
         self.all_ants.append(ant)
         self.current_ants[loc] = ant
+        self.index_ant(ant)
+        self.state_changes = None
         hill.last_touched = self.turn
         return ant
 
     def add_initial_ant(self, loc, owner):
         ant = Ant(loc, owner, self.turn)
         row, col = loc
-        self.map[row][col] = owner
+        self.set_square(row, col, owner)
         self.all_ants.append(ant)
         self.current_ants[loc] = ant
+        self.index_ant(ant)
+        self.state_changes = None
         return ant
     
     def kill_ant(self, ant, ignore_error=False):
@@ -777,11 +1347,14 @@ class Ants(Game):
         """
         try:
             loc = ant.loc
-            self.map[loc[0]][loc[1]] = LAND
+            self.set_square(loc[0], loc[1], LAND)
             self.killed_ants.append(ant)
             ant.killed = True
             ant.die_turn = self.turn
-            return self.current_ants.pop(loc)
+            self.state_changes = None
+            ant = self.current_ants.pop(loc)
+            self.unindex_ant(ant)
+            return ant
         except KeyError:
             if not ignore_error:
                 raise Exception("Kill ant error",
@@ -789,7 +1362,7 @@ class Ants(Game):
 
     def player_ants(self, player):
         """ Return the current ants belonging to the given player """
-        return [ant for ant in self.current_ants.values() if player == ant.owner]
+        return list(self.owner_ants[player].values())
 
     def do_raze_hills(self):
         for loc, hill in self.hills.items():
@@ -818,7 +1391,7 @@ class Ants(Game):
             if enemies:
                 nearby_enemies[ant] = enemies
                 strenth = 10 # dot dot dot
-                if ant.orders[-1] == '-':
+                if ant.last_order() == '-':
                     strenth = 10
                 else:
                     strenth = 10
@@ -890,91 +1463,239 @@ class Ants(Game):
         for ant in ants_to_kill:
             self.kill_ant(ant)
 
+    def do_attack_focus_batch(self):
+        """ Kill ants which are the most surrounded by enemies
+
+            Same rule as do_attack_focus, resolved for all ants at once.
+            The square of every ant is looked up at each offset of the
+              attack radius, giving a table of the ants near each ant,
+              so the work grows with the number of ants, not the map.
+            An ant's weakness is the number of enemies in its row, and
+              its most focused enemy is the least weak of them.
+            It is chosen with the focus_batch attack option, and is faster
+              than do_attack_focus when many ants are fighting, but
+              slower when there are few ants.
+        """
+        ants = list(self.current_ants.values())
+        if not ants:
+            return
+        rows = numpy.array([ant.loc[0] for ant in ants], dtype=numpy.intp)
+        cols = numpy.array([ant.loc[1] for ant in ants], dtype=numpy.intp)
+        owners = numpy.array([ant.owner for ant in ants], dtype=numpy.intp)
+        if self.attackradius not in self.nearby_cache:
+            self.nearby_cache[self.attackradius] = self.nearby_buckets(self.attackradius)
+        # offsets are counted so tiny maps see repeated ants like nearby_ants
+        kernel = self.nearby_cache[self.attackradius][2]
+        d_rows = numpy.array([offset[0] for offset in kernel], dtype=numpy.intp)
+        d_cols = numpy.array([offset[1] for offset in kernel], dtype=numpy.intp)
+        counts = numpy.array(list(kernel.values()), dtype=numpy.intp)
+
+        # index of the ant on each square, -1 for none
+        ant_at = numpy.empty(self.height * self.width, dtype=numpy.intp)
+        ant_at.fill(-1)
+        ant_at[rows * self.width + cols] = numpy.arange(len(ants))
+        # the ant at each offset of each ant
+        near = ant_at[((rows[:, None] + d_rows) % self.height) * self.width
+                      + (cols[:, None] + d_cols) % self.width]
+        enemy = (near >= 0) & (owners[near] != owners[:, None])
+        weakness = (enemy * counts).sum(axis=1)
+
+        # find the most focused nearby enemy
+        no_ant = numpy.iinfo(numpy.intp).max
+        min_enemy_weakness = numpy.where(enemy, weakness[near], no_ant).min(axis=1)
+
+        # ant dies if it is weak as or weaker than an enemy weakness
+        #   ants with no enemies nearby can't be attacked
+        ants_to_kill = (weakness > 0) & (min_enemy_weakness <= weakness)
+        for ant, killed in zip(ants, ants_to_kill.tolist()):
+            if killed:
+                self.kill_ant(ant)
+
     def do_attack_closest(self):
-        """ Iteratively kill neighboring groups of ants """
-        # maps ants to nearby enemies by distance
-        ants_by_distance = {}
+        """ Iteratively kill neighboring groups of ants
+
+            For each distance, starting with the closest, ants are grouped
+              with the living enemies at exactly that distance and every
+              group of more than 1 ant is killed.
+            An ant is in such a group when it has a living enemy at that
+              distance, so the groups are found by marking both ants of
+              each pair at the distance, without searching the groups.
+        """
+        # pairs of enemies in range by distance, each pair is found once
+        pairs_by_distance = defaultdict(list)
         for ant in self.current_ants.values():
-            # pre-compute distance to each enemy in range
-            dist_map = defaultdict(list)
             for enemy in self.nearby_ants(ant.loc, self.attackradius, ant.owner):
-                dist_map[self.distance(ant.loc, enemy.loc)].append(enemy)
-            ants_by_distance[ant] = dist_map
-
-        # create helper method to find ant groups
-        ant_group = set()
-        def find_enemy(ant, distance):
-            """ Recursively finds a group of ants to eliminate each other """
-            # we only need to check ants at the given distance, because closer
-            #   ants would have been eliminated already
-            for enemy in ants_by_distance[ant][distance]:
-                if not enemy.killed and enemy not in ant_group:
-                    ant_group.add(enemy)
-                    find_enemy(enemy, distance)
+                if ant.loc < enemy.loc:
+                    pairs_by_distance[self.distance(ant.loc, enemy.loc)].append((ant, enemy))
 
         # setup done - start the killing
         for distance in range(1, self.attackradius):
-            for ant in self.current_ants.values():
-                if not ants_by_distance[ant] or ant.killed:
+            # find all the groups before killing, closer ants were
+            #   killed by earlier distances
+            group = []
+            grouped = set()
+            for pair in pairs_by_distance[distance]:
+                if pair[0].killed or pair[1].killed:
                     continue
-
-                ant_group = set([ant])
-                find_enemy(ant, distance)
-
-                # kill all ants in groups with more than 1 ant
-                #  this way of killing is order-independent because the
-                #  the ant group is the same regardless of which ant
-                #  you start looking at
-                if len(ant_group) > 1:
-                    for ant in ant_group:
-                        self.kill_ant(ant)
+                for ant in pair:
+                    if ant not in grouped:
+                        grouped.add(ant)
+                        group.append(ant)
+            for ant in group:
+                self.kill_ant(ant)
 
     def destination(self, loc, d):
         """ Returns the location produced by offsetting loc by d """
         return ((loc[0] + d[0]) % self.height, (loc[1] + d[1]) % self.width)
 
-    def access_map(self):
-        """ Determine the list of locations that each player is closest to """
-        distances = {}
-        players = defaultdict(set)
+    def flood(self, sources, masks=None, water=False, radius2=None,
+              visited=None, stop=None):
+        """ Breadth first search over flat square numbers
+
+            sources are the squares at distance 0
+            masks gives a player bitmask for each source, a square reached
+              at the same distance from more than one square combines them
+            water allows water squares to be entered
+            radius2 limits squares to within that distance squared of the
+              source they were reached from
+            visited marks squares that are not entered, such as squares
+              found by an earlier flood, and is updated with the squares found
+            stop is a test for each square found after the sources,
+              the search ends at the first square that passes it
+
+            Returns the squares in the order found, the distance to each
+              square and the bitmask of each square (None without masks)
+        """
+        distances = [None] * len(self.locs)
+        square_masks = None if masks is None else [0] * len(self.locs)
+        origins = None if radius2 is None else [None] * len(self.locs)
+        order = []
         square_queue = deque()
+        for i, loc in enumerate(sources):
+            distances[loc] = 0
+            if masks is not None:
+                square_masks[loc] = masks[i]
+            if origins is not None:
+                origins[loc] = loc
+            if visited is not None:
+                visited[loc] = True
+            order.append(loc)
+            square_queue.append(loc)
 
-        # determine the starting squares and valid squares
-        # (where food can be placed)
-        for row, squares in enumerate(self.map):
-            for col, square in enumerate(squares):
-                loc = (row, col)
-                if square >= 0:
-                    distances[loc] = 0
-                    players[loc].add(square)
-                    square_queue.append(loc)
-                elif square != WATER:
-                    distances[loc] = None
-
-        # use bfs to determine who can reach each square first
         while square_queue:
             c_loc = square_queue.popleft()
-            for d in AIM.values():
-                n_loc = self.destination(c_loc, d)
-                if n_loc not in distances: continue # wall
-
+            n_distance = distances[c_loc] + 1
+            for n_loc in self.adjacent[c_loc]:
                 if distances[n_loc] is None:
+                    if not (water or self.passable[n_loc]):
+                        continue
+                    if visited is not None and visited[n_loc]:
+                        continue
+                    if origins is not None:
+                        origin = origins[c_loc]
+                        if self.distance(self.locs[origin], self.locs[n_loc]) > radius2:
+                            continue
+                        origins[n_loc] = origin
                     # first visit to this square
-                    distances[n_loc] = distances[c_loc] + 1
-                    players[n_loc].update(players[c_loc])
+                    distances[n_loc] = n_distance
+                    if masks is not None:
+                        square_masks[n_loc] = square_masks[c_loc]
+                    if visited is not None:
+                        visited[n_loc] = True
+                    order.append(n_loc)
+                    if stop is not None and stop(n_loc):
+                        return order, distances, square_masks
                     square_queue.append(n_loc)
-                elif distances[n_loc] == distances[c_loc] + 1:
+                elif masks is not None and distances[n_loc] == n_distance:
                     # we've seen this square before, but the distance is
                     # the same - therefore combine the players that can
                     # reach this square
-                    players[n_loc].update(players[c_loc])
+                    square_masks[n_loc] |= square_masks[c_loc]
+        return order, distances, square_masks
+
+    def access_map(self):
+        """ Determine the list of locations that each player is closest to """
+        if self.board == 'numpy':
+            return self.access_map_numpy()
+        # the players that reach a square first are kept as a bitmask
+        sources = []
+        masks = []
+        for row, squares in enumerate(self.map):
+            for col, square in enumerate(squares):
+                if square >= 0:
+                    sources.append(row * self.width + col)
+                    masks.append(1 << square)
+        visit_order, _, players = self.flood(sources, masks)
 
         # summarise the final results of the squares that are closest
         # to a single unique player
+        # (keys are inserted in visit order so the dict iterates in the
+        #  same order as one built during the bfs)
+        owners = {}
+        for loc in visit_order:
+            owners[self.locs[loc]] = players[loc]
         access_map = defaultdict(list)
-        for coord, player_set in players.items():
-            if len(player_set) != 1: continue
-            access_map[player_set.pop()].append(coord)
+        for coord, mask in owners.items():
+            if mask & (mask - 1): continue
+            access_map[mask.bit_length() - 1].append(coord)
+
+        return access_map
+
+    def access_map_numpy(self):
+        """ Whole array version of access_map for the numpy board
+
+            The bfs is run one distance at a time over the flattened map,
+              with the players that reach a square kept as a bitmask.
+            Squares are visited in the same order as access_map so the
+              resulting lists are identical.
+        """
+        squares = self.map.ravel()
+        passable = squares != WATER
+        distances = numpy.empty(squares.shape, dtype=numpy.int32)
+        distances.fill(-1)
+        players = numpy.zeros(squares.shape, dtype=numpy.int16)
+
+        # determine the starting squares
+        frontier = numpy.flatnonzero(squares >= 0)
+        distances[frontier] = 0
+        players[frontier] = numpy.left_shift(1, squares[frontier].astype(numpy.int16))
+        visit_order = [frontier]
+
+        # use bfs to determine who can reach each square first
+        directions = list(AIM.values())
+        distance = 0
+        while len(frontier):
+            f_rows, f_cols = numpy.divmod(frontier, self.width)
+            neighbours = numpy.empty((len(frontier), len(directions)), dtype=numpy.intp)
+            for i, (d_row, d_col) in enumerate(directions):
+                neighbours[:, i] = (((f_rows + d_row) % self.height) * self.width
+                                    + (f_cols + d_col) % self.width)
+            neighbours = neighbours.ravel()
+            sources = numpy.repeat(frontier, len(directions))
+
+            # squares reached for the first time, in the order they are found
+            unseen = neighbours[passable[neighbours] & (distances[neighbours] < 0)]
+            unseen, first = numpy.unique(unseen, return_index=True)
+            frontier = unseen[numpy.argsort(first)]
+            distance += 1
+            distances[frontier] = distance
+
+            # combine the players of every square one step closer
+            closer = distances[neighbours] == distance
+            numpy.bitwise_or.at(players, neighbours[closer], players[sources[closer]])
+            visit_order.append(frontier)
+
+        # summarise the final results of the squares that are closest
+        # to a single unique player
+        # (keys are inserted in visit order to match the dict in access_map)
+        visit_order = numpy.concatenate(visit_order)
+        owners = {}
+        for loc, mask in zip(visit_order.tolist(), players[visit_order].tolist()):
+            owners[divmod(loc, self.width)] = mask
+        access_map = defaultdict(list)
+        for coord, mask in owners.items():
+            if mask & (mask - 1): continue
+            access_map[mask.bit_length() - 1].append(coord)
 
         return access_map
 
@@ -986,22 +1707,15 @@ class Ants(Game):
         if self.map[coord[0]][coord[1]] == LAND:
             return coord
 
-        visited = set()
-        square_queue = deque([coord])
-
-        while square_queue:
-            c_loc = square_queue.popleft()
-
-            for d in AIM.values():
-                n_loc = self.destination(c_loc, d)
-                if n_loc in visited: continue
-
-                if self.map[n_loc[0]][n_loc[1]] == LAND:
-                    return n_loc
-
-                visited.add(n_loc)
-                square_queue.append(n_loc)
+        def is_land(loc):
+            row, col = self.locs[loc]
+            return self.map[row][col] == LAND
 
+        # the search may cross water to reach land
+        order, _, _ = self.flood([coord[0] * self.width + coord[1]],
+                                 water=True, stop=is_land)
+        if is_land(order[-1]):
+            return self.locs[order[-1]]
         return None
 
     def do_food_none(self, amount=0):
@@ -1009,14 +1723,23 @@ class Ants(Game):
         return amount
 
     def do_food_random(self, amount=1):
-        """ Place food randomly on the map """
+        """ Place food randomly on the map
+
+            Each food is put on a random free square of land.  Random
+              squares are drawn until one is land, or with food_index
+              one is drawn from the index of free land.
+        """
         for _ in range(amount):
-            while True:
-                row = randrange(self.height)
-                col = randrange(self.width)
-                if self.map[row][col] == LAND:
-                    self.pending_food[(row, col)] += 1
-                    break
+            if not self.food_index:
+                while True:
+                    row = randrange(self.height)
+                    col = randrange(self.width)
+                    if self.map[row][col] == LAND:
+                        self.queue_food((row, col))
+                        break
+            elif self.free_squares:
+                loc = self.free_squares[randrange(len(self.free_squares))]
+                self.queue_food(self.locs[loc])
         self.place_food()
         return 0
 
@@ -1038,7 +1761,7 @@ class Ants(Game):
                 col = (ant.loc[1]+dc)%self.width
                 coord = self.find_closest_land((row, col))
                 if coord:
-                    self.pending_food[coord] += 1
+                    self.queue_food(coord)
         self.place_food()
         return left_over
 
@@ -1055,7 +1778,7 @@ class Ants(Game):
                 squares = self.initial_access_map[p]
                 row, col = choice(squares)
                 if self.map[row][col] == LAND:
-                    self.pending_food[(row, col)] += 1
+                    self.queue_food((row, col))
         self.place_food()
         return left_over
 
@@ -1086,7 +1809,7 @@ class Ants(Game):
                 amount -= len(s)
                 self.food_sets_visible.appendleft(s)
                 for loc in s:
-                    self.pending_food[loc] += 1
+                    self.queue_food(loc)
 
 
     def do_food_symmetric(self, amount=1):
@@ -1121,12 +1844,26 @@ class Ants(Game):
                 amount -= len(s)
                 self.food_sets.appendleft(s)
                 for loc in s:
-                    self.pending_food[loc] += 1
+                    self.queue_food(loc)
+
+    def queue_food(self, loc):
+        """ Schedule food to be placed at a location once it is free """
+        self.pending_food[loc] += 1
+        self.pending_ready.add(loc)
 
     def place_food(self):
         """ Place food in scheduled locations if they are free
+
+            Only the locations queued or freed since the last call can
+              have become free, so only they are checked, but in the
+              order of pending_food so food is placed in the same order
+              as checking every location.
         """
-        for loc in list(self.pending_food.keys()):
+        if not self.pending_ready:
+            return
+        ready = self.pending_ready
+        self.pending_ready = set()
+        for loc in [loc for loc in self.pending_food if loc in ready]:
             if self.map[loc[0]][loc[1]] == LAND:
                 self.add_food(loc)
                 self.pending_food[loc] -= 1
@@ -1182,9 +1919,111 @@ class Ants(Game):
                     enemy_map[ilk0] = ilk1
         return enemy_map
 
+    def symmetry_views(self):
+        """ Build the views of the map used to compare orientations
+
+            Squares are classed from each player's point of view, 0 for
+              the player's ants, 1 for enemy ants and the map value for
+              everything else, so two views match exactly when
+              map_similar would find the orientation similar.
+            Each row and column also gets a fingerprint which does not
+              change when the line is shifted or reversed, so most
+              orientations can be rejected without comparing squares.
+
+            Returns the ant squares and, for each player, the rows,
+              columns, row fingerprints and column fingerprints.
+        """
+        grid = self.map.tolist() if self.board == 'numpy' else self.map
+        base = [[1 if square >= 0 else square for square in squares]
+                for squares in grid]
+        ants = []
+        owners = defaultdict(list)
+        for row, squares in enumerate(grid):
+            if max(squares) >= 0:
+                for col, square in enumerate(squares):
+                    if square >= 0:
+                        ants.append((row, col))
+                        owners[square].append((row, col))
+
+        views = []
+        for player in range(self.num_players):
+            rows = list(base)
+            for row, col in owners[player]:
+                if rows[row] is base[row]:
+                    rows[row] = base[row][:]
+                rows[row][col] = 0
+            cols = [list(line) for line in zip(*rows)]
+            views.append((rows, cols,
+                          [hash(tuple(sorted(line))) for line in rows],
+                          [hash(tuple(sorted(line))) for line in cols]))
+        return ants, views
+
+    def orientation_similar(self, views, loc1, loc2, aim, player):
+        """ Same result as map_similar using views from symmetry_views
+
+            The fingerprints of the rows and columns are checked first,
+              then every row is compared using slices of the views.
+            Rotations of non-square maps are left to map_similar.
+        """
+        if aim >= 4 and self.height != self.width:
+            return self.map_similar(loc1, loc2, aim, player)
+        ants, views = views
+        rows0, cols0, row_prints0, col_prints0 = views[0]
+        rows1, cols1, row_prints1, col_prints1 = views[player]
+        row0, col0 = loc1
+        row1, col1 = loc2
+
+        # each row of the oriented view is a line of the map read from
+        #   along_start in along_sign direction, each column is a cross line
+        if aim < 4:
+            lines, line_prints = rows1, row_prints1
+            line_start, line_sign = row1, (-1 if aim in (1, 3) else 1)
+            cross_prints = col_prints1
+            along_start, along_sign = col1, (-1 if aim in (2, 3) else 1)
+        else:
+            lines, line_prints = cols1, col_prints1
+            line_start, line_sign = col1, (-1 if aim in (6, 7) else 1)
+            cross_prints = row_prints1
+            along_start, along_sign = row1, (-1 if aim in (5, 7) else 1)
+
+        # reject using the fingerprints
+        for row in range(self.height):
+            if (row_prints0[(row0 + row) % self.height]
+                    != line_prints[(line_start + line_sign * row) % len(lines)]):
+                return None
+        for col in range(self.width):
+            if (col_prints0[(col0 + col) % self.width]
+                    != cross_prints[(along_start + along_sign * col) % len(cross_prints)]):
+                return None
+
+        # compare every square
+        for row in range(self.height):
+            line0 = rows0[(row0 + row) % self.height]
+            line1 = lines[(line_start + line_sign * row) % len(lines)]
+            if along_sign == 1:
+                line1 = line1[along_start:] + line1[:along_start]
+            else:
+                line1 = line1[along_start::-1] + line1[:along_start:-1]
+            if line0[col0:] + line0[:col0] != line1:
+                return None
+
+        # map the players in the order map_similar finds them
+        enemy_map = {}
+        for offset in sorted(((row - row0) % self.height, (col - col0) % self.width)
+                             for row, col in ants):
+            ilk0_row, ilk0_col = self.destination(loc1, offset)
+            ilk1_row, ilk1_col = self.destination(loc2, self.offset_aim(offset, aim))
+            enemy_map[self.map[ilk0_row][ilk0_col]] = self.map[ilk1_row][ilk1_col]
+        return enemy_map
+
     def get_map_symmetry(self):
         """ Get orientation for each starting hill
         """
+        if self.symmetry_cache is not None:
+            orientations, error, _ = self.symmetry_cache
+            if error:
+                raise Exception("Invalid map", error)
+            return orientations
         # get list of player 0 hills
         hills = [hill for hill in self.hills.values() if hill.owner == 0]
         # list of
@@ -1192,6 +2031,7 @@ class Ants(Game):
         #         location, aim, and enemy map dict
         orientations = [[(hills[0].loc, 0,
             dict([(i, i, ) for i in range(self.num_players)]))]]
+        views = self.symmetry_views()
         for player in range(1, self.num_players):
             player_hills = [hill for hill in self.hills.values() if hill.owner == player]
             if len(player_hills) != len(hills):
@@ -1202,13 +2042,11 @@ class Ants(Game):
             for player_hill in player_hills:
                 for aim in range(8):
                 # check if map looks similar given the orientation
-                    enemy_map = self.map_similar(hills[0].loc, player_hill.loc, aim, player)
+                    enemy_map = self.orientation_similar(views, hills[0].loc, player_hill.loc, aim, player)
                     if enemy_map != None:
                         # produce combinations of orientation sets
                         for hill_aims in orientations:
-                            new_hill_aims = deepcopy(hill_aims)
-                            new_hill_aims.append((player_hill.loc, aim, enemy_map))
-                            new_orientations.append(new_hill_aims)
+                            new_orientations.append(hill_aims + [(player_hill.loc, aim, enemy_map)])
             orientations = new_orientations
             if len(orientations) == 0:
                 raise Exception("Invalid map",
@@ -1223,8 +2061,9 @@ class Ants(Game):
                 row, col = self.destination(loc, self.offset_aim((1,2), aim))
                 fix.append(((row, col), self.map[row][col]))
                 self.map[row][col] = FOOD
+            views = self.symmetry_views()
             for loc, aim, enemy_map in hill_aims:
-                if self.map_similar(hill_aims[0][0], loc, aim, enemy_map[0]) is None:
+                if self.orientation_similar(views, hill_aims[0][0], loc, aim, enemy_map[0]) is None:
                     break
             else:
                 valid_orientations.append(hill_aims)
@@ -1239,20 +2078,14 @@ class Ants(Game):
         """ Get initial squares in bots vision that are traversable
 
             flood fill from each starting hill up to the vision radius
+            Hills share the squares found, so a flood does not cross squares
+              already seen from an earlier hill
+            Returns a list marking the flat square numbers found
         """
-        vision_squares = {}
+        vision_squares = [False] * len(self.locs)
         for hill in self.hills.values():
-            squares = deque()
-            squares.append(hill.loc)
-            while squares:
-                c_loc = squares.popleft()
-                vision_squares[c_loc] = True
-                for d in AIM.values():
-                    n_loc = self.destination(c_loc, d)
-                    if (n_loc not in vision_squares
-                            and self.map[n_loc[0]][n_loc[1]] != WATER and
-                            self.distance(hill.loc, n_loc) <= self.viewradius):
-                        squares.append(n_loc)
+            self.flood([hill.loc[0] * self.width + hill.loc[1]],
+                       radius2=self.viewradius, visited=vision_squares)
         return vision_squares
 
     def get_symmetric_food_sets(self, starting=False):
@@ -1270,11 +2103,14 @@ class Ants(Game):
             # get_map_symmetry will raise an exception for non-symmetric maps
             self.map_symmetry = choice(self.get_map_symmetry())
 
+        if self.symmetry_cache is not None:
+            orientations, _, food_sets = self.symmetry_cache
+            sets = food_sets[orientations.index(self.map_symmetry)]
+            return list(sets[1] if starting else sets[0])
 
         food_sets = []
         # start with only land squares
-        visited = [[False for col in range(self.width)]
-                          for row in range(self.height)]
+        visited = [False] * len(self.locs)
 
         # aim for ahill0 will always be 0
         ant0 = self.map_symmetry[0][0]
@@ -1282,49 +2118,48 @@ class Ants(Game):
         if starting:
             vision_squares = self.get_initial_vision_squares()
 
-        for row, squares in enumerate(visited):
-            for col, square in enumerate(squares):
-                # if this square has been visited then we don't need to process
-                if square:
-                    continue
-
-                # skip locations of hills
-                if (row, col) in self.hills:
-                    continue
+        for square, (row, col) in enumerate(self.locs):
+            # if this square has been visited then we don't need to process
+            if visited[square]:
+                continue
 
-                if starting:
-                    # skip locations outside of initial ants' view radius
-                    if (row, col) not in vision_squares:
-                        continue
+            # skip locations of hills
+            if (row, col) in self.hills:
+                continue
 
-                # offset to ant 0
-                o_row, o_col = row - ant0[0], col - ant0[1]
-                # set of unique food locations based on offsets from each starting ant
-                locations = list(set([
-                    self.destination(loc, self.offset_aim((o_row, o_col), aim))
-                    for loc, aim, _ in self.map_symmetry
-                ]))
-                # duplicates can happen if 2 ants are the same distance from 1 square
-                # the food set will be smaller and food spawning takes this into account
-
-                # check for spawn location next to each other
-                # create food dead zone along symmetric lines
-                too_close = False
-                loc1 = locations[0]
-                for loc2 in locations[1:]:
-                    if self.distance(loc1, loc2) == 1:
-                        # spawn locations too close
-                        too_close = True
-                        break
-                if too_close:
+            if starting:
+                # skip locations outside of initial ants' view radius
+                if not vision_squares[square]:
                     continue
 
-                # prevent starting food from being equidistant to ants
-                if not starting or len(locations) == self.num_players:
-                    # set locations to visited
-                    for loc in locations:
-                        visited[loc[0]][loc[1]] = True
-                    food_sets.append(locations)
+            # offset to ant 0
+            o_row, o_col = row - ant0[0], col - ant0[1]
+            # set of unique food locations based on offsets from each starting ant
+            locations = list(set([
+                self.destination(loc, self.offset_aim((o_row, o_col), aim))
+                for loc, aim, _ in self.map_symmetry
+            ]))
+            # duplicates can happen if 2 ants are the same distance from 1 square
+            # the food set will be smaller and food spawning takes this into account
+
+            # check for spawn location next to each other
+            # create food dead zone along symmetric lines
+            too_close = False
+            loc1 = locations[0]
+            for loc2 in locations[1:]:
+                if self.distance(loc1, loc2) == 1:
+                    # spawn locations too close
+                    too_close = True
+                    break
+            if too_close:
+                continue
+
+            # prevent starting food from being equidistant to ants
+            if not starting or len(locations) == self.num_players:
+                # set locations to visited
+                for loc in locations:
+                    visited[loc[0] * self.width + loc[1]] = True
+                food_sets.append(locations)
 
         return food_sets
 
@@ -1336,6 +2171,30 @@ class Ants(Game):
         """ Return the players with active hills """
         return [h.owner for h in self.hills.values() if h.killed_by is None]
 
+    def update_score_bounds(self):
+        """ Update the highest and lowest score each player can reach
+
+            A player can still raze every remaining hill of the others
+              and can still lose every one of its own remaining hills.
+            Called whenever scores or hill counts change.
+        """
+        hills = sum(self.hill_count)
+        self.max_score = [score + HILL_POINTS * (hills - count)
+                          for score, count in zip(self.score, self.hill_count)]
+        self.min_score = [score + RAZE_POINTS * count
+                          for score, count in zip(self.score, self.hill_count)]
+
+    def can_climb(self, player):
+        """ Determine if the player can still overtake an opponent in score """
+        for opponent in range(self.num_players):
+            if player != opponent:
+                if ((self.score[player] < self.score[opponent]
+                        and self.max_score[player] >= self.min_score[opponent])
+                        or (self.score[player] == self.score[opponent]
+                        and self.max_score[player] > self.min_score[opponent])):
+                    return True
+        return False
+
     # Common functions for all games
 
     def is_rank_stabilized(self):
@@ -1346,20 +2205,9 @@ class Ants(Game):
             Those without hills will not be given the opportunity to overtake
         """
         for player in range(self.num_players):
-            if self.is_alive(player) and player in self.remaining_hills():
-                max_score = sum([HILL_POINTS for hill in self.hills.values()
-                                 if hill.killed_by is None
-                                 and hill.owner != player]) + self.score[player]
-                for opponent in range(self.num_players):
-                    if player != opponent:
-                        min_score = sum([RAZE_POINTS for hill in self.hills.values()
-                                         if hill.killed_by is None
-                                         and hill.owner == opponent]) + self.score[opponent]
-                        if ((self.score[player] < self.score[opponent]
-                                and max_score >= min_score)
-                                or (self.score[player] == self.score[opponent]
-                                and max_score > min_score)):
-                            return False
+            if (self.is_alive(player) and self.hill_count[player]
+                    and self.can_climb(player)):
+                return False
         return True
 
     def game_over(self):
@@ -1369,10 +2217,11 @@ class Ants(Game):
             A game is over when there are no players remaining, or a single
               winner remaining.
         """
-        if len(self.remaining_players()) < 1:
+        players = len(self.remaining_players())
+        if players < 1:
             self.cutoff = 'extermination'
             return True
-        if len(self.remaining_players()) == 1:
+        if players == 1:
             self.cutoff = 'lone survivor'
             return True
         if self.cutoff_turns >= self.cutoff_turn:
@@ -1395,6 +2244,7 @@ class Ants(Game):
             if hill.owner == player and not hill.raze_points:
                 hill.raze_points = True
                 self.score[player] += RAZE_POINTS
+        self.update_score_bounds()
 
     def start_game(self):
         """ Called by engine at the start of the game """
@@ -1419,11 +2269,14 @@ class Ants(Game):
                     if hill.killed_by == None:
                         self.bonus[players[0]] += HILL_POINTS
                         hill.killed_by = players[0]
+                        self.hill_count[hill.owner] -= 1
+                        self.state_changes = None
                     if not hill.raze_points:
                         self.bonus[hill.owner] += RAZE_POINTS
                         hill.raze_points = True
             for player in range(self.num_players):
                 self.score[player] += self.bonus[player]
+            self.update_score_bounds()
 
         self.calc_significant_turns()
         
@@ -1434,22 +2287,42 @@ class Ants(Game):
     def start_turn(self):
         """ Called by engine at the start of the turn """
         self.turn += 1
+        if self.spool_replay:
+            self.spool_entries()
         self.killed_ants = []
+        self.state_changes = None
         self.revealed_water = [[] for _ in range(self.num_players)]
         self.removed_food = [[] for _ in range(self.num_players)]
         self.orders = [[] for _ in range(self.num_players)]
 
+    def time_phase(self, phase, start):
+        """ Record the time since start for a phase of finish_turn
+
+            Returns the current time, which is the start of the next phase.
+        """
+        now = time.time()
+        self.turn_phase_time[phase] = now - start
+        self.phase_time[phase] += now - start
+        return now
+
     def finish_turn(self):
         """ Called by engine at the end of the turn """
+        start = time.time()
         self.do_orders()
+        start = self.time_phase('orders', start)
         self.do_attack()
+        start = self.time_phase('attack', start)
         self.do_raze_hills()
+        start = self.time_phase('raze_hills', start)
         self.do_spawn()
+        start = self.time_phase('spawn', start)
         self.do_gather()
+        start = self.time_phase('gather', start)
         self.food_extra += Fraction(self.food_rate * self.num_players, self.food_turn)
         food_now = int(self.food_extra)
         left_over = self.do_food(food_now)
         self.food_extra -= (food_now - left_over)
+        self.time_phase('food', start)
 
         # record score in score history
         for i, s in enumerate(self.score):
@@ -1476,8 +2349,11 @@ class Ants(Game):
                 self.hive_history[i].append(f)
 
         # now that all the ants have moved we can update the vision
+        start = time.time()
         self.update_vision()
+        start = self.time_phase('vision', start)
         self.update_revealed()
+        self.time_phase('revealed', start)
 
         # calculate population counts for stopping games early
         # FOOD can end the game as well, since no one is gathering it
@@ -1517,8 +2393,7 @@ class Ants(Game):
 
             Used by engine for streaming playback
         """
-        updates = self.get_state_changes()
-        updates.append([]) # newline
+        updates = self.get_state_changes() + [()] # newline
 
         return '\n'.join(' '.join(map(str,s)) for s in updates)
 
@@ -1563,7 +2438,7 @@ class Ants(Game):
         if self.killed[player]:
             return False
         else:
-            return bool(self.player_ants(player))
+            return bool(self.owner_ants[player])
 
     def get_error(self, player):
         """ Returns the reason a player was killed
@@ -1604,9 +2479,7 @@ class Ants(Game):
 
             Used by engine to report stats
         """
-        ant_count = [0 for _ in range(self.num_players+1)]
-        for ant in self.current_ants.values():
-            ant_count[ant.owner] += 1
+        ant_count = [len(ants) for ants in self.owner_ants] + [0]
         stats = {}
         stats['ant_count'] = ant_count
         stats['food'] = len(self.current_food)
@@ -1618,41 +2491,63 @@ class Ants(Game):
         stats['r_turn'] = self.ranking_turn
         stats['score'] = self.score
         stats['s_alive'] = [1 if self.is_alive(player) else 0 for player in range(self.num_players)]
-        stats['s_hills'] = [1 if player in self.remaining_hills() else 0 for player in range(self.num_players)]
-        stats['climb?'] = []
-#        stats['max_score'] = {}
-        for player in range(self.num_players):
-            if self.is_alive(player) and player in self.remaining_hills():
-                found = 0
-                max_score = sum([HILL_POINTS for hill in self.hills.values()
-                                 if hill.killed_by is None
-                                 and hill.owner != player]) + self.score[player]
-#                stats['max_score'][player] = max_score
-#                stats['min_score_%s' % player] = {}
-                for opponent in range(self.num_players):
-                    if player != opponent:
-                        min_score = sum([RAZE_POINTS for hill in self.hills.values()
-                                         if hill.killed_by is None
-                                         and hill.owner == opponent]) + self.score[opponent]
-#                        stats['min_score_%s' % player][opponent] = min_score
-                        if ((self.score[player] < self.score[opponent]
-                                and max_score >= min_score)
-                                or (self.score[player] == self.score[opponent]
-                                and max_score > min_score)):
-                            found = 1
-                            #return False
-                            break
-                stats['climb?'].append(found)
-            else:
-                stats['climb?'].append(0)
+        stats['s_hills'] = [1 if self.hill_count[player] else 0 for player in range(self.num_players)]
+        stats['climb?'] = [1 if self.is_alive(player) and self.hill_count[player]
+                              and self.can_climb(player) else 0
+                           for player in range(self.num_players)]
+        # milliseconds spent in each phase of the last turn, in PHASES order
+        stats['phase_ms'] = [round(self.turn_phase_time[phase] * 1000, 1)
+                             for phase in PHASES]
         return stats
 
+    def get_phase_times(self):
+        """ Return the seconds spent in each phase of finish_turn
+
+            Totals for the game so far, used by the engine to report slow
+              maps.
+        """
+        return dict((phase, round(self.phase_time[phase], 6)) for phase in PHASES)
+
     def get_replay(self):
         """ Return a summary of the entire game
 
             Used by the engine to create a replay file which may be used
               to replay the game.
         """
+        replay = self.replay_parts()
+        replay['food'] = list(replay['food'])
+        replay['ants'] = list(replay['ants'])
+        return replay
+
+    def write_replay(self, replay_file):
+        """ Write the replay as json to a file
+
+            The text is the same as json.dump of get_replay with sorted
+              keys, but the food and ants are written one at a time so
+              the whole replay is never held in memory.
+        """
+        replay = self.replay_parts()
+        replay_file.write('{')
+        for i, key in enumerate(sorted(replay)):
+            if i > 0:
+                replay_file.write(', ')
+            replay_file.write(json.dumps(key) + ': ')
+            if key in ('food', 'ants'):
+                replay_file.write('[')
+                for j, entry in enumerate(replay[key]):
+                    if j > 0:
+                        replay_file.write(', ')
+                    replay_file.write(json.dumps(entry))
+                replay_file.write(']')
+            else:
+                replay_file.write(json.dumps(replay[key], sort_keys=True))
+        replay_file.write('}')
+
+    def replay_parts(self):
+        """ Return the replay with generators of the food and ants entries
+
+            Shared by get_replay and write_replay.
+        """
         replay = {}
         # required params
         replay['revision'] = 3
@@ -1678,31 +2573,8 @@ class Ants(Game):
         replay['map']['data'] = self.get_map_output()
 
         # food and ants combined
-        replay['food'] = []
-        for food in self.all_food:
-            food_data = [food.loc[0], food.loc[1], food.start_turn]
-            if food.end_turn is None:
-                # food survives to end of game
-                food_data.append(self.turn + 1)
-            else: # food.ant is None:
-                # food disappears
-                food_data.append(food.end_turn)
-            if food.owner != None:
-                food_data.append(food.owner)
-            replay['food'].append(food_data)
-
-        replay['ants'] = []
-        for ant in self.all_ants:
-            # mimic food data
-            ant_data = [ant.initial_loc[0], ant.initial_loc[1], ant.spawn_turn]
-            if not ant.killed:
-                ant_data.append(self.turn + 1)
-            else:
-                ant_data.append(ant.die_turn)
-            ant_data.append(ant.owner)
-            ant_data.append(''.join(ant.orders))
-
-            replay['ants'].append(ant_data)
+        replay['food'] = self.replay_food()
+        replay['ants'] = self.replay_ants()
 
         replay['hills'] = []
         for hill in self.hills.values():
@@ -1724,10 +2596,356 @@ class Ants(Game):
         replay['winning_turn'] = self.winning_turn
         replay['ranking_turn'] = self.ranking_turn
         replay['cutoff'] =  self.cutoff
+        replay['engine_time'] = self.get_phase_times()
 
         return replay
 
-class Ant:
+    def replay_food(self):
+        """ Generate the replay entry of each food
+
+            Spooled food comes first, in the order it was removed.
+        """
+        if self.spool_replay:
+            for food_data in self.read_spool(self.food_spool):
+                yield food_data
+        for food in self.all_food:
+            yield self.food_entry(food)
+
+    def replay_ants(self):
+        """ Generate the replay entry of each ant
+
+            Spooled ants come first, in the order they died.
+        """
+        if self.spool_replay:
+            for ant_data in self.read_spool(self.ant_spool):
+                yield ant_data
+        for ant in self.all_ants:
+            yield self.ant_entry(ant)
+
+    def food_entry(self, food):
+        food_data = [food.loc[0], food.loc[1], food.start_turn]
+        if food.end_turn is None:
+            # food survives to end of game
+            food_data.append(self.turn + 1)
+        else: # food.ant is None:
+            # food disappears
+            food_data.append(food.end_turn)
+        if food.owner != None:
+            food_data.append(food.owner)
+        return food_data
+
+    def ant_entry(self, ant):
+        # mimic food data
+        ant_data = [ant.initial_loc[0], ant.initial_loc[1], ant.spawn_turn]
+        if not ant.killed:
+            ant_data.append(self.turn + 1)
+        else:
+            ant_data.append(ant.die_turn)
+        ant_data.append(ant.owner)
+        ant_data.append(ant.get_orders())
+        return ant_data
+
+    def spool_entries(self):
+        """ Write the replay entries of dead ants and removed food
+
+            Called at the start of each turn with the spool_replay option,
+              once the ants killed last turn have been reported.  The
+              entries are written as lines of json and the ants and food
+              are dropped, so only the ants and food on the map are kept
+              in memory.  A game that spools can't be snapshot.
+        """
+        ants = []
+        for ant in self.all_ants:
+            if ant.killed:
+                self.ant_spool.write(json.dumps(self.ant_entry(ant)) + '\n')
+            else:
+                ants.append(ant)
+        self.all_ants = ants
+        food = []
+        for item in self.all_food:
+            if item.end_turn is not None:
+                self.food_spool.write(json.dumps(self.food_entry(item)) + '\n')
+            else:
+                food.append(item)
+        self.all_food = food
+
+    def read_spool(self, spool):
+        """ Generate the entries written to a spool """
+        spool.seek(0)
+        line = spool.readline()
+        while line:
+            yield json.loads(line)
+            line = spool.readline()
+        spool.seek(0, 2)
+
+    def snapshot(self):
+        """ Return the state of the game between turns as bytes
+
+            The map, ants with their orders, food, hills, vision, revealed
+              squares, scores, cutoff counters and the random number
+              generator state are stored as typed arrays, see mapcache.
+            The snapshot can be loaded with restore() into a game created
+              from the same map and options.
+        """
+        if self.spool_replay:
+            raise Exception("snapshot",
+                            "a game with spool_replay can't be snapshot")
+        arrays = []
+        def flat(loc):
+            return loc[0] * self.width + loc[1]
+        def text(value):
+            arrays.append(array('B', bytearray(value.encode('utf-8'))))
+        def optional(value, write):
+            # a flag array, followed by the value if there is one
+            arrays.append([int(value is not None)])
+            if value is not None:
+                write(value)
+        def grid(values, typecode):
+            if self.board == 'numpy':
+                arrays.append(array(typecode, values.ravel().tolist()))
+            else:
+                arrays.append(array(typecode, [value for row in values for value in row]))
+        def none_as(value, default=-1):
+            return default if value is None else value
+
+        arrays.append([self.height, self.width, self.num_players, self.turn])
+        text(' '.join(str(value) for value in
+                      (self.engine_seed, self.player_seed, self.food_rate,
+                       self.food_turn, self.food_start, self.food_visible)))
+        version, internal, gauss_next = getstate()
+        arrays.append([version])
+        arrays.append(array('L', internal))
+        optional(gauss_next, lambda value: arrays.append(array('d', [value])))
+        grid(self.map, 'b')
+        # random food is picked by its position in the free land index
+        arrays.append(self.free_squares)
+
+        # ants, with all orders joined together
+        ant_index = dict((ant, i) for i, ant in enumerate(self.all_ants))
+        ants = []
+        for ant in self.all_ants:
+            ants.extend([flat(ant.initial_loc), flat(ant.loc), ant.owner,
+                         ant.spawn_turn, none_as(ant.die_turn), int(ant.killed)])
+        arrays.append(ants)
+        arrays.append([len(ant.orders) for ant in self.all_ants])
+        arrays.append(array('B', b''.join(bytes(ant.orders) for ant in self.all_ants)))
+        arrays.append([ant_index[ant] for ant in self.current_ants.values()])
+        arrays.append([ant_index[ant] for ant in self.killed_ants])
+        arrays.append([ant_index[ant] for ant in self.initial_ant_list])
+
+        # all food in creation order, current and queued food in dict order
+        food_index = dict((food, i) for i, food in enumerate(self.all_food))
+        food = []
+        for item in self.all_food:
+            food.extend([flat(item.loc), item.start_turn, none_as(item.end_turn),
+                         none_as(item.owner)])
+        arrays.append(food)
+        arrays.append([food_index[item] for item in self.current_food.values()])
+        arrays.append([i for loc, count in self.pending_food.items()
+                       for i in (flat(loc), count)])
+
+        hills = []
+        for hill in self.hills.values():
+            hills.extend([flat(hill.loc), hill.owner, none_as(hill.end_turn),
+                          none_as(hill.killed_by), int(hill.raze_points),
+                          hill.last_touched])
+        arrays.append(hills)
+
+        arrays.append(self.score)
+        arrays.append(self.bonus)
+        arrays.append(self.hive_food)
+        arrays.append(mapcache.pack_lists(self.score_history))
+        arrays.append(mapcache.pack_lists(self.hive_history))
+        arrays.append([self.cutoff_bot, self.cutoff_turns, self.winning_turn,
+                       self.ranking_turn, self.food_extra.numerator,
+                       self.food_extra.denominator,
+                       int(getattr(self, 'game_started', False))])
+        optional(self.cutoff, text)
+        optional(self.winning_bot, arrays.append)
+        optional(self.ranking_bots, arrays.append)
+
+        # what each player has seen
+        arrays.append([int(killed) for killed in self.killed])
+        arrays.append(mapcache.pack_lists(
+            [[none_as(i, SWITCH_NONE) for i in switch] for switch in self.switch]))
+        for player in range(self.num_players):
+            grid(self.vision[player], 'h')
+            grid(self.revealed[player], 'B')
+        arrays.append(mapcache.pack_lists(
+            [[flat(loc) for loc in water] for water in self.revealed_water]))
+
+        # symmetric food placement, the sets are a deque with a None sentinel
+        optional(getattr(self, 'map_symmetry', None),
+                 lambda value: arrays.append(self.pack_orientation(value)))
+        for name in ('food_sets', 'food_sets_visible'):
+            optional(getattr(self, name, None), lambda value: arrays.append(
+                mapcache.pack_lists([[-1] if s is None else [flat(loc) for loc in s]
+                                     for s in value])))
+        return mapcache.encode_arrays(arrays)
+
+    def restore(self, blob):
+        """ Load the state of a game saved with snapshot()
+
+            The game must have been created from the same map and options.
+            Under python 2 the food queued for placement may be placed in
+              a different order than the original game, since the order
+              of dict keys depends on the history of the dict.
+        """
+        if self.spool_replay:
+            raise Exception("snapshot",
+                            "a game with spool_replay can't be restored")
+        try:
+            values = iter(mapcache.decode_arrays(blob))
+        except (ValueError, struct.error):
+            raise Exception("snapshot", "snapshot data is corrupt")
+        def read():
+            try:
+                return next(values)
+            except StopIteration:
+                raise Exception("snapshot", "snapshot data is truncated")
+        def text():
+            return bytes(bytearray(read())).decode('utf-8')
+        def optional(read_value):
+            if read()[0]:
+                return read_value()
+            return None
+        def grid(dtype, convert):
+            values = read()
+            if self.board == 'numpy':
+                return numpy.array(values, dtype=dtype).reshape(self.height, self.width)
+            return [[convert(value) for value in values[row:row + self.width]]
+                    for row in range(0, len(values), self.width)]
+        def as_none(value, default=-1):
+            return None if value == default else value
+        locs = self.locs
+
+        height, width, num_players, turn = read()
+        if (height, width, num_players) != (self.height, self.width, self.num_players):
+            raise Exception("snapshot", "snapshot is for a %sx%s map with %s players"
+                            % (height, width, num_players))
+        self.turn = turn
+        (self.engine_seed, self.player_seed, self.food_rate, self.food_turn,
+         self.food_start, self.food_visible) = [int(value) for value in text().split()]
+        version = read()[0]
+        internal = tuple(read())
+        setstate((version, internal, optional(lambda: read()[0])))
+        self.map = grid('int8', int)
+        self.free_squares = read()
+        self.free_position = [-1] * (self.height * self.width)
+        for position, loc in enumerate(self.free_squares):
+            self.free_position[loc] = position
+
+        ants = read()
+        order_lengths = read()
+        orders = bytearray(read())
+        self.all_ants = []
+        offset = 0
+        for i, length in enumerate(order_lengths):
+            initial_loc, loc, owner, spawn_turn, die_turn, killed = ants[i*6:i*6+6]
+            ant = Ant(locs[loc], owner, spawn_turn)
+            ant.initial_loc = locs[initial_loc]
+            ant.die_turn = as_none(die_turn)
+            ant.killed = bool(killed)
+            ant.orders = orders[offset:offset + length]
+            offset += length
+            self.all_ants.append(ant)
+        self.current_ants = {}
+        self.owner_ants = [{} for _ in range(self.num_players)]
+        self.ant_buckets = {}
+        for i in read():
+            ant = self.all_ants[i]
+            self.current_ants[ant.loc] = ant
+            self.index_ant(ant)
+        self.killed_ants = [self.all_ants[i] for i in read()]
+        self.initial_ant_list = [self.all_ants[i] for i in read()]
+
+        food = read()
+        self.all_food = []
+        for i in range(0, len(food), 4):
+            loc, start_turn, end_turn, owner = food[i:i+4]
+            item = Food(locs[loc], start_turn)
+            item.end_turn = as_none(end_turn)
+            item.owner = as_none(owner)
+            self.all_food.append(item)
+        self.current_food = {}
+        for i in read():
+            self.current_food[self.all_food[i].loc] = self.all_food[i]
+        pending = read()
+        self.pending_food = defaultdict(int)
+        for i in range(0, len(pending), 2):
+            self.pending_food[locs[pending[i]]] = pending[i+1]
+        self.pending_ready = set(loc for loc in self.pending_food
+                                 if self.map[loc[0]][loc[1]] == LAND)
+
+        # the hills of the map are updated in place so they keep the
+        #   order they were created in, which decides spawn order
+        hills = read()
+        if sorted(hills[0::6]) != sorted(row * self.width + col for row, col in self.hills):
+            raise Exception("snapshot", "snapshot has different hills")
+        self.hill_count = [0]*self.num_players
+        for i in range(0, len(hills), 6):
+            loc, owner, end_turn, killed_by, raze_points, last_touched = hills[i:i+6]
+            hill = self.hills[locs[loc]]
+            hill.end_turn = as_none(end_turn)
+            hill.killed_by = as_none(killed_by)
+            hill.raze_points = bool(raze_points)
+            hill.last_touched = last_touched
+            if hill.killed_by is None:
+                self.hill_count[owner] += 1
+
+        self.score = read()
+        self.bonus = read()
+        self.hive_food = read()
+        self.score_history = mapcache.unpack_lists(read())
+        self.hive_history = mapcache.unpack_lists(read())
+        (self.cutoff_bot, self.cutoff_turns, self.winning_turn, self.ranking_turn,
+         numerator, denominator, game_started) = read()
+        self.food_extra = Fraction(numerator, denominator)
+        if game_started:
+            self.game_started = True
+        self.cutoff = optional(lambda: str(text()))
+        self.winning_bot = optional(read)
+        self.ranking_bots = optional(read)
+        self.update_score_bounds()
+
+        self.killed = [bool(killed) for killed in read()]
+        self.switch = [[as_none(i, SWITCH_NONE) for i in switch]
+                       for switch in mapcache.unpack_lists(read())]
+        self.vision = []
+        self.revealed = []
+        for player in range(self.num_players):
+            self.vision.append(grid('int16', int))
+            self.revealed.append(grid('bool', bool))
+        if self.board == 'numpy':
+            self.vision_array = numpy.array(self.vision)
+            self.vision = list(self.vision_array)
+        self.revealed_water = [[locs[loc] for loc in water]
+                               for water in mapcache.unpack_lists(read())]
+        self.newly_visible = [[] for _ in range(self.num_players)]
+        self.removed_food = [[] for _ in range(self.num_players)]
+        self.orders = [[] for _ in range(self.num_players)]
+        self.state_changes = None
+
+        # attributes which are created the first time they are needed
+        map_symmetry = optional(lambda: self.unpack_orientation(read(), self.width))
+        if map_symmetry is not None:
+            self.map_symmetry = map_symmetry
+        elif hasattr(self, 'map_symmetry'):
+            del self.map_symmetry
+        for name in ('food_sets', 'food_sets_visible'):
+            food_sets = optional(lambda: deque(
+                [None if s == [-1] else [locs[loc] for loc in s]
+                 for s in mapcache.unpack_lists(read())]))
+            if food_sets is not None:
+                setattr(self, name, food_sets)
+            elif hasattr(self, name):
+                delattr(self, name)
+
+# entities use __slots__ since every one created is kept for the replay
+class Ant(object):
+    __slots__ = ('loc', 'owner', 'initial_loc', 'spawn_turn', 'die_turn',
+                 'orders', 'killed')
+
     def __init__(self, loc, owner, spawn_turn=None):
         self.loc = loc
         self.owner = owner
@@ -1735,13 +2953,26 @@ class Ant:
         self.initial_loc = loc
         self.spawn_turn = spawn_turn
         self.die_turn = None
-        self.orders = []
+        # one byte per turn, the character of the direction moved
+        self.orders = bytearray()
         self.killed = False
 
+    def add_order(self, direction):
+        self.orders.append(ord(direction))
+
+    def last_order(self):
+        return chr(self.orders[-1])
+
+    def get_orders(self):
+        """ Return the orders as a string for the replay """
+        return str(self.orders.decode('ascii'))
+
     def __str__(self):
-        return '(%s, %s, %s, %s, %s)' % (self.initial_loc, self.owner, self.spawn_turn, self.die_turn, ''.join(self.orders))
+        return '(%s, %s, %s, %s, %s)' % (self.initial_loc, self.owner, self.spawn_turn, self.die_turn, self.get_orders())
+
+class Food(object):
+    __slots__ = ('loc', 'start_turn', 'end_turn', 'owner')
 
-class Food:
     def __init__(self, loc, start_turn):
         self.loc = loc
         self.start_turn = start_turn
@@ -1751,7 +2982,10 @@ class Food:
     def __str__(self):
         return '(%s, %s, %s)' % (self.loc, self.start_turn, self.end_turn)
 
-class Hill:
+class Hill(object):
+    __slots__ = ('loc', 'owner', 'end_turn', 'killed_by', 'raze_points',
+                 'last_touched')
+
     def __init__(self, loc, owner):
         self.loc = loc
         self.owner = owner
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+"""
+    Plays many games between python bots inside the engine process
+
+    Bots written against the python starter package ants.py are loaded
+    as modules and their do_setup and do_turn methods are called
+    directly, instead of running each bot as a process and talking to
+    it through pipes.  Games are spread across a pool of processes and
+    the results are summed up for each bot.
+
+    The rules are those of the Ants class, the same as games played by
+    playgame.py.  Each bot has its own random number generator state,
+    as it would in its own process, so the random numbers drawn by the
+    engine are not changed by the bots.
+"""
+from __future__ import print_function
+import sys
+import os
+import time
+import json
+import inspect
+import traceback
+from optparse import OptionParser, OptionGroup
+from random import shuffle, getstate, setstate, Random
+from collections import defaultdict
+from multiprocessing import Pool
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+try:
+    from importlib.util import spec_from_file_location, module_from_spec
+except ImportError:
+    import imp
+    spec_from_file_location = None
+
+from ants import Ants
+
+# starter package used by bots that don't have an ants.py next to them
+STARTER_ANTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'dist', 'starter_bots', 'python', 'ants.py')
+
+# number of bots loaded by this process, to give their modules unique names
+bots_loaded = [0]
+
+def load_module(name, path):
+    if spec_from_file_location is None:
+        return imp.load_source(name, path)
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_bot(filename):
+    """ Return the starter package, the module and the bot class of a bot file
+
+        The bot imports its starter package as 'ants', which is also the
+          name of the engine module, so the starter package is put in
+          sys.modules only while the bot is loaded.
+        The bot and its starter package are loaded again on every call,
+          so module globals don't carry over from one seat or game to
+          the next, as if the bot ran in its own process.
+        The bot class is the class of the module with a do_turn method.
+    """
+    filename = os.path.abspath(filename)
+    bot_dir = os.path.dirname(filename)
+    starter_file = os.path.join(bot_dir, 'ants.py')
+    if not os.path.exists(starter_file):
+        starter_file = STARTER_ANTS
+    prefix = 'bot%s_' % bots_loaded[0]
+    bots_loaded[0] += 1
+    starter = load_module(prefix + 'ants', starter_file)
+
+    engine_module = sys.modules.get('ants')
+    sys.modules['ants'] = starter
+    sys.path.insert(0, bot_dir)
+    try:
+        module = load_module(prefix + os.path.splitext(os.path.basename(filename))[0],
+                             filename)
+    finally:
+        sys.path.remove(bot_dir)
+        if engine_module is None:
+            del sys.modules['ants']
+        else:
+            sys.modules['ants'] = engine_module
+    # the modules are only used through what is returned
+    del sys.modules[starter.__name__]
+    sys.modules.pop(module.__name__, None)
+
+    bot_classes = [value for value in vars(module).values()
+                   if inspect.isclass(value) and value.__module__ == module.__name__
+                   and hasattr(value, 'do_turn')]
+    if len(bot_classes) != 1:
+        raise Exception("bot", "%s should have 1 class with a do_turn method, found %s"
+                        % (filename, len(bot_classes)))
+    return starter, module, bot_classes[0]
+
+class InProcessBot(object):
+    """ A bot and its starter package state, called directly by the engine """
+    def __init__(self, filename):
+        # the modules are kept with the bot, python 2 clears the globals
+        #   of a module once nothing refers to it
+        self.starter, self.module, bot_class = load_bot(filename)
+        self.ants = self.starter.Ants()
+        self.bot = bot_class()
+        # state of the bot's random number generator, seeded by the
+        #   starter package with the player_seed of the game
+        self.random_state = Random().getstate()
+        self.time = 0.0
+
+    def call(self, method, *args):
+        """ Call a method of the bot, returning the lines it printed
+
+            The random number generator and stdout are swapped with the
+              bot's own while the method runs.
+        """
+        engine_state = getstate()
+        setstate(self.random_state)
+        stdout = sys.stdout
+        sys.stdout = output = StringIO()
+        start_time = time.time()
+        try:
+            method(*args)
+        finally:
+            self.time += time.time() - start_time
+            sys.stdout = stdout
+            self.random_state = getstate()
+            setstate(engine_state)
+        return [line.strip() for line in output.getvalue().split('\n')]
+
+    def setup(self, start):
+        self.call(self.ants.setup, start)
+        if hasattr(self.bot, 'do_setup'):
+            self.call(self.bot.do_setup, self.ants)
+
+    def turn(self, state):
+        self.ants.update(state)
+        return self.call(self.bot.do_turn, self.ants)
+
+def run_game(game, bots, options):
+    """ Play a game with bots that run in this process
+
+        The calls to the game are made in the same order as the engine's
+          run_game, including the shuffle of the bots each turn.
+        A bot that raises an exception or exits has crashed and is killed.
+        Returns a game result with the same keys as the engine's,
+          without the replay.
+    """
+    strict = options.get('strict', False)
+    num_bots = len(bots)
+    bot_status = ['survived'] * num_bots
+    bot_turns = [0] * num_bots
+    errors = [None] * num_bots
+
+    for turn in range(game.turns + 1):
+        if turn == 0:
+            game.start_game()
+
+        # game state is rendered before the turn starts, as it is sent
+        states = {}
+        for b in range(num_bots):
+            if game.is_alive(b):
+                if turn == 0:
+                    states[b] = game.get_player_start(b)
+                else:
+                    states[b] = game.get_player_state(b)
+                    bot_turns[b] = turn
+
+        if turn > 0:
+            game.start_turn()
+
+        bot_moves = [[] for b in bots]
+        bot_list = [b for b in range(num_bots) if game.is_alive(b)]
+        shuffle(bot_list)
+        for b in bot_list:
+            try:
+                if turn == 0:
+                    bots[b].setup(states[b])
+                else:
+                    moves = bots[b].turn(states[b])
+                    bot_moves[b] = moves[:moves.index('go')] if 'go' in moves else moves
+            except (Exception, SystemExit):
+                errors[b] = traceback.format_exc()
+                bot_status[b] = 'crashed'
+                bot_turns[b] = turn
+                game.kill_player(b)
+
+        bot_alive = [game.is_alive(b) for b in range(num_bots)]
+        if turn > 0 and not game.game_over():
+            for b, moves in enumerate(bot_moves):
+                if game.is_alive(b):
+                    valid, ignored, invalid = game.do_moves(b, moves)
+                    if invalid and strict:
+                        game.kill_player(b)
+                        bot_status[b] = 'invalid'
+                        bot_turns[b] = turn
+
+        if turn > 0:
+            game.finish_turn()
+
+        for b, alive in enumerate(bot_alive):
+            if alive and not game.is_alive(b) and bot_status[b] == 'survived':
+                bot_status[b] = 'eliminated'
+                bot_turns[b] = turn
+
+        if game.game_over():
+            break
+
+    game.finish_game()
+    scores = game.get_scores()
+    return {
+        'challenge': game.__class__.__name__.lower(),
+        'status': bot_status,
+        'playerturns': bot_turns,
+        'score': scores,
+        'rank': [sorted(scores, reverse=True).index(x) for x in scores],
+        'game_length': turn,
+        'cutoff': game.cutoff,
+        'engine_time': game.get_phase_times(),
+        'bot_time': [bot.time for bot in bots],
+        'errors': errors
+    }
+
+def play_game(task):
+    """ Play one game of a batch, run by the processes of the pool """
+    game_options, bot_files, options = task
+    start_time = time.time()
+    game = Ants(game_options)
+    bots = [InProcessBot(filename) for filename in bot_files]
+    result = run_game(game, bots, options)
+    result['bots'] = bot_files
+    result['map'] = game_options['map_file']
+    result['engine_seed'] = game.engine_seed
+    result['time'] = time.time() - start_time
+    return result
+
+def map_players(map_text):
+    """ Return the number of players of a map, or None if it doesn't say """
+    for line in map_text.splitlines():
+        if line.lower().startswith('players'):
+            return int(line.split()[1])
+    return None
+
+def game_tasks(opts, bot_files):
+    """ Yield the game options, bots and engine options of each game
+
+        Maps are played in turn.  With fill the last bot takes the extra
+          seats of each map, and with rotate the bots are moved one
+          position along for each game.
+    """
+    map_texts = {}
+    for map_file in opts.map:
+        with open(map_file) as f:
+            map_texts[map_file] = f.read()
+    for game_num in range(opts.games):
+        map_file = opts.map[game_num % len(opts.map)]
+        game_options = {
+            'map': map_texts[map_file],
+            'map_file': map_file,
+            'turns': opts.turns,
+            'loadtime': opts.loadtime,
+            'turntime': opts.turntime,
+            'attack': opts.attack,
+            'food': opts.food,
+            'viewradius2': opts.viewradius2,
+            'attackradius2': opts.attackradius2,
+            'spawnradius2': opts.spawnradius2,
+            'food_rate': opts.food_rate,
+            'food_turn': opts.food_turn,
+            'food_start': opts.food_start,
+            'food_visible': opts.food_visible,
+            'food_index': opts.food_index,
+            'cutoff_turn': opts.cutoff_turn,
+            'cutoff_percent': opts.cutoff_percent,
+            'board': opts.board,
+            'map_cache': opts.map_cache
+        }
+        if opts.engine_seed is not None:
+            game_options['engine_seed'] = opts.engine_seed + game_num
+        if opts.player_seed is not None:
+            game_options['player_seed'] = opts.player_seed
+        bots = list(bot_files)
+        players = map_players(map_texts[map_file])
+        if players is not None and players > len(bots) and opts.fill:
+            bots.extend([bots[-1]] * (players - len(bots)))
+        if opts.rotate:
+            shift = game_num % len(bots)
+            bots = bots[shift:] + bots[:shift]
+        yield game_options, bots, {'strict': opts.strict}
+
+def summarize(results):
+    """ Return statistics of a batch of game results for each bot and map
+
+        Bots are the files given on the command line, which may play
+          several seats of a game with --fill.  A bot's games are the
+          games it played in, and a game is a win for the bot if one of
+          its seats ranked first alone, or a draw if it shared first
+          place.  The score and rank are the means over its seats.
+        The engine time of each map is the mean number of milliseconds
+          spent in each phase of a turn.
+    """
+    bots = defaultdict(lambda: {'games': 0, 'seats': 0, 'wins': 0, 'draws': 0,
+                                'score': 0, 'rank': 0, 'time': 0.0,
+                                'status': defaultdict(int)})
+    maps = defaultdict(lambda: {'games': 0, 'turns': 0,
+                                'engine_time': defaultdict(float)})
+    cutoffs = defaultdict(int)
+    turns = 0
+    for result in results:
+        turns += result['game_length']
+        cutoffs[result['cutoff']] += 1
+        map_stats = maps[os.path.basename(result['map'])]
+        map_stats['games'] += 1
+        map_stats['turns'] += result['game_length']
+        for phase, seconds in result['engine_time'].items():
+            map_stats['engine_time'][phase] += seconds
+        first = [b for b, rank in enumerate(result['rank']) if rank == 0]
+        for filename in set(result['bots']):
+            stats = bots[filename]
+            stats['games'] += 1
+            if any(result['bots'][b] == filename for b in first):
+                if len(first) == 1:
+                    stats['wins'] += 1
+                else:
+                    stats['draws'] += 1
+        for b, filename in enumerate(result['bots']):
+            stats = bots[filename]
+            stats['seats'] += 1
+            stats['score'] += result['score'][b]
+            stats['rank'] += result['rank'][b]
+            stats['time'] += result['bot_time'][b]
+            stats['status'][result['status'][b]] += 1
+    for stats in bots.values():
+        for key in ('score', 'rank'):
+            stats[key] = float(stats[key]) / stats['seats']
+        stats['status'] = dict(stats['status'])
+    for map_stats in maps.values():
+        map_stats['engine_time'] = dict(
+            (phase, seconds * 1000 / max(map_stats['turns'], 1))
+            for phase, seconds in map_stats['engine_time'].items())
+    return {
+        'games': len(results),
+        'turns': turns,
+        'game_length': float(turns) / len(results) if results else 0,
+        'cutoff': dict(cutoffs),
+        'bots': dict(bots),
+        'maps': dict(maps)
+    }
+
+def run_batch(opts, bot_files):
+    """ Play all the games of a batch and return the results """
+    tasks = list(game_tasks(opts, bot_files))
+    if opts.processes == 1:
+        return [play_game(task) for task in tasks]
+    pool = Pool(opts.processes)
+    try:
+        return pool.map(play_game, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+def main(argv):
+    usage = "Usage: %prog [options] -m map bot1 bot2 ...\n\nBots are python files using the starter package"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-m", "--map_file", dest="map", action="append", default=[],
+                      help="Name of a map file, may be given more than once")
+    parser.add_option("-n", "--games", dest="games", default=1, type="int",
+                      help="Number of games to play")
+    parser.add_option("-j", "--processes", dest="processes", default=None, type="int",
+                      help="Number of processes to play games in, defaults to the number of cpus")
+    parser.add_option("-t", "--turns", dest="turns", default=1000, type="int",
+                      help="Number of turns in the game")
+    parser.add_option("--turntime", dest="turntime", default=1000, type="int",
+                      help="Amount of time bots are told they have, in milliseconds")
+    parser.add_option("--loadtime", dest="loadtime", default=3000, type="int",
+                      help="Amount of time bots are told they have to load, in milliseconds")
+    parser.add_option("--player_seed", dest="player_seed", default=None, type="int",
+                      help="Player seed for the random number generator")
+    parser.add_option("--engine_seed", dest="engine_seed", default=None, type="int",
+                      help="Engine seed of the first game, each game adds 1")
+    parser.add_option('--strict', dest='strict', action='store_true', default=False,
+                      help='Strict mode enforces valid moves for bots')
+    parser.add_option('--fill', dest='fill', action='store_true', default=False,
+                      help='Fill up extra player starts with last bot specified')
+    parser.add_option('--rotate', dest='rotate', action='store_true', default=False,
+                      help='Move the bots one player position along for each game')
+    parser.add_option('--json', dest='json', action='store_true', default=False,
+                      help='Print the statistics as json')
+
+    game_group = OptionGroup(parser, "Game Options", "Options that affect the game mechanics for ants")
+    game_group.add_option("--attack", dest="attack", default="focus",
+                          help="Attack method to use for engine. (closest, focus, focus_batch, support, damage)")
+    game_group.add_option("--food", dest="food", default="symmetric",
+                          help="Food spawning method. (none, random, sections, symmetric)")
+    game_group.add_option("--viewradius2", dest="viewradius2", default=77, type="int",
+                          help="Vision radius of ants squared")
+    game_group.add_option("--spawnradius2", dest="spawnradius2", default=1, type="int",
+                          help="Spawn radius of ants squared")
+    game_group.add_option("--attackradius2", dest="attackradius2", default=5, type="int",
+                          help="Attack radius of ants squared")
+    game_group.add_option("--food_rate", dest="food_rate", nargs=2, type="int", default=(5,11),
+                          help="Numerator of food per turn per player rate")
+    game_group.add_option("--food_turn", dest="food_turn", nargs=2, type="int", default=(19,37),
+                          help="Denominator of food per turn per player rate")
+    game_group.add_option("--food_start", dest="food_start", nargs=2, type="int", default=(75,175),
+                          help="One over percentage of land area filled with food at start")
+    game_group.add_option("--food_visible", dest="food_visible", nargs=2, type="int", default=(3,5),
+                          help="Amount of food guaranteed to be visible to starting ants")
+    game_group.add_option("--food_index", dest="food_index",
+                          action='store_true', default=False,
+                          help="Draw random food from an index of free land, which is faster but plays a different game from the same seed")
+    game_group.add_option("--cutoff_turn", dest="cutoff_turn", type="int", default=150,
+                          help="Number of turns cutoff percentage is maintained to end game early")
+    game_group.add_option("--cutoff_percent", dest="cutoff_percent", type="float", default=0.85,
+                          help="Number of turns cutoff percentage is maintained to end game early")
+    game_group.add_option("--board", dest="board", default="list",
+                          help="Board storage for the engine. (list, numpy)")
+    game_group.add_option("--map_cache", dest="map_cache", default=None,
+                          help="Directory used to cache data derived from maps")
+    parser.add_option_group(game_group)
+
+    (opts, args) = parser.parse_args(argv)
+    if not opts.map or not args:
+        parser.print_help()
+        return -1
+
+    # check the number of bots against each map, seats are filled per game
+    for map_file in opts.map:
+        with open(map_file) as f:
+            players = map_players(f.read())
+        if players is not None and players != len(args):
+            if not (players > len(args) and opts.fill):
+                print("Incorrect number of bots for map %s.  Need %s, got %s"
+                      % (map_file, players, len(args)), file=sys.stderr)
+                return -1
+
+    start_time = time.time()
+    results = run_batch(opts, args)
+    summary = summarize(results)
+    summary['time'] = time.time() - start_time
+
+    if opts.json:
+        print(json.dumps(summary, indent=2, sort_keys=True))
+        return 0
+    print('%s games, %s turns, %.1fs, %.1f turns/s, mean length %.1f'
+          % (summary['games'], summary['turns'], summary['time'],
+             summary['turns'] / summary['time'], summary['game_length']))
+    for cutoff, count in sorted(summary['cutoff'].items()):
+        print('  %5s %s' % (count, cutoff))
+    print('%-20s %6s %6s %6s %6s %8s %6s %8s  %s'
+          % ('bot', 'games', 'seats', 'wins', 'draws', 'score', 'rank', 'time', 'status'))
+    for name, stats in sorted(summary['bots'].items()):
+        print('%-20s %6s %6s %6s %6s %8.2f %6.2f %8.1f  %s'
+              % (os.path.basename(name), stats['games'], stats['seats'], stats['wins'], stats['draws'],
+                 stats['score'], stats['rank'],
+                 stats['time'], ' '.join('%s:%s' % item for item in sorted(stats['status'].items()))))
+    print('%-30s %6s %6s %8s  %s' % ('map', 'games', 'turns', 'ms/turn', 'slowest phase'))
+    for name, stats in sorted(summary['maps'].items()):
+        engine_time = stats['engine_time']
+        slowest = max(engine_time, key=engine_time.get) if engine_time else '-'
+        print('%-30s %6s %6s %8.2f  %s %.2f'
+              % (name, stats['games'], stats['turns'], sum(engine_time.values()),
+                 slowest, engine_time.get(slowest, 0)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import json
 
 # Games used by the engine should implement the following methods
 class Game:
@@ -70,3 +71,11 @@ class Game:
     # used for getting a compact replay of the game
     def get_replay(self):
         pass
+
+    # used for writing the replay as json without building it all at once
+    def write_replay(self, replay_file):
+        json.dump(self.get_replay(), replay_file, sort_keys=True)
+
+    # seconds spent in each phase of the turns, used to find slow maps
+    def get_phase_times(self):
+        return {}
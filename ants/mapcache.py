@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+    On-disk cache of the structures the engine derives from a map
+
+    Files are named after a hash of the map text and the options that
+    change the derived data, and hold a list of integer arrays.
+    A file that is missing, truncated or for another key is ignored and
+    the engine rebuilds it.
+
+    encode_arrays and decode_arrays are also used for engine snapshots.
+    Each array is written as its typecode, a 4 byte length and the
+    native machine values.
+"""
+import os
+import sys
+import struct
+import hashlib
+import tempfile
+from array import array
+
+MAGIC = b'ANTSMAP\x00'
+VERSION = 2
+
+def cache_key(map_text, viewradius, scenario):
+    """ Return the hex digest used to name the cache file of a map
+
+        The interpreter version is included since the order of the food
+          set locations depends on how it hashes tuples.
+    """
+    key = hashlib.sha1()
+    key.update(map_text.encode('utf-8'))
+    key.update(('\n%s %s %s %s.%s' % (VERSION, viewradius, bool(scenario),
+                                      sys.version_info[0], sys.version_info[1])
+               ).encode('ascii'))
+    return key.hexdigest()
+
+def cache_path(cache_dir, key):
+    return os.path.join(cache_dir, key + '.cache')
+
+def load(cache_dir, key):
+    """ Return the arrays stored for key, or None if there is no valid file """
+    try:
+        with open(cache_path(cache_dir, key), 'rb') as cache_file:
+            data = cache_file.read()
+    except (IOError, OSError):
+        return None
+    header = MAGIC + key.encode('ascii')
+    if not data.startswith(header):
+        return None
+    try:
+        return decode_arrays(data, len(header))
+    except (ValueError, struct.error):
+        return None
+
+def save(cache_dir, key, arrays):
+    """ Write the arrays for key
+
+        The file is written under a temporary name and renamed so other
+          processes never read a partial file.
+    """
+    data = MAGIC + key.encode('ascii') + encode_arrays(arrays)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # another process may have made it first
+            if not os.path.isdir(cache_dir):
+                raise
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as cache_file:
+            cache_file.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, cache_path(cache_dir, key))
+    except:
+        os.remove(tmp_path)
+        raise
+
+def encode_arrays(arrays):
+    """ Pack a list of arrays into bytes
+
+        Plain lists are stored as arrays of ints.
+    """
+    parts = []
+    for values in arrays:
+        if not isinstance(values, array):
+            values = array('i', values)
+        tobytes = getattr(values, 'tobytes', None) or values.tostring
+        parts.append(struct.pack('<cI', values.typecode.encode('ascii'), len(values)))
+        parts.append(tobytes())
+    return b''.join(parts)
+
+def decode_arrays(data, offset=0):
+    """ Unpack the arrays packed by encode_arrays into lists
+
+        Raises ValueError or struct.error if the data is truncated
+    """
+    arrays = []
+    while offset < len(data):
+        typecode, length = struct.unpack_from('<cI', data, offset)
+        offset += struct.calcsize('<cI')
+        values = array(str(typecode.decode('ascii')))
+        end = offset + length * values.itemsize
+        if end > len(data):
+            raise ValueError("truncated array")
+        frombytes = getattr(values, 'frombytes', None) or values.fromstring
+        frombytes(data[offset:end])
+        arrays.append(values.tolist())
+        offset = end
+    return arrays
+
+def pack_lists(lists):
+    """ Flatten a list of int lists into one list of ints """
+    flat = [len(lists)]
+    for values in lists:
+        flat.append(len(values))
+        flat.extend(values)
+    return flat
+
+def unpack_lists(flat):
+    """ Reverse of pack_lists """
+    lists = []
+    offset = 1
+    for _ in range(flat[0]):
+        length = flat[offset]
+        if offset + 1 + length > len(flat):
+            raise ValueError("truncated list")
+        lists.append(flat[offset+1:offset+1+length])
+        offset += 1 + length
+    return lists
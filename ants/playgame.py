@@ -18,7 +18,7 @@ from ants import Ants
 
 sys.path.append("../worker")
 try:
-    from engine import run_game
+    from engine import run_game, get_cmd_wd
 except ImportError:
     # this can happen if we're launched with cwd outside our own dir
     # get our full path, then work relative from that
@@ -27,7 +27,7 @@ except ImportError:
         sys.path.insert(0, cmd_folder)
     sys.path.append(cmd_folder + "/../worker")
     # try again
-    from engine import run_game
+    from engine import run_game, get_cmd_wd
 
 # make stderr red text
 try:
@@ -112,6 +112,12 @@ def main(argv):
     parser.add_option("--turntime", dest="turntime",
                       default=1000, type="int",
                       help="Amount of time to give each bot, in milliseconds")
+    parser.add_option("--cpu_time", dest="cpu_time",
+                      action="store_true", default=False,
+                      help="Time bots by the cpu time they use instead of wall clock time")
+    parser.add_option("--cpu_backstop", dest="cpu_backstop",
+                      default=3.0, type="float",
+                      help="With --cpu_time, times out bots after this many times the turn time of wall clock time")
     parser.add_option("--loadtime", dest="loadtime",
                       default=3000, type="int",
                       help="Amount of time to give for load, in milliseconds")
@@ -148,7 +154,7 @@ def main(argv):
     game_group = OptionGroup(parser, "Game Options", "Options that affect the game mechanics for ants")
     game_group.add_option("--attack", dest="attack",
                           default="focus",
-                          help="Attack method to use for engine. (closest, focus, support, damage)")
+                          help="Attack method to use for engine. (closest, focus, focus_batch, support, damage)")
     game_group.add_option("--kill_points", dest="kill_points",
                           default=2, type="int",
                           help="Points awarded for killing a hill")
@@ -172,12 +178,21 @@ def main(argv):
                           help="One over percentage of land area filled with food at start")
     game_group.add_option("--food_visible", dest="food_visible", nargs=2, type="int", default=(3,5),
                           help="Amount of food guaranteed to be visible to starting ants")
+    game_group.add_option("--food_index", dest="food_index",
+                          action='store_true', default=False,
+                          help="Draw random food from an index of free land, which is faster but plays a different game from the same seed")
     game_group.add_option("--cutoff_turn", dest="cutoff_turn", type="int", default=150,
                           help="Number of turns cutoff percentage is maintained to end game early")
     game_group.add_option("--cutoff_percent", dest="cutoff_percent", type="float", default=0.85,
                           help="Number of turns cutoff percentage is maintained to end game early")
     game_group.add_option("--scenario", dest="scenario",
                           action='store_true', default=False)
+    game_group.add_option("--board", dest="board",
+                          default="list",
+                          help="Board storage for the engine. (list, numpy)")
+    game_group.add_option("--map_cache", dest="map_cache",
+                          default=None,
+                          help="Directory used to cache data derived from maps")
     parser.add_option_group(game_group)
 
     # the log directory must be specified for any logging to occur, except:
@@ -255,24 +270,6 @@ def main(argv):
         return -1
 
 def run_rounds(opts,args):
-    def get_cmd_wd(cmd, exec_rel_cwd=False):
-        ''' get the proper working directory from a command line '''
-        new_cmd = []
-        wd = None
-        for i, part in reversed(list(enumerate(cmd.split()))):
-            if wd == None and os.path.exists(part):
-                wd = os.path.dirname(os.path.realpath(part))
-                basename = os.path.basename(part)
-                if i == 0:
-                    if exec_rel_cwd:
-                        new_cmd.insert(0, os.path.join(".", basename))
-                    else:
-                        new_cmd.insert(0, part)
-                else:
-                    new_cmd.insert(0, basename)
-            else:
-                new_cmd.insert(0, part)
-        return wd, ' '.join(new_cmd)
     def get_cmd_name(cmd):
         ''' get the name of a bot from the command line '''
         for i, part in enumerate(reversed(cmd.split())):
@@ -294,9 +291,12 @@ def run_rounds(opts,args):
         "food_turn": opts.food_turn,
         "food_start": opts.food_start,
         "food_visible": opts.food_visible,
+        "food_index": opts.food_index,
         "cutoff_turn": opts.cutoff_turn,
         "cutoff_percent": opts.cutoff_percent,
-        "scenario": opts.scenario }
+        "scenario": opts.scenario,
+        "board": opts.board,
+        "map_cache": opts.map_cache }
     if opts.player_seed != None:
         game_options['player_seed'] = opts.player_seed
     if opts.engine_seed != None:
@@ -312,6 +312,8 @@ def run_rounds(opts,args):
         "log_output": opts.log_output,
         "log_error": opts.log_error,
         "serial": opts.serial,
+        "cpu_time": opts.cpu_time,
+        "cpu_backstop": opts.cpu_backstop,
         "strict": opts.strict,
         "capture_errors": opts.capture_errors,
         "secure_jail": opts.secure_jail,
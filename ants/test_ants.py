@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+    Checks of the ants engine on games played with random orders
+    python -m pytest test_ants.py
+"""
+import os
+import io
+import json
+import random
+import pytest
+from ants import Ants
+
+# maps and attacks the boards are compared on
+BOARD_GAMES = [(os.path.join('random_walk', 'random_walk_04p_01.map'), 'focus'),
+               (os.path.join('maze', 'maze_04p_01.map'), 'closest'),
+               (os.path.join('multi_hill_maze', 'maze_02p_01.map'), 'support'),
+               (os.path.join('example', 'tutorial1.map'), 'damage')]
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps')
+
+def game_options(map_file, **options):
+    with open(os.path.join(MAPS_DIR, map_file)) as f:
+        map_text = f.read()
+    game_options = {'map': map_text, 'turns': 150, 'loadtime': 3000,
+                    'turntime': 1000, 'attack': 'focus', 'food': 'symmetric',
+                    'viewradius2': 77, 'attackradius2': 5, 'spawnradius2': 1,
+                    'engine_seed': 42, 'player_seed': 7}
+    game_options.update(options)
+    return game_options
+
+def play_turns(game, turns, rng):
+    """ Play turns with a random order for most ants of each player
+
+        Returns the states sent to the players.
+    """
+    states = []
+    if game.turn == 0:
+        game.start_game()
+    for _ in range(turns):
+        if game.game_over():
+            break
+        states.append([game.get_player_state(player)
+                       for player in range(game.num_players)
+                       if game.is_alive(player)])
+        game.start_turn()
+        for player in range(game.num_players):
+            if game.is_alive(player):
+                orders = ['o %s %s %s' % (ant.loc[0], ant.loc[1], rng.choice('nesw'))
+                          for ant in sorted(game.player_ants(player),
+                                            key=lambda ant: ant.loc)
+                          if rng.random() < 0.8]
+                game.do_moves(player, orders)
+        game.finish_turn()
+    return states
+
+def without_times(replay):
+    """ The replay without the times the engine took """
+    replay = dict(replay)
+    del replay['engine_time']
+    return replay
+
+def play_game(options, seed=0):
+    """ Play a whole game, returns the states and the replay """
+    game = Ants(options)
+    states = play_turns(game, game.turns, random.Random(seed))
+    game.finish_game()
+    return game, states
+
+def test_spool_replay():
+    options = game_options(os.path.join('random_walk', 'random_walk_04p_01.map'))
+    game, states = play_game(options)
+    spooled_game, spooled_states = play_game(dict(options, spool_replay=True))
+    assert spooled_states == states
+    replay = game.get_replay()
+    spooled_replay = spooled_game.get_replay()
+    replay_file = io.StringIO()
+    spooled_game.write_replay(replay_file)
+    assert json.loads(replay_file.getvalue()) == spooled_replay
+    # the spooled replay lists dead ants and removed food first
+    for key in ('ants', 'food'):
+        assert sorted(spooled_replay.pop(key)) == sorted(replay.pop(key))
+    assert without_times(spooled_replay) == without_times(replay)
+    assert any(ant.killed for ant in game.all_ants)
+    # only the ants killed in the last turn are kept
+    assert all(ant.die_turn == spooled_game.turn
+               for ant in spooled_game.all_ants if ant.killed)
+
+@pytest.mark.parametrize('map_file,attack', BOARD_GAMES)
+def test_numpy_board(map_file, attack):
+    pytest.importorskip('numpy')
+    options = game_options(map_file, attack=attack, turns=100)
+    game, states = play_game(options)
+    numpy_game, numpy_states = play_game(dict(options, board='numpy'))
+    assert numpy_states == states
+    assert without_times(numpy_game.get_replay()) == without_times(game.get_replay())
+
+@pytest.mark.parametrize('board', ['list', 'numpy'])
+def test_snapshot(board):
+    if board == 'numpy':
+        pytest.importorskip('numpy')
+    options = game_options(os.path.join('maze', 'maze_04p_01.map'), board=board)
+    game = Ants(options)
+    rng = random.Random(0)
+    play_turns(game, 30, rng)
+    # snapshot a turn with dead ants to report
+    while not game.killed_ants and game.turn < 100:
+        play_turns(game, 1, rng)
+    assert game.killed_ants
+    blob = game.snapshot()
+    states = play_turns(game, 90, random.Random(1))
+    game.finish_game()
+
+    restored = Ants(options)
+    restored.restore(blob)
+    assert restored.snapshot() == blob
+    assert play_turns(restored, 90, random.Random(1)) == states
+    restored.finish_game()
+    assert without_times(restored.get_replay()) == without_times(game.get_replay())
+
+def test_map_cache(tmp_path):
+    options = game_options(os.path.join('maze', 'maze_04p_01.map'))
+    game, states = play_game(options)
+    cached_options = dict(options, map_cache=str(tmp_path))
+    for run in ('cold', 'warm'):
+        cached_game, cached_states = play_game(cached_options)
+        assert os.listdir(str(tmp_path)), run
+        assert cached_states == states, run
+        assert without_times(cached_game.get_replay()) == \
+            without_times(game.get_replay()), run
+
+def test_parse_orders():
+    game = Ants(game_options(os.path.join('maze', 'maze_04p_01.map')))
+    rng = random.Random(0)
+    numbers = ['0', '7', '42', '007', str(game.height), '100000']
+    for _ in range(100):
+        lines = ['o %s %s %s' % (rng.choice(numbers), rng.choice(numbers),
+                                 rng.choice('nesw'))
+                 for _ in range(rng.randrange(1, 20))]
+        orders, valid, ignored, invalid = game.parse_orders(0, lines)
+        # a comment keeps the lines from being parsed as a batch
+        line_orders, line_valid, _, _ = game.parse_orders(0, lines + ['# by line'])
+        assert (orders, valid, ignored, invalid) == (line_orders, line_valid, [], [])
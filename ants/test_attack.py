@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+    Checks that do_attack_focus_batch kills the same ants as do_attack_focus
+    python -m pytest test_attack.py
+
+    The ants of each turn of the example games of the website are placed
+    on two boards, and so are crowded boards of random ants, where most
+    ants fight and offsets wrap around small maps.
+"""
+import os
+import sys
+import random
+import pytest
+numpy = pytest.importorskip('numpy')
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'util'))
+from ants import Ants
+from attack_compare import load_replay, create_game, ants_by_turn, attack
+
+EXAMPLE_GAMES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', 'website', 'example_games')
+
+def random_game(size, attackradius2, board):
+    """ Create an empty scenario on an open map """
+    map_text = ['rows %s' % size, 'cols %s' % size, 'players 4']
+    map_text += ['m ' + '.' * size] * size
+    return Ants({'map': '\n'.join(map_text), 'turns': 1, 'loadtime': 0,
+                 'turntime': 0, 'viewradius2': 77, 'attackradius2': attackradius2,
+                 'spawnradius2': 1, 'engine_seed': 0, 'player_seed': 0,
+                 'scenario': True, 'board': board})
+
+def test_example_games():
+    filenames = sorted(os.listdir(EXAMPLE_GAMES))
+    assert filenames
+    kills = 0
+    for filename in filenames:
+        _, replay = load_replay(os.path.join(EXAMPLE_GAMES, filename))
+        game = create_game(replay, 'list')
+        batch_game = create_game(replay, 'numpy')
+        for turn, ants in ants_by_turn(replay):
+            killed = attack(game, ants, game.do_attack_focus)
+            assert attack(batch_game, ants, batch_game.do_attack_focus_batch) == killed, \
+                '%s turn %s' % (filename, turn)
+            kills += len(killed)
+    assert kills > 0
+
+def test_crowded_boards():
+    rng = random.Random(0)
+    kills = 0
+    for size, count, attackradius2 in [(4, 6, 5), (6, 20, 5), (30, 300, 5),
+                                       (60, 900, 5), (30, 200, 13)]:
+        game = random_game(size, attackradius2, 'list')
+        batch_game = random_game(size, attackradius2, 'numpy')
+        squares = [(row, col) for row in range(size) for col in range(size)]
+        for _ in range(5):
+            ants = dict((loc, rng.randrange(4)) for loc in rng.sample(squares, count))
+            killed = attack(game, ants, game.do_attack_focus)
+            assert attack(batch_game, ants, batch_game.do_attack_focus_batch) == killed, \
+                (size, count)
+            kills += len(killed)
+    assert kills > 0
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+    Compares the kills of the two focus attack implementations
+    ./attack_compare.py replay [replay ...]
+
+    Each replay is stepped through turn by turn.  The ants that are alive
+    after the moves of a turn are placed on two boards, one resolved with
+    do_attack_focus and one with do_attack_focus_batch, and the sets of
+    ants killed must be the same.
+
+    Replays may be plain replay data or a game result with replaydata.
+"""
+
+import sys
+import os
+from collections import defaultdict
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from ants import Ants, AIM
+from replay_verify import load_replay
+
+def create_game(replay, board):
+    """ Create an empty scenario with the water of the replay map """
+    rows = replay['map']['rows']
+    cols = replay['map']['cols']
+    map_text = ['rows %s' % rows, 'cols %s' % cols,
+                'players %s' % replay['players']]
+    for line in replay['map']['data']:
+        map_text.append('m ' + ''.join(c if c == '%' else '.' for c in line))
+    options = {
+        'map': '\n'.join(map_text),
+        'turns': replay.get('turns', 1),
+        'loadtime': replay.get('loadtime', 0),
+        'turntime': replay.get('turntime', 0),
+        'viewradius2': replay.get('viewradius2', 55),
+        'attackradius2': replay['attackradius2'],
+        'spawnradius2': replay.get('spawnradius2', 1),
+        'engine_seed': 0,
+        'player_seed': 0,
+        'scenario': True,
+        'board': board
+    }
+    return Ants(options)
+
+def ants_by_turn(replay):
+    """ Yields the turn and the ants present when attacks are resolved
+
+        Ants that collide with each other are removed, the same as
+          do_orders does before attacking.
+    """
+    rows = replay['map']['rows']
+    cols = replay['map']['cols']
+    last_turn = max([ant[3] for ant in replay['ants']] + [0])
+    locs = [(ant[0], ant[1]) for ant in replay['ants']]
+    for turn in range(1, last_turn + 1):
+        next_loc = defaultdict(list)
+        for i, (row, col, spawn_turn, end_turn, owner, orders) in enumerate(replay['ants']):
+            if spawn_turn < turn <= end_turn and turn - spawn_turn <= len(orders):
+                d_row, d_col = AIM.get(orders[turn - spawn_turn - 1], (0, 0))
+                locs[i] = ((locs[i][0] + d_row) % rows, (locs[i][1] + d_col) % cols)
+                next_loc[locs[i]].append(owner)
+        yield turn, dict((loc, owners[0]) for loc, owners in next_loc.items()
+                         if len(owners) == 1)
+
+def attack(game, ants, do_attack):
+    """ Place the ants on the board and return the locations of the killed ants """
+    for ant in list(game.current_ants.values()):
+        game.kill_ant(ant)
+    for loc, owner in sorted(ants.items()):
+        game.add_initial_ant(loc, owner)
+    game.killed_ants = []
+    do_attack()
+    return sorted(ant.loc for ant in game.killed_ants)
+
+def compare_replay(filename):
+    _, replay = load_replay(filename)
+    game = create_game(replay, 'list')
+    batch_game = create_game(replay, 'numpy')
+    turns = kills = 0
+    for turn, ants in ants_by_turn(replay):
+        killed = attack(game, ants, game.do_attack_focus)
+        batch_killed = attack(batch_game, ants, batch_game.do_attack_focus_batch)
+        if killed != batch_killed:
+            print("%s: turn %s kills differ" % (filename, turn))
+            print("    do_attack_focus:       %s" % (killed,))
+            print("    do_attack_focus_batch: %s" % (batch_killed,))
+            return False
+        turns += 1
+        kills += len(killed)
+    print("%s: %s turns, %s kills match" % (filename, turns, kills))
+    return True
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: attack_compare.py replay [replay ...]")
+        sys.exit(2)
+    results = [compare_replay(filename) for filename in sys.argv[1:]]
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+    Replays the orders of recorded games through the engine and checks
+    that the outcome is the same
+    ./replay_verify.py [options] replay [replay ...]
+
+    The starting map is rebuilt from the water and hills of the replay
+    and each ant is given the orders stored for it, with no bots running.
+    The ants, food, hills, scores and cutoff of the new game must match
+    the recorded ones.  The number of engine turns played per second is
+    reported, so the tool also works as a benchmark of the engine.
+
+    Replays may be plain replay data or a game result with replaydata.
+    Game results also hold the status of each bot, which is used to kill
+    the bots that crashed, timed out or made invalid moves on the same
+    turn as the original game.
+
+    The food options are stored in the replay after being picked from
+    their ranges, so the ranges the game was played with must be given
+    if they are not the defaults.  Games must be checked with the same
+    major version of python they were played with, since it changes the
+    order food locations are chosen in.  Games played with --food_index
+    must be checked with it too.
+"""
+
+import sys
+import os
+import json
+import time
+from random import shuffle
+from optparse import OptionParser
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+from ants import Ants, AIM
+
+# replay keys compared with the recorded game
+REPLAY_KEYS = ('ants', 'food', 'hills', 'scores', 'bonus', 'hive_history',
+               'winning_turn', 'ranking_turn', 'cutoff')
+
+def load_replay(filename):
+    """ Return the game result, or None, and the replay data of a file """
+    with open(filename) as replay_file:
+        data = json.load(replay_file)
+    result = None
+    if 'replaydata' in data:
+        result = data
+        data = data['replaydata']
+        if not isinstance(data, dict):
+            data = json.loads(data)
+    return result, data
+
+def create_game(replay, opts):
+    """ Create the game with the starting map and options of the replay """
+    rows = replay['map']['rows']
+    cols = replay['map']['cols']
+    squares = [['%' if c == '%' else '.' for c in line]
+               for line in replay['map']['data']]
+    for row, col, owner in [hill[:3] for hill in replay['hills']]:
+        squares[row][col] = str(owner)
+    map_text = ['rows %s' % rows, 'cols %s' % cols,
+                'players %s' % replay['players']]
+    map_text.extend('m ' + ''.join(line) for line in squares)
+    options = {
+        'map': '\n'.join(map_text),
+        'turns': replay['turns'],
+        'loadtime': replay['loadtime'],
+        'turntime': replay['turntime'],
+        'viewradius2': replay['viewradius2'],
+        'attackradius2': replay['attackradius2'],
+        'spawnradius2': replay['spawnradius2'],
+        'engine_seed': replay['engine_seed'],
+        'player_seed': replay['player_seed'],
+        'attack': opts.attack,
+        'food': opts.food,
+        'food_rate': opts.food_rate,
+        'food_turn': opts.food_turn,
+        'food_start': opts.food_start,
+        'food_visible': opts.food_visible,
+        'food_index': opts.food_index,
+        'cutoff_turn': opts.cutoff_turn,
+        'cutoff_percent': opts.cutoff_percent,
+        'board': opts.board,
+        'map_cache': opts.map_cache
+    }
+    game = Ants(options)
+    for key in ('food_rate', 'food_turn', 'food_start'):
+        if getattr(game, key) != replay[key]:
+            raise Exception("options",
+                            "%s is %s, the game had %s, give the range used by the game"
+                            % (key, getattr(game, key), replay[key]))
+    return game
+
+def player_kills(result, num_players):
+    """ Return the players the engine killed, keyed by when it happened
+
+        Keys are ('start', 0) for bots that didn't start,
+          ('moves', turn) for bots that crashed or timed out while
+          sending moves and ('invalid', turn) for invalid moves.
+    """
+    kills = {}
+    if result is None:
+        return kills
+    for player in range(num_players):
+        status = result['status'][player]
+        turn = result['playerturns'][player]
+        if status == 'crashed 0':
+            key = ('start', 0)
+        elif status in ('crashed', 'timeout'):
+            key = ('moves', turn)
+        elif status == 'invalid':
+            key = ('invalid', turn)
+        else:
+            continue
+        kills.setdefault(key, []).append(player)
+    return kills
+
+def replay_moves(game, replay, turn, ant_index):
+    """ Return the order lines of each player for a turn
+
+        ant_index maps each ant to its position in the replay and is
+          extended with the ants created since the last turn, which
+          must be the same as the next ants of the replay.
+    """
+    for i in range(len(ant_index), len(game.all_ants)):
+        ant = game.all_ants[i]
+        if (i >= len(replay['ants']) or
+                replay['ants'][i][:3] != [ant.initial_loc[0], ant.initial_loc[1], ant.spawn_turn]):
+            raise Exception("replay", "turn %s ant %s differs from the replay" % (turn, i))
+        ant_index[ant] = i
+    moves = [[] for _ in range(game.num_players)]
+    for ant in game.current_ants.values():
+        orders = replay['ants'][ant_index[ant]][5]
+        step = turn - ant.spawn_turn - 1
+        if step < len(orders) and orders[step] in AIM:
+            moves[ant.owner].append('o %s %s %s' % (ant.loc[0], ant.loc[1], orders[step]))
+    return moves
+
+def simulate(game, replay, result):
+    """ Play the game with the recorded orders
+
+        Follows the order of calls made by the engine, including the
+          shuffle of the bots each turn which draws random numbers.
+        Returns the number of turns played.
+    """
+    kills = player_kills(result, game.num_players)
+    ant_index = {}
+    for player in kills.get(('start', 0), []):
+        game.kill_player(player)
+    for turn in range(game.turns + 1):
+        if turn == 0:
+            game.start_game()
+        else:
+            game.start_turn()
+        shuffle([player for player in range(game.num_players) if game.is_alive(player)])
+        for player in kills.get(('moves', turn), []):
+            game.kill_player(player)
+
+        if turn > 0 and not game.game_over():
+            moves = replay_moves(game, replay, turn, ant_index)
+            for player in range(game.num_players):
+                if game.is_alive(player):
+                    game.do_moves(player, moves[player])
+            for player in kills.get(('invalid', turn), []):
+                game.kill_player(player)
+
+        if turn > 0:
+            game.finish_turn()
+        if game.game_over():
+            break
+    game.finish_game()
+    return turn
+
+def compare(new, old):
+    """ Return a description of the first difference, or None """
+    if isinstance(new, list) and isinstance(old, list):
+        for i, (new_item, old_item) in enumerate(zip(new, old)):
+            difference = compare(new_item, old_item)
+            if difference is not None:
+                return '[%s]%s' % (i, difference)
+        if len(new) != len(old):
+            return ' has length %s, expected %s' % (len(new), len(old))
+        return None
+    if new != old:
+        return ' is %r, expected %r' % (new, old)
+    return None
+
+def verify_replay(filename, opts):
+    result, replay = load_replay(filename)
+    try:
+        start_time = time.time()
+        game = create_game(replay, opts)
+        setup_time = time.time() - start_time
+
+        start_time = time.time()
+        turns = simulate(game, replay, result)
+        turn_time = time.time() - start_time
+    except Exception as e:
+        if e.args[0] not in ("options", "replay"):
+            raise
+        print("%s: %s" % (filename, e.args[1]))
+        return False
+
+    new_replay = game.get_replay()
+    differences = []
+    for key in REPLAY_KEYS:
+        if key in replay:
+            difference = compare(new_replay[key], replay[key])
+            if difference is not None:
+                differences.append(key + difference)
+    if result is not None:
+        difference = compare(game.get_scores(), result['score'])
+        if difference is not None:
+            differences.append('score' + difference)
+        if turns != result['game_length']:
+            differences.append('game_length is %s, expected %s'
+                               % (turns, result['game_length']))
+
+    rate = turns / turn_time if turn_time else 0
+    print("%s: %s turns in %.3fs (%.1f turns/s), setup %.3fs"
+          % (filename, turns, turn_time, rate, setup_time))
+    for difference in differences:
+        print("    %s" % difference)
+    return not differences
+
+def main(argv):
+    usage = "Usage: %prog [options] replay [replay ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("--attack", dest="attack", default="focus",
+                      help="Attack method the game was played with")
+    parser.add_option("--food", dest="food", default="symmetric",
+                      help="Food spawning method the game was played with")
+    parser.add_option("--food_rate", dest="food_rate", nargs=2, type="int", default=(5,11),
+                      help="Range of the food_rate option of the game")
+    parser.add_option("--food_turn", dest="food_turn", nargs=2, type="int", default=(19,37),
+                      help="Range of the food_turn option of the game")
+    parser.add_option("--food_start", dest="food_start", nargs=2, type="int", default=(75,175),
+                      help="Range of the food_start option of the game")
+    parser.add_option("--food_visible", dest="food_visible", nargs=2, type="int", default=(3,5),
+                      help="Range of the food_visible option of the game")
+    parser.add_option("--food_index", dest="food_index", action="store_true", default=False,
+                      help="Draw random food from the index of free land, as the game did")
+    parser.add_option("--cutoff_turn", dest="cutoff_turn", type="int", default=150,
+                      help="Cutoff turns of the game")
+    parser.add_option("--cutoff_percent", dest="cutoff_percent", type="float", default=0.85,
+                      help="Cutoff percentage of the game")
+    parser.add_option("--board", dest="board", default="list",
+                      help="Board storage for the engine. (list, numpy)")
+    parser.add_option("--map_cache", dest="map_cache", default=None,
+                      help="Directory used to cache data derived from maps")
+    (opts, args) = parser.parse_args(argv)
+    if not args:
+        parser.print_help()
+        return 2
+    results = [verify_replay(filename, opts) for filename in args]
+    return 0 if all(results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
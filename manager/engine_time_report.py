@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+from __future__ import print_function
+
+import argparse
+from collections import defaultdict
+from os.path import basename, splitext
+
+import MySQLdb
+from server_info import server_info
+from sql import sql
+
+# maps taking this many times the median engine time per turn are flagged
+SLOW_FACTOR = 2.0
+
+
+def map_engine_times(cursor, days):
+    """ Return the engine milliseconds per turn for each map and phase """
+    cursor.execute(sql["select_map_engine_time"] % (days,))
+    maps = {}
+    for map_id, filename, phase, games, ms_per_turn in cursor.fetchall():
+        if map_id not in maps:
+            maps[map_id] = {'name': splitext(basename(filename))[0],
+                            'games': games,
+                            'phases': defaultdict(float)}
+        maps[map_id]['phases'][phase] = float(ms_per_turn)
+    return maps
+
+
+def main(days, min_games):
+    connection = MySQLdb.connect(host = server_info["db_host"],
+                                 user = server_info["db_username"],
+                                 passwd = server_info["db_password"],
+                                 db = server_info["db_name"])
+    cursor = connection.cursor()
+    maps = map_engine_times(cursor, days)
+    maps = dict((map_id, info) for map_id, info in maps.items()
+                if info['games'] >= min_games)
+    if not maps:
+        print("No games with engine times in the last %s days" % days)
+        return
+
+    totals = sorted(sum(info['phases'].values()) for info in maps.values())
+    median = totals[len(totals) // 2]
+    print("%-8s %-30s %6s %8s  %s" % ('map_id', 'map', 'games', 'ms/turn', 'slowest phase'))
+    for map_id, info in sorted(maps.items(),
+                               key=lambda item: -sum(item[1]['phases'].values())):
+        phases = info['phases']
+        total = sum(phases.values())
+        slowest = max(phases, key=phases.get)
+        print("%-8s %-30s %6s %8.2f  %s %.2f%s"
+              % (map_id, info['name'], info['games'], total, slowest, phases[slowest],
+                 ' SLOW' if total > median * SLOW_FACTOR else ''))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Report the engine time per turn of each map")
+    parser.add_argument("-d", "--days", default=7, type=int,
+            help="Only use games from this many days ago")
+    parser.add_argument("-g", "--min_games", default=10, type=int,
+            help="Skip maps with fewer games than this")
+    args = parser.parse_args()
+    main(args.days, args.min_games)
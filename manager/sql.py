@@ -14,6 +14,20 @@ sql = {
     # used in delete_some_old_submissions.py
     "select_latest_submissions": "select submission_id from submission where latest = 1",
     
+    # used in engine_time_report.py
+    "select_map_engine_time": """
+        select m.map_id, m.filename, et.phase,
+               count(distinct g.game_id) as games,
+               sum(et.seconds) * 1000 / sum(g.game_length) as ms_per_turn
+        from game g
+        inner join game_engine_time et
+            on et.game_id = g.game_id
+        inner join map m
+            on m.map_id = g.map_id
+        where g.timestamp > timestampadd(day, -%s, current_timestamp)
+        group by m.map_id, m.filename, et.phase
+        order by m.map_id, et.phase""",
+
     # used in manager.py
     "select_game_players": "select gp.submission_id, gp.game_rank, s.mu, s.sigma, gp.mu_after from game_player gp inner join submission s on s.submission_id = gp.submission_id where gp.game_id = %s",
 
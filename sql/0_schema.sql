@@ -28,6 +28,14 @@ CREATE TABLE `game` (
   KEY `game_map_id_timestamp_idx` (`map_id`, `timestamp`)
 );
 
+DROP TABLE IF EXISTS `game_engine_time`;
+CREATE TABLE `game_engine_time` (
+  `game_id` int(11) NOT NULL,
+  `phase` varchar(32) NOT NULL,
+  `seconds` float NOT NULL,
+  PRIMARY KEY (`game_id`,`phase`)
+);
+
 DROP TABLE IF EXISTS `game_player`;
 CREATE TABLE `game_player` (
   `game_id` int(11) NOT NULL,
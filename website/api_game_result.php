@@ -93,6 +93,16 @@ if (array_key_exists('error', $gamedata)) {
         die();
     }
     $game_id = mysql_insert_id();
+    // record engine time spent in each phase of the turns
+    if (isset($gamedata->engine_time)) {
+        foreach ($gamedata->engine_time as $phase => $seconds) {
+            if (!contest_query("insert_game_engine_time",
+                               $game_id, $phase, $seconds)) {
+                api_log(sprintf("Error inserting engine time for game %s",
+                                $game_id)."\n".mysql_error());
+            }
+        }
+    }
     // calculate new trueskill values
     $skill_result = contest_query("select_matchup_players", $gamedata->matchup_id);
     if (!$skill_result) {
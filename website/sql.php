@@ -86,6 +86,8 @@ $contest_sql = array(
                            select seed_id, map_id, current_timestamp, worker_id, %s, %s, '%s', %s, %s
                            from matchup
                            where matchup_id = %s;",
+    "insert_game_engine_time" => "insert into game_engine_time (game_id, phase, seconds)
+                                  values (%s, '%s', %s);",
     "insert_game_player" => "insert into game_player (game_id, user_id, submission_id, rank_before, player_id, errors, status, game_rank, game_score, valid, mu_before, mu_after, sigma_before, sigma_after)
                              select %s, p.user_id, p.submission_id,
                              (select rank from submission s where s.submission_id = p.submission_id),
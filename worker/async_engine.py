@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+    Plays many games at once in one process with asyncio
+    ./async_engine.py [options] bot [bot ...]
+
+    The bots are read from the pipes of their processes by the event
+    loop, so a game waiting on its bots costs nothing and other games
+    keep playing.  The turns are played by the engine, only the waits
+    for the bots are made by the event loop.  Each game uses the first
+    bots given, as many as the players of its map.
+
+    Bots are run without the secure jail, the same way House runs them.
+    This module needs python 3.
+"""
+import asyncio
+import os
+import random
+import shlex
+import signal
+import sys
+import time
+import traceback
+from optparse import OptionParser, OptionGroup
+from queue import Empty
+
+from engine import HeadTail, play_turns, make_result, store_replay, get_cmd_wd
+from sandbox import (OutputBuffer, STDOUT_LIMITS, STDERR_LIMITS, MAX_LINE_LENGTH,
+                     _is_go, _cpu_time, resume_all)
+
+class GameRandom(object):
+    """ The state of the random module for one game
+
+        The engine draws from the global random module, so games played
+          at the same time would draw from the same state.  Everything a
+          game does is wrapped in its GameRandom, which swaps the state of
+          the game in and out, so each game draws the same numbers as it
+          would alone.  There must be no awaits inside the with block.
+        The first time it is used the game starts from the current state,
+          and creating the game inside it then seeds its own state.
+    """
+    def __init__(self):
+        self.state = None
+        self.outer_state = None
+
+    def __enter__(self):
+        self.outer_state = random.getstate()
+        if self.state is not None:
+            random.setstate(self.state)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.state = random.getstate()
+        random.setstate(self.outer_state)
+        return False
+
+class AsyncBot(object):
+    """ A bot process read by the event loop
+
+        It has the methods of the sandboxes that the engine uses, so the
+          engine can play its turns.  Its output is kept in the same
+          buffers, with the same quotas, and output_event is set whenever
+          it writes a line or exits.
+    """
+    def __init__(self, working_directory, output_event):
+        self.working_directory = working_directory
+        self.output_event = output_event
+        self.process = None
+        self.stdout_queue = OutputBuffer(*STDOUT_LIMITS, keep=_is_go)
+        self.stderr_queue = OutputBuffer(*STDERR_LIMITS)
+        self.readers = []
+
+    @property
+    def is_alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def cpu_time(self):
+        """ Cpu seconds used by the bot, or None if unknown """
+        if self.process is None:
+            return None
+        return _cpu_time(self.process.pid)
+
+    async def start(self, shell_command):
+        """ Start the bot, returns False if it could not be started """
+        shell_command = shlex.split(shell_command.replace('\\','/'))
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *shell_command,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self.working_directory,
+                limit=MAX_LINE_LENGTH)
+        except OSError:
+            return False
+        self.readers = [
+            asyncio.ensure_future(self._read(self.process.stdout, self.stdout_queue)),
+            asyncio.ensure_future(self._read(self.process.stderr, self.stderr_queue))]
+        return True
+
+    async def _read(self, stream, queue):
+        while True:
+            try:
+                line = await stream.readline()
+            except ValueError:
+                # longer than MAX_LINE_LENGTH, the rest of it is dropped
+                continue
+            if not line:
+                break
+            line = line.decode('utf-8', 'replace').rstrip('\r\n')
+            queue.put(line, len(line))
+            self.output_event.set()
+        queue.put(None)
+        self.output_event.set()
+
+    def read_line(self):
+        """ Return a line of stdout that has been read, or None """
+        try:
+            return self.stdout_queue.get(block=False)
+        except Empty:
+            return None
+
+    def read_error(self):
+        """ Return a line of stderr that has been read, or None """
+        try:
+            return self.stderr_queue.get(block=False)
+        except Empty:
+            return None
+
+    def reset_output(self):
+        """ Let the bot write a new quota of output """
+        self.stdout_queue.reset()
+        self.stderr_queue.reset()
+
+    @property
+    def overflow(self):
+        """ Lines and characters of output dropped for being over the quota """
+        return {'stdout_lines': self.stdout_queue.dropped_lines,
+                'stdout_chars': self.stdout_queue.dropped_chars,
+                'stderr_lines': self.stderr_queue.dropped_lines,
+                'stderr_chars': self.stderr_queue.dropped_chars}
+
+    def write(self, data):
+        if not self.is_alive:
+            return False
+        try:
+            self.process.stdin.write(data.encode('utf-8'))
+        except (OSError, RuntimeError):
+            self.kill()
+
+    def pause(self):
+        self._signal(signal.SIGSTOP)
+
+    def resume(self):
+        self._signal(signal.SIGCONT)
+
+    def _signal(self, signum):
+        try:
+            self.process.send_signal(signum)
+        except (AttributeError, OSError, ProcessLookupError):
+            pass
+
+    def _send_signal(self, action):
+        """ Pause or resume the bot for pause_all and resume_all """
+        getattr(self, action)()
+        return False
+
+    def kill(self):
+        if self.is_alive:
+            try:
+                self.process.kill()
+            except (OSError, ProcessLookupError):
+                pass
+
+    async def release(self):
+        """ Wait for the killed bot and the readers of its output """
+        if self.process is not None:
+            await self.process.wait()
+            await asyncio.gather(*self.readers, return_exceptions=True)
+
+async def run_game(game, botcmds, options, game_random=None):
+    """ Play a game between bots and return the game result
+
+        Takes the same options as engine.run_game, and plays the turns
+          with engine.play_turns.  game_random must be the GameRandom the
+          game was created in, or None if no other games are played at
+          the same time.
+    """
+    if game_random is None:
+        game_random = GameRandom()
+    replay_log = options.get('replay_log', None)
+    replay_spool = options.get('replay_spool', None)
+    verbose_log = options.get('verbose_log', None)
+    error_logs = options.get('error_logs', [None]*len(botcmds))
+
+    capture_errors = options.get('capture_errors', False)
+    capture_errors_max = options.get('capture_errors_max', 510)
+
+    end_wait = options.get('end_wait', 0.0)
+
+    location = options.get('location', 'localhost')
+    game_id = options.get('game_id', 0)
+
+    error = ''
+
+    bots = []
+    bot_status = []
+    bot_turns = []
+    turn = 0
+    if capture_errors:
+        error_logs = [HeadTail(log, capture_errors_max) for log in error_logs]
+    # set by the bots when any of them writes output
+    output_event = asyncio.Event()
+    try:
+        # create bot processes
+        for b, bot in enumerate(botcmds):
+            bot_cwd, bot_cmd = bot
+            process = AsyncBot(bot_cwd, output_event)
+            started = await process.start(bot_cmd)
+            bots.append(process)
+            bot_status.append('survived')
+            bot_turns.append(0)
+
+            # ensure it started
+            if not started or not process.is_alive:
+                bot_status[-1] = 'crashed 0'
+                bot_turns[-1] = 0
+                if verbose_log:
+                    verbose_log.write('bot %s did not start\n' % b)
+                with game_random:
+                    game.kill_player(b)
+            process.pause()
+
+        turns = play_turns(game, bots, options, bot_status, bot_turns, error_logs)
+        while True:
+            with game_random:
+                request = next(turns, None)
+            if request is None:
+                break
+            action, value = request
+            if action == 'turn':
+                turn = value
+            elif action == 'output':
+                try:
+                    await asyncio.wait_for(output_event.wait(), value)
+                except asyncio.TimeoutError:
+                    pass
+                output_event.clear()
+            else:
+                await asyncio.sleep(value)
+
+    except Exception:
+        error = traceback.format_exc()
+        if verbose_log:
+            verbose_log.write(error)
+    finally:
+        if end_wait:
+            resume_all(bots)
+            if verbose_log:
+                verbose_log.write('waiting {0} seconds for bots to process end turn\n'.format(end_wait))
+            await asyncio.sleep(end_wait)
+        for bot in bots:
+            bot.kill()
+        for bot in bots:
+            await bot.release()
+
+    with game_random:
+        if error:
+            game_result = { 'error': error }
+        else:
+            game_result = make_result(game, turn, bot_status, bot_turns,
+                                      location, game_id)
+            # output dropped from bots that wrote more than their quota
+            game_result['overflow'] = [bot.overflow for bot in bots]
+            if capture_errors:
+                game_result['errors'] = [head.headtail() for head in error_logs]
+        store_replay(game_result, None if error else game, replay_log, replay_spool)
+    return game_result
+
+async def run_games(tasks, max_games):
+    """ Play games at the same time and return their results in order
+
+        tasks is a list of (new_game, botcmds, options), new_game is
+          called with no arguments to create the game just before it is
+          played.  At most max_games are played at once.
+    """
+    limit = asyncio.Semaphore(max_games)
+
+    async def play(new_game, botcmds, options):
+        async with limit:
+            game_random = GameRandom()
+            with game_random:
+                game = new_game()
+            return await run_game(game, botcmds, options, game_random)
+
+    return await asyncio.gather(*[play(*task) for task in tasks])
+
+def main(argv):
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ants'))
+    from ants import Ants
+
+    usage = "Usage: %prog [options] bot [bot ...]"
+    parser = OptionParser(usage=usage)
+    parser.add_option("-m", "--map_file", dest="map_files", action="append", default=[],
+                      help="Map to play on, give more than once to rotate maps")
+    parser.add_option("-g", "--games", dest="games", type="int", default=10,
+                      help="Number of games to play")
+    parser.add_option("-c", "--concurrency", dest="concurrency", type="int", default=8,
+                      help="Most games played at once")
+    parser.add_option("-t", "--turns", dest="turns", type="int", default=1000,
+                      help="Number of turns in the game")
+    parser.add_option("--loadtime", dest="loadtime", type="int", default=3000,
+                      help="Amount of time to give for load, in milliseconds")
+    parser.add_option("--turntime", dest="turntime", type="int", default=1000,
+                      help="Amount of time to give each bot, in milliseconds")
+    parser.add_option("--cpu_time", dest="cpu_time",
+                      action="store_true", default=False,
+                      help="Time bots by the cpu time they use instead of wall clock time")
+    parser.add_option("--cpu_backstop", dest="cpu_backstop",
+                      default=3.0, type="float",
+                      help="With --cpu_time, times out bots after this many times the turn time of wall clock time")
+    parser.add_option("--engine_seed", dest="engine_seed", type="int", default=None,
+                      help="Random number seed of the first game, incremented per game")
+    parser.add_option("--player_seed", dest="player_seed", type="int", default=None,
+                      help="Random number seed for the players")
+    parser.add_option("--end_wait", dest="end_wait", type="float", default=0.0,
+                      help="Seconds to wait at the end for bots to process the end")
+    parser.add_option("--log_dir", dest="log_dir", default=None,
+                      help="Directory to write the game results with replays to")
+
+    # the same game options and defaults as playgame.py
+    game_group = OptionGroup(parser, "Game Options", "Options that affect the game mechanics for ants")
+    game_group.add_option("--attack", dest="attack", default="focus",
+                          help="Attack method to use for engine. (closest, focus, focus_batch, support, damage)")
+    game_group.add_option("--food", dest="food", default="symmetric",
+                          help="Food spawning method. (none, random, sections, symmetric)")
+    game_group.add_option("--viewradius2", dest="viewradius2", default=77, type="int",
+                          help="Vision radius of ants squared")
+    game_group.add_option("--spawnradius2", dest="spawnradius2", default=1, type="int",
+                          help="Spawn radius of ants squared")
+    game_group.add_option("--attackradius2", dest="attackradius2", default=5, type="int",
+                          help="Attack radius of ants squared")
+    game_group.add_option("--food_rate", dest="food_rate", nargs=2, type="int", default=(5,11),
+                          help="Numerator of food per turn per player rate")
+    game_group.add_option("--food_turn", dest="food_turn", nargs=2, type="int", default=(19,37),
+                          help="Denominator of food per turn per player rate")
+    game_group.add_option("--food_start", dest="food_start", nargs=2, type="int", default=(75,175),
+                          help="One over percentage of land area filled with food at start")
+    game_group.add_option("--food_visible", dest="food_visible", nargs=2, type="int", default=(3,5),
+                          help="Amount of food guaranteed to be visible to starting ants")
+    game_group.add_option("--food_index", dest="food_index",
+                          action='store_true', default=False,
+                          help="Draw random food from an index of free land, which is faster but plays a different game from the same seed")
+    game_group.add_option("--cutoff_turn", dest="cutoff_turn", type="int", default=150,
+                          help="Number of turns cutoff percentage is maintained to end game early")
+    game_group.add_option("--cutoff_percent", dest="cutoff_percent", type="float", default=0.85,
+                          help="Number of turns cutoff percentage is maintained to end game early")
+    game_group.add_option("--board", dest="board", default="list",
+                          help="Board storage for the engine. (list, numpy)")
+    game_group.add_option("--map_cache", dest="map_cache", default=None,
+                          help="Directory used to cache data derived from maps")
+    parser.add_option_group(game_group)
+    (opts, args) = parser.parse_args(argv)
+    if not opts.map_files or not args:
+        parser.print_help()
+        return 2
+    if opts.log_dir and not os.path.exists(opts.log_dir):
+        os.mkdir(opts.log_dir)
+
+    tasks = []
+    for game_num in range(opts.games):
+        map_file = opts.map_files[game_num % len(opts.map_files)]
+        with open(map_file) as f:
+            map_text = f.read()
+        players = int([line.split()[1] for line in map_text.splitlines()
+                       if line.startswith('players')][0])
+        if players > len(args):
+            parser.error("%s needs %s bots" % (map_file, players))
+        game_options = {
+            'map': map_text,
+            'turns': opts.turns,
+            'loadtime': opts.loadtime,
+            'turntime': opts.turntime,
+            'attack': opts.attack,
+            'food': opts.food,
+            'viewradius2': opts.viewradius2,
+            'attackradius2': opts.attackradius2,
+            'spawnradius2': opts.spawnradius2,
+            'food_rate': opts.food_rate,
+            'food_turn': opts.food_turn,
+            'food_start': opts.food_start,
+            'food_visible': opts.food_visible,
+            'food_index': opts.food_index,
+            'cutoff_turn': opts.cutoff_turn,
+            'cutoff_percent': opts.cutoff_percent,
+            'board': opts.board,
+            'map_cache': opts.map_cache }
+        if opts.engine_seed is not None:
+            game_options['engine_seed'] = opts.engine_seed + game_num
+        if opts.player_seed is not None:
+            game_options['player_seed'] = opts.player_seed
+        options = dict(game_options, game_id=game_num, end_wait=opts.end_wait,
+                       cpu_time=opts.cpu_time, cpu_backstop=opts.cpu_backstop)
+        if opts.log_dir:
+            options['replay_log'] = open(os.path.join(opts.log_dir, '%s.replay' % game_num), 'w')
+        # bots run in the directory of their file, the same as playgame.py
+        botcmds = [get_cmd_wd(bot) for bot in args[:players]]
+        tasks.append((lambda game_options=game_options: Ants(game_options), botcmds, options))
+
+    start_time = time.time()
+    results = asyncio.run(run_games(tasks, opts.concurrency))
+    total_time = time.time() - start_time
+
+    turns = 0
+    for game_num, result in enumerate(results):
+        if 'error' in result:
+            print("game %s: %s" % (game_num, result['error']))
+            continue
+        turns += result['game_length']
+        print("game %s: %s turns, score %s, status %s"
+              % (game_num, result['game_length'], result['score'], result['status']))
+    print("%s games, %s turns in %.1fs (%.1f turns/s)"
+          % (len(results), turns, total_time, turns / total_time))
+    for task in tasks:
+        if 'replay_log' in task[2]:
+            task[2]['replay_log'].close()
+    return 0 if all('error' not in result for result in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
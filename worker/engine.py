@@ -7,11 +7,22 @@ import random
 import sys
 import json
 import io
+from collections import deque
+from threading import Event
 if sys.version_info >= (3,):
     def unicode(s):
         return s
 
-from sandbox import get_sandbox
+from sandbox import get_sandbox, pause_all, resume_all
+
+# longest wait for bot output before the bots are checked for crashes
+#   python 2 waits on an event with sleeps that double in length, so
+#   shorter waits also keep it from sleeping past the output
+OUTPUT_WAIT = 0.01
+
+# multiple of the time limit a bot may take in wall clock time when it is
+#   charged for its cpu time, so bots that block are still timed out
+CPU_BACKSTOP = 3.0
 
 class HeadTail(object):
     'Capture first part of file write and discard remainder'
@@ -20,7 +31,9 @@ class HeadTail(object):
         self.max_capture = max_capture
         self.capture_head_len = 0
         self.capture_head = unicode('')
-        self.capture_tail = unicode('')
+        # ring of the last writes, holding at least max_capture characters
+        self.capture_tail = deque()
+        self.capture_tail_len = 0
     def write(self, data):
         if self.file:
             self.file.write(data)
@@ -33,11 +46,22 @@ class HeadTail(object):
             else:
                 self.capture_head += data[:capture_head_left]
                 self.capture_head_len = self.max_capture
-                self.capture_tail += data[capture_head_left:]
-                self.capture_tail = self.capture_tail[-self.max_capture:]
+                self.add_tail(data[capture_head_left:])
         else:
-            self.capture_tail += data
-            self.capture_tail = self.capture_tail[-self.max_capture:]
+            self.add_tail(data)
+    def add_tail(self, data):
+        if not data:
+            return
+        if len(data) >= self.max_capture:
+            self.capture_tail.clear()
+            data = data[-self.max_capture:]
+            self.capture_tail_len = 0
+        self.capture_tail.append(data)
+        self.capture_tail_len += len(data)
+        # drop writes that are no longer part of the tail
+        while (len(self.capture_tail) > 1 and
+               self.capture_tail_len - len(self.capture_tail[0]) >= self.max_capture):
+            self.capture_tail_len -= len(self.capture_tail.popleft())
     def flush(self):
         if self.file:
             self.file.flush()
@@ -47,31 +71,192 @@ class HeadTail(object):
     def head(self):
         return self.capture_head
     def tail(self):
-        return self.capture_tail
+        return unicode('').join(self.capture_tail)[-self.max_capture:]
     def headtail(self):
-        if self.capture_head != '' and self.capture_tail != '':
+        tail = self.tail()
+        if self.capture_head != '' and tail != '':
             sep = unicode('\n..\n')
         else:
             sep = unicode('')
-        return self.capture_head + sep + self.capture_tail
+        return self.capture_head + sep + tail
+
+def get_cmd_wd(cmd, exec_rel_cwd=False):
+    ''' get the proper working directory from a command line '''
+    new_cmd = []
+    wd = None
+    for i, part in reversed(list(enumerate(cmd.split()))):
+        if wd == None and os.path.exists(part):
+            wd = os.path.dirname(os.path.realpath(part))
+            basename = os.path.basename(part)
+            if i == 0:
+                if exec_rel_cwd:
+                    new_cmd.insert(0, os.path.join(".", basename))
+                else:
+                    new_cmd.insert(0, part)
+            else:
+                new_cmd.insert(0, basename)
+        else:
+            new_cmd.insert(0, part)
+    return wd, ' '.join(new_cmd)
+
+def write_result(game_result, game, replay_log):
+    """ Write the game result as json with the replay data of the game
+
+        The replay is written by the game as the replaydata key, so it
+          is never held in memory as a whole.  The text is the same as
+          json.dump with sorted keys.
+    """
+    keys = list(game_result.keys())
+    if game is not None:
+        keys.append('replaydata')
+    replay_log.write('{')
+    for i, key in enumerate(sorted(keys)):
+        if i > 0:
+            replay_log.write(', ')
+        replay_log.write(json.dumps(key) + ': ')
+        if key == 'replaydata':
+            game.write_replay(replay_log)
+        else:
+            replay_log.write(json.dumps(game_result[key], sort_keys=True))
+    replay_log.write('}')
+
+def send_states(game, bots, turn, bot_turns, input_logs):
+    """ Send the start of the game or the state of the turn to each bot """
+    for b, bot in enumerate(bots):
+        if game.is_alive(b):
+            if turn == 0:
+                start = game.get_player_start(b) + 'ready\n'
+                bot.write(start)
+                if input_logs and input_logs[b]:
+                    input_logs[b].write(start)
+                    input_logs[b].flush()
+            else:
+                state = 'turn ' + str(turn) + '\n' + game.get_player_state(b) + 'go\n'
+                bot.write(state)
+                if input_logs and input_logs[b]:
+                    input_logs[b].write(state)
+                    input_logs[b].flush()
+                bot_turns[b] = turn
+
+def record_statuses(error_lines, statuses, turn, bot_status, bot_turns, error_logs):
+    """ Log the errors of the bots and set the status of crashed and timed out bots """
+    for b, errors in enumerate(error_lines):
+        if errors:
+            if error_logs and error_logs[b]:
+                error_logs[b].write(unicode('\n').join(errors)+unicode('\n'))
+    for b, status in enumerate(statuses):
+        if status != None:
+            bot_status[b] = status
+            bot_turns[b] = turn
+
+def apply_moves(game, bot_moves, turn, strict, bot_status, bot_turns,
+                output_logs, error_logs):
+    """ Give the moves of the bots to the game and log the results """
+    for b, moves in enumerate(bot_moves):
+        if game.is_alive(b):
+            valid, ignored, invalid = game.do_moves(b, moves)
+            if output_logs and output_logs[b]:
+                output_logs[b].write('# turn %s\n' % turn)
+                if valid:
+                    if output_logs and output_logs[b]:
+                        output_logs[b].write('\n'.join(valid)+'\n')
+                        output_logs[b].flush()
+            if ignored:
+                if error_logs and error_logs[b]:
+                    error_logs[b].write('turn %4d bot %s ignored actions:\n' % (turn, b))
+                    error_logs[b].write('\n'.join(ignored)+'\n')
+                    error_logs[b].flush()
+                if output_logs and output_logs[b]:
+                    output_logs[b].write('\n'.join(ignored)+'\n')
+                    output_logs[b].flush()
+            if invalid:
+                if strict:
+                    game.kill_player(b)
+                    bot_status[b] = 'invalid'
+                    bot_turns[b] = turn
+                if error_logs and error_logs[b]:
+                    error_logs[b].write('turn %4d bot %s invalid actions:\n' % (turn, b))
+                    error_logs[b].write('\n'.join(invalid)+'\n')
+                    error_logs[b].flush()
+                if output_logs and output_logs[b]:
+                    output_logs[b].write('\n'.join(invalid)+'\n')
+                    output_logs[b].flush()
+
+def end_state(game, b, num_bots, bot_status, bot_turns):
+    """ Return the final scores, statuses and state sent to a bot """
+    score_line ='score %s\n' % ' '.join([str(s) for s in game.get_scores(b)])
+    status_line = 'status %s\n' % ' '.join(map(str, game.order_for_player(b, bot_status)))
+    status_line += 'playerturns %s\n' % ' '.join(map(str, game.order_for_player(b, bot_turns)))
+    end_line = 'end\nplayers %s\n' % num_bots + score_line + status_line
+    return end_line + game.get_player_state(b) + 'go\n'
+
+def write_stats(verbose_log, game, turn):
+    """ Write a line of game stats, with a header every 50 turns """
+    stats = game.get_stats()
+    stat_keys = sorted(stats.keys())
+    s = 'turn %4d stats: ' % turn
+    if turn % 50 == 0:
+        verbose_log.write(' '*len(s))
+        for key in stat_keys:
+            values = stats[key]
+            verbose_log.write(' {0:^{1}}'.format(key, max(len(key), len(str(values)))))
+        verbose_log.write('\n')
+    verbose_log.write(s)
+    for key in stat_keys:
+        values = stats[key]
+        if type(values) == list:
+            values = '[' + ','.join(map(str,values)) + ']'
+        verbose_log.write(' {0:^{1}}'.format(str(values), max(len(key), len(str(values)))))
+    verbose_log.write('\n')
+
+def make_result(game, turn, bot_status, bot_turns, location, game_id):
+    """ Return the game result of a finished game, without the replay """
+    scores = game.get_scores()
+    return {
+        'challenge': game.__class__.__name__.lower(),
+        'location': location,
+        'game_id': game_id,
+        'status': bot_status,
+        'playerturns': bot_turns,
+        'score': scores,
+        'rank': [sorted(scores, reverse=True).index(x) for x in scores],
+        'replayformat': 'json',
+        'engine_time': game.get_phase_times(),
+        'game_length': turn
+    }
+
+def store_replay(game_result, game, replay_log, replay_spool):
+    """ Write the game result to the replay log and store the replay
+
+        game is None if the game failed, otherwise its replay is written
+          to replay_spool if there is one, or added to the game result.
+    """
+    if replay_log:
+        write_result(game_result, game, replay_log)
+    if game is not None:
+        if replay_spool:
+            game.write_replay(replay_spool)
+        else:
+            game_result['replaydata'] = game.get_replay()
 
 def run_game(game, botcmds, options):
+    """ Play a game between bots and return the game result
+
+        If a replay_log is given, the game result with its replay is
+          written to it.  If a replay_spool is given, the replay alone is
+          written to it and left out of the returned result, otherwise
+          the result holds the replay as replaydata.
+    """
     # file descriptors for replay and streaming formats
     replay_log = options.get('replay_log', None)
-    stream_log = options.get('stream_log', None)
+    replay_spool = options.get('replay_spool', None)
     verbose_log = options.get('verbose_log', None)
     # file descriptors for bots, should be list matching # of bots
-    input_logs = options.get('input_logs', [None]*len(botcmds))
-    output_logs = options.get('output_logs', [None]*len(botcmds))
     error_logs = options.get('error_logs', [None]*len(botcmds))
 
     capture_errors = options.get('capture_errors', False)
     capture_errors_max = options.get('capture_errors_max', 510)
 
-    turns = int(options['turns'])
-    loadtime = float(options['loadtime']) / 1000
-    turntime = float(options['turntime']) / 1000
-    strict = options.get('strict', False)
     end_wait = options.get('end_wait', 0.0)
 
     location = options.get('location', 'localhost')
@@ -82,14 +267,18 @@ def run_game(game, botcmds, options):
     bots = []
     bot_status = []
     bot_turns = []
+    turn = 0
     if capture_errors:
         error_logs = [HeadTail(log, capture_errors_max) for log in error_logs]
+    # set by the sandboxes when any bot writes output
+    output_event = Event()
     try:
         # create bot sandboxes
         for b, bot in enumerate(botcmds):
             bot_cwd, bot_cmd = bot
             sandbox = get_sandbox(bot_cwd,
-                    secure=options.get('secure_jail', None))
+                    secure=options.get('secure_jail', None),
+                    output_event=output_event)
             sandbox.start(bot_cmd)
             bots.append(sandbox)
             bot_status.append('survived')
@@ -104,191 +293,17 @@ def run_game(game, botcmds, options):
                 game.kill_player(b)
             sandbox.pause()
 
-        if stream_log:
-            stream_log.write(game.get_player_start())
-            stream_log.flush()
-
-        if verbose_log:
-            verbose_log.write('running for %s turns\n' % turns)
-        for turn in range(turns+1):
-            if turn == 0:
-                game.start_game()
-
-            # send game state to each player
-            for b, bot in enumerate(bots):
-                if game.is_alive(b):
-                    if turn == 0:
-                        start = game.get_player_start(b) + 'ready\n'
-                        bot.write(start)
-                        if input_logs and input_logs[b]:
-                            input_logs[b].write(start)
-                            input_logs[b].flush()
-                    else:
-                        state = 'turn ' + str(turn) + '\n' + game.get_player_state(b) + 'go\n'
-                        bot.write(state)
-                        if input_logs and input_logs[b]:
-                            input_logs[b].write(state)
-                            input_logs[b].flush()
-                        bot_turns[b] = turn
-
-            if turn > 0:
-                if stream_log:
-                    stream_log.write('turn %s\n' % turn)
-                    stream_log.write('score %s\n' % ' '.join([str(s) for s in game.get_scores()]))
-                    stream_log.write(game.get_state())
-                    stream_log.flush()
-                game.start_turn()
-
-            # get moves from each player
-            if turn == 0:
-                time_limit = loadtime
-            else:
-                time_limit = turntime
-
-            if options.get('serial', False):
-                simul_num = int(options['serial']) # int(True) is 1
+        for action, value in play_turns(game, bots, options, bot_status,
+                                        bot_turns, error_logs):
+            if action == 'turn':
+                turn = value
+            elif action == 'output':
+                if value:
+                    output_event.wait(value)
+                # output that arrives while reading sets the event again
+                output_event.clear()
             else:
-                simul_num = len(bots)
-
-            bot_moves = [[] for b in bots]
-            error_lines = [[] for b in bots]
-            statuses = [None for b in bots]
-            bot_list = [(b, bot) for b, bot in enumerate(bots)
-                        if game.is_alive(b)]
-            random.shuffle(bot_list)
-            for group_num in range(0, len(bot_list), simul_num):
-                pnums, pbots = zip(*bot_list[group_num:group_num + simul_num])
-                moves, errors, status = get_moves(game, pbots, pnums,
-                        time_limit, turn)
-                for p, b in enumerate(pnums):
-                    bot_moves[b] = moves[p]
-                    error_lines[b] = errors[p]
-                    statuses[b] = status[p]
-
-            # handle any logs that get_moves produced
-            for b, errors in enumerate(error_lines):
-                if errors:
-                    if error_logs and error_logs[b]:
-                        error_logs[b].write(unicode('\n').join(errors)+unicode('\n'))
-            # set status for timeouts and crashes
-            for b, status in enumerate(statuses):
-                if status != None:
-                    bot_status[b] = status
-                    bot_turns[b] = turn
-
-            # process all moves
-            bot_alive = [game.is_alive(b) for b in range(len(bots))]
-            if turn > 0 and not game.game_over():
-                for b, moves in enumerate(bot_moves):
-                    if game.is_alive(b):
-                        valid, ignored, invalid = game.do_moves(b, moves)
-                        if output_logs and output_logs[b]:
-                            output_logs[b].write('# turn %s\n' % turn)
-                            if valid:
-                                if output_logs and output_logs[b]:
-                                    output_logs[b].write('\n'.join(valid)+'\n')
-                                    output_logs[b].flush()
-                        if ignored:
-                            if error_logs and error_logs[b]:
-                                error_logs[b].write('turn %4d bot %s ignored actions:\n' % (turn, b))
-                                error_logs[b].write('\n'.join(ignored)+'\n')
-                                error_logs[b].flush()
-                            if output_logs and output_logs[b]:
-                                output_logs[b].write('\n'.join(ignored)+'\n')
-                                output_logs[b].flush()
-                        if invalid:
-                            if strict:
-                                game.kill_player(b)
-                                bot_status[b] = 'invalid'
-                                bot_turns[b] = turn
-                            if error_logs and error_logs[b]:
-                                error_logs[b].write('turn %4d bot %s invalid actions:\n' % (turn, b))
-                                error_logs[b].write('\n'.join(invalid)+'\n')
-                                error_logs[b].flush()
-                            if output_logs and output_logs[b]:
-                                output_logs[b].write('\n'.join(invalid)+'\n')
-                                output_logs[b].flush()
-
-            if turn > 0:
-                game.finish_turn()
-
-            # send ending info to eliminated bots
-            bots_eliminated = []
-            for b, alive in enumerate(bot_alive):
-                if alive and not game.is_alive(b):
-                    bots_eliminated.append(b)
-            for b in bots_eliminated:
-                if verbose_log:
-                    verbose_log.write('turn %4d bot %s eliminated\n' % (turn, b))
-                if bot_status[b] == 'survived': # could be invalid move
-                    bot_status[b] = 'eliminated'
-                    bot_turns[b] = turn
-                score_line ='score %s\n' % ' '.join([str(s) for s in game.get_scores(b)])
-                status_line = 'status %s\n' % ' '.join(map(str, game.order_for_player(b, bot_status)))
-                status_line += 'playerturns %s\n' % ' '.join(map(str, game.order_for_player(b, bot_turns)))
-                end_line = 'end\nplayers %s\n' % len(bots) + score_line + status_line
-                state = end_line + game.get_player_state(b) + 'go\n'
-                bots[b].write(state)
-                if input_logs and input_logs[b]:
-                    input_logs[b].write(state)
-                    input_logs[b].flush()
-                if end_wait:
-                    bots[b].resume()
-            if bots_eliminated and end_wait:
-                if verbose_log:
-                    verbose_log.write('waiting {0} seconds for bots to process end turn\n'.format(end_wait))
-                time.sleep(end_wait)
-            for b in bots_eliminated:
-                bots[b].kill()
-
-            if verbose_log:
-                stats = game.get_stats()
-                stat_keys = sorted(stats.keys())
-                s = 'turn %4d stats: ' % turn
-                if turn % 50 == 0:
-                    verbose_log.write(' '*len(s))
-                    for key in stat_keys:
-                        values = stats[key]
-                        verbose_log.write(' {0:^{1}}'.format(key, max(len(key), len(str(values)))))
-                    verbose_log.write('\n')
-                verbose_log.write(s)
-                for key in stat_keys:
-                    values = stats[key]
-                    if type(values) == list:
-                        values = '[' + ','.join(map(str,values)) + ']'
-                    verbose_log.write(' {0:^{1}}'.format(values, max(len(key), len(str(values)))))
-                verbose_log.write('\n')
-
-            #alive = [game.is_alive(b) for b in range(len(bots))]
-            #if sum(alive) <= 1:
-            if game.game_over():
-                break
-
-        # send bots final state and score, output to replay file
-        game.finish_game()
-        score_line ='score %s\n' % ' '.join(map(str, game.get_scores()))
-        status_line = 'status %s\n' % ' '.join(bot_status)
-        status_line += 'playerturns %s\n' % ' '.join(map(str, bot_turns))
-        end_line = 'end\nplayers %s\n' % len(bots) + score_line + status_line
-        if stream_log:
-            stream_log.write(end_line)
-            stream_log.write(game.get_state())
-            stream_log.flush()
-        if verbose_log:
-            verbose_log.write(score_line)
-            verbose_log.write(status_line)
-            verbose_log.flush()
-        for b, bot in enumerate(bots):
-            if game.is_alive(b):
-                score_line ='score %s\n' % ' '.join([str(s) for s in game.get_scores(b)])
-                status_line = 'status %s\n' % ' '.join(map(str, game.order_for_player(b, bot_status)))
-                status_line += 'playerturns %s\n' % ' '.join(map(str, game.order_for_player(b, bot_turns)))
-                end_line = 'end\nplayers %s\n' % len(bots) + score_line + status_line
-                state = end_line + game.get_player_state(b) + 'go\n'
-                bot.write(state)
-                if input_logs and input_logs[b]:
-                    input_logs[b].write(state)
-                    input_logs[b].flush()
+                time.sleep(value)
 
     except Exception as e:
         # TODO: sanitize error output, tracebacks shouldn't be sent to workers
@@ -298,8 +313,7 @@ def run_game(game, botcmds, options):
         # error = str(e)
     finally:
         if end_wait:
-            for bot in bots:
-                bot.resume()
+            resume_all(bots)
             if verbose_log:
                 verbose_log.write('waiting {0} seconds for bots to process end turn\n'.format(end_wait))
             time.sleep(end_wait)
@@ -311,49 +325,209 @@ def run_game(game, botcmds, options):
     if error:
         game_result = { 'error': error }
     else:
-        scores = game.get_scores()
-        game_result = {
-            'challenge': game.__class__.__name__.lower(),
-            'location': location,
-            'game_id': game_id,
-            'status': bot_status,
-            'playerturns': bot_turns,
-            'score': scores,
-            'rank': [sorted(scores, reverse=True).index(x) for x in scores],
-            'replayformat': 'json',
-            'replaydata': game.get_replay(),
-            'game_length': turn
-        }
+        game_result = make_result(game, turn, bot_status, bot_turns,
+                                  location, game_id)
+        # output dropped from bots that wrote more than their quota
+        game_result['overflow'] = [bot.overflow for bot in bots]
         if capture_errors:
             game_result['errors'] = [head.headtail() for head in error_logs]
+    store_replay(game_result, None if error else game, replay_log, replay_spool)
+    return game_result
 
-    if replay_log:
-        json.dump(game_result, replay_log, sort_keys=True)
+def play_turns(game, bots, options, bot_status, bot_turns, error_logs):
+    """ Play the turns of a game between started bots and send them the end
+
+        The bots are sandboxes, or anything with the same methods.  This
+          is a generator, driven by run_game, or by the run_game of
+          async_engine that reads the bots with an event loop.  It yields
+          what the driver has to do before the game goes on:
+            ('turn', turn) a turn starts
+            ('output', seconds) wait at most seconds for output from a
+              bot, then clear the output event of the bots
+            ('sleep', seconds) wait for eliminated bots to read the end
+    """
+    stream_log = options.get('stream_log', None)
+    verbose_log = options.get('verbose_log', None)
+    input_logs = options.get('input_logs', [None]*len(bots))
+    output_logs = options.get('output_logs', [None]*len(bots))
 
-    return game_result
+    turns = int(options['turns'])
+    loadtime = float(options['loadtime']) / 1000
+    turntime = float(options['turntime']) / 1000
+    strict = options.get('strict', False)
+    end_wait = options.get('end_wait', 0.0)
+    # charge bots for their cpu time, with a wall clock backstop
+    if options.get('cpu_time', False):
+        cpu_backstop = float(options.get('cpu_backstop', CPU_BACKSTOP))
+    else:
+        cpu_backstop = None
+
+    if stream_log:
+        stream_log.write(game.get_player_start())
+        stream_log.flush()
+
+    if verbose_log:
+        verbose_log.write('running for %s turns\n' % turns)
+    for turn in range(turns+1):
+        yield 'turn', turn
+        if turn == 0:
+            game.start_game()
+
+        # send game state to each player
+        send_states(game, bots, turn, bot_turns, input_logs)
+
+        if turn > 0:
+            if stream_log:
+                stream_log.write('turn %s\n' % turn)
+                stream_log.write('score %s\n' % ' '.join([str(s) for s in game.get_scores()]))
+                stream_log.write(game.get_state())
+                stream_log.flush()
+            game.start_turn()
+
+        # get moves from each player
+        if turn == 0:
+            time_limit = loadtime
+        else:
+            time_limit = turntime
+
+        if options.get('serial', False):
+            simul_num = int(options['serial']) # int(True) is 1
+        else:
+            simul_num = len(bots)
+
+        bot_moves = [[] for b in bots]
+        error_lines = [[] for b in bots]
+        statuses = [None for b in bots]
+        bot_list = [(b, bot) for b, bot in enumerate(bots)
+                    if game.is_alive(b)]
+        random.shuffle(bot_list)
+        for group_num in range(0, len(bot_list), simul_num):
+            pnums, pbots = zip(*bot_list[group_num:group_num + simul_num])
+            moves = [[] for bot in pbots]
+            errors = [[] for bot in pbots]
+            status = [None for bot in pbots]
+            for wait in get_moves(game, pbots, pnums, time_limit, turn,
+                                  moves, errors, status, cpu_backstop):
+                yield wait
+            for p, b in enumerate(pnums):
+                bot_moves[b] = moves[p]
+                error_lines[b] = errors[p]
+                statuses[b] = status[p]
+
+        # handle any logs that get_moves produced
+        #   and set status for timeouts and crashes
+        record_statuses(error_lines, statuses, turn, bot_status, bot_turns, error_logs)
+
+        # process all moves
+        bot_alive = [game.is_alive(b) for b in range(len(bots))]
+        if turn > 0 and not game.game_over():
+            apply_moves(game, bot_moves, turn, strict, bot_status, bot_turns,
+                        output_logs, error_logs)
+
+        if turn > 0:
+            game.finish_turn()
+
+        # send ending info to eliminated bots
+        bots_eliminated = []
+        for b, alive in enumerate(bot_alive):
+            if alive and not game.is_alive(b):
+                bots_eliminated.append(b)
+        for b in bots_eliminated:
+            if verbose_log:
+                verbose_log.write('turn %4d bot %s eliminated\n' % (turn, b))
+            if bot_status[b] == 'survived': # could be invalid move
+                bot_status[b] = 'eliminated'
+                bot_turns[b] = turn
+            state = end_state(game, b, len(bots), bot_status, bot_turns)
+            bots[b].write(state)
+            if input_logs and input_logs[b]:
+                input_logs[b].write(state)
+                input_logs[b].flush()
+        if bots_eliminated and end_wait:
+            resume_all([bots[b] for b in bots_eliminated])
+            if verbose_log:
+                verbose_log.write('waiting {0} seconds for bots to process end turn\n'.format(end_wait))
+            yield 'sleep', end_wait
+        for b in bots_eliminated:
+            bots[b].kill()
 
-def get_moves(game, bots, bot_nums, time_limit, turn):
+        if verbose_log:
+            write_stats(verbose_log, game, turn)
+
+        #alive = [game.is_alive(b) for b in range(len(bots))]
+        #if sum(alive) <= 1:
+        if game.game_over():
+            break
+
+    # send bots final state and score, output to replay file
+    game.finish_game()
+    score_line ='score %s\n' % ' '.join(map(str, game.get_scores()))
+    status_line = 'status %s\n' % ' '.join(bot_status)
+    status_line += 'playerturns %s\n' % ' '.join(map(str, bot_turns))
+    end_line = 'end\nplayers %s\n' % len(bots) + score_line + status_line
+    if stream_log:
+        stream_log.write(end_line)
+        stream_log.write(game.get_state())
+        stream_log.flush()
+    if verbose_log:
+        verbose_log.write(score_line)
+        verbose_log.write(status_line)
+        verbose_log.flush()
+    for b, bot in enumerate(bots):
+        if game.is_alive(b):
+            state = end_state(game, b, len(bots), bot_status, bot_turns)
+            bot.write(state)
+            if input_logs and input_logs[b]:
+                input_logs[b].write(state)
+                input_logs[b].flush()
+
+def get_moves(game, bots, bot_nums, time_limit, turn, bot_moves, error_lines,
+              statuses, cpu_backstop=None):
+    """ Collect the moves of the bots for a turn
+
+        A generator like play_turns, that yields ('output', seconds) when
+          it waits for the bots.  The moves, errors and status of each bot
+          are stored in bot_moves, error_lines and statuses.
+        With a cpu_backstop each bot is charged for the cpu time it uses
+          instead of the wall clock time, so the load of other games
+          doesn't time it out.  It is still timed out after cpu_backstop
+          times the time limit, or by the wall clock if its sandbox can't
+          tell its cpu time.
+    """
     bot_finished = [not game.is_alive(bot_nums[b]) for b in range(len(bots))]
-    bot_moves = [[] for b in bots]
-    error_lines = [[] for b in bots]
-    statuses = [None for b in bots]
 
-    # resume all bots
+    if cpu_backstop:
+        wall_limit = time_limit * cpu_backstop
+        start_cpu = [bot.cpu_time for bot in bots]
+        # a bot can't use more cpu time than wall clock time, so its cpu
+        #   time is only checked once it could be over the limit
+        cpu_check = [time_limit for bot in bots]
+    else:
+        wall_limit = time_limit
+    bot_stopped = [False for b in bots]
+
+    # give each bot a new quota of output and resume them
     for bot in bots:
-        if bot.is_alive:
-            bot.resume()
+        bot.reset_output()
+    resume_all([bot for bot in bots if bot.is_alive])
 
     # don't start timing until the bots are started
     start_time = time.time()
 
     # loop until received all bots send moves or are dead
     #   or when time is up
-    while (sum(bot_finished) < len(bot_finished) and
-            time.time() - start_time < time_limit):
-        time.sleep(0.01)
+    more_output = False
+    while (sum(bot_finished) + sum(bot_stopped) < len(bot_finished) and
+            time.time() - start_time < wall_limit):
+        if more_output:
+            yield 'output', 0
+        else:
+            yield 'output', min(OUTPUT_WAIT,
+                    max(0, wall_limit - (time.time() - start_time)))
+        more_output = False
         for b, bot in enumerate(bots):
-            if bot_finished[b]:
-                continue # already got bot moves
+            if bot_finished[b] or bot_stopped[b]:
+                continue # already got bot moves or out of time
             if not bot.is_alive:
                 error_lines[b].append(unicode('turn %4d bot %s crashed') % (turn, bot_nums[b]))
                 statuses[b] = 'crashed'
@@ -377,16 +551,38 @@ def get_moves(game, bots, bot_nums, time_limit, turn):
                     # bot finished sending data for this turn
                     break
                 bot_moves[b].append(line)
+            else:
+                more_output = True
 
             for x in range(100):
                 line = bot.read_error()
                 if line is None:
                     break
                 error_lines[b].append(line)
+            else:
+                more_output = True
+
+        if cpu_backstop:
+            # stop the bots that used up their cpu time
+            elapsed = time.time() - start_time
+            for b, bot in enumerate(bots):
+                if bot_finished[b] or bot_stopped[b] or elapsed < cpu_check[b]:
+                    continue
+                cpu_time = bot.cpu_time
+                if cpu_time is None or start_cpu[b] is None:
+                    used = elapsed
+                else:
+                    used = cpu_time - start_cpu[b]
+                if used >= time_limit:
+                    bot_stopped[b] = True
+                    if bot.is_alive:
+                        bot.pause()
+                else:
+                    cpu_check[b] = elapsed + max(time_limit - used, OUTPUT_WAIT)
+
     # pause all bots again
-    for bot in bots:
-        if bot.is_alive:
-            bot.pause()
+    pause_all([bot for b, bot in enumerate(bots)
+               if bot.is_alive and not bot_stopped[b]])
 
     # check for any final output from bots
     for b, bot in enumerate(bots):
@@ -404,7 +600,7 @@ def get_moves(game, bots, bot_nums, time_limit, turn):
             continue # bot is dead
 
         line = bot.read_line()
-	lines_read = 0;
+        lines_read = 0
         while line is not None and len(bot_moves[b]) < 40000:
             line = line.strip()
             if line.lower() == 'go':
@@ -433,5 +629,3 @@ def get_moves(game, bots, bot_nums, time_limit, turn):
                 error_lines[b].append(line)
             game.kill_player(bot_nums[b])
             bots[b].kill()
-
-    return bot_moves, error_lines, statuses
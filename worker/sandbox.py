@@ -1,13 +1,18 @@
 #!/usr/bin/python
 from __future__ import print_function
 import os
+try:
+    import pwd
+except ImportError:
+    pwd = None
 import shlex
 import signal
 import subprocess
 import sys
 import time
+from collections import deque
 from optparse import OptionParser
-from threading import Thread
+from threading import Thread, Condition
 try:
     from Queue import Queue, Empty
 except ImportError:
@@ -28,19 +33,163 @@ try:
 except ImportError:
     _SECURE_DEFAULT = False
 
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = None
+
+# commands sent to jailguard for each action
+_GUARD_COMMANDS = {"pause": "STOP", "resume": "CONT"}
+
+# most lines and characters of output kept from a command between calls
+#   to reset_output, which the engine makes every turn
+STDOUT_LIMITS = (40000, 4 * 1024 * 1024)
+STDERR_LIMITS = (10000, 1024 * 1024)
+# longer lines are cut to this many characters
+MAX_LINE_LENGTH = 64 * 1024
+
 class SandboxError(Exception):
     pass
 
-def _guard_monitor(jail):
-    guard_out = jail.command_process.stdout
+def _is_go(line):
+    """Whether a line of a bot's output ends its turn"""
+    return line is not None and line.strip().lower() == 'go'
+
+class OutputBuffer(object):
+    """Queue of the output lines of a command, with a limit on its size
+
+    At most max_lines lines and max_chars characters are let in between
+    calls to reset, the rest are dropped.  Lines over the limit that keep
+    returns true for are let in anyway, so a bot over its quota still
+    ends its turn.  The lines are kept in a ring buffer of max_lines, so
+    if they aren't read the oldest are dropped.  Dropped lines and
+    characters are counted.
+
+    """
+    def __init__(self, max_lines, max_chars, keep=None):
+        self.max_lines = max_lines
+        self.max_chars = max_chars
+        self.keep = keep
+        self.lines = deque(maxlen=max_lines)
+        self.condition = Condition()
+        self.turn_lines = 0
+        self.turn_chars = 0
+        self.dropped_lines = 0
+        self.dropped_chars = 0
+
+    def put(self, item, size=None):
+        """Add a line of size characters
+
+        Items without a size, such as the end of the output, are always
+        let in.
+
+        """
+        with self.condition:
+            if size is not None:
+                if (self.turn_lines >= self.max_lines or
+                        self.turn_chars + size > self.max_chars):
+                    if self.keep is None or not self.keep(item):
+                        self.dropped_lines += 1
+                        self.dropped_chars += size
+                        return
+                else:
+                    self.turn_lines += 1
+                    self.turn_chars += size
+            if len(self.lines) == self.max_lines:
+                self.dropped_lines += 1
+                self.dropped_chars += self.lines[0][1] or 0
+            self.lines.append((item, size))
+            self.condition.notify()
+
+    def drop(self, size):
+        """Count characters that were cut from a line"""
+        with self.condition:
+            self.dropped_chars += size
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the oldest line, like Queue.get"""
+        with self.condition:
+            if block and timeout is not None:
+                end_time = time.time() + timeout
+            while not self.lines:
+                if not block:
+                    raise Empty
+                if timeout is None:
+                    self.condition.wait()
+                else:
+                    remaining = end_time - time.time()
+                    if remaining <= 0:
+                        raise Empty
+                    self.condition.wait(remaining)
+            return self.lines.popleft()[0]
+
+    def reset(self):
+        """Start letting in lines again"""
+        with self.condition:
+            self.turn_lines = 0
+            self.turn_chars = 0
+
+def _read_lines(fd):
+    """Yield the lines of a file and the number of characters cut from them
+
+    Lines are read at most MAX_LINE_LENGTH at a time, so a command can't
+    fill the memory of the worker with a line that never ends.
+
+    """
     while True:
-        line = guard_out.readline()
+        line = fd.readline(MAX_LINE_LENGTH)
         if not line:
-            end_item = (time.time(), None)
-            jail.resp_queue.put(end_item)
-            jail.stdout_queue.put(end_item)
-            jail.stderr_queue.put(end_item)
             break
+        cut = 0
+        if len(line) == MAX_LINE_LENGTH and line[-1:] not in ('\n', b'\n'):
+            while True:
+                rest = fd.readline(MAX_LINE_LENGTH)
+                cut += len(rest)
+                if not rest or rest[-1:] in ('\n', b'\n'):
+                    break
+        yield line, cut
+
+def _cpu_time(pid):
+    """Return the cpu seconds used by a process and its waited for children
+
+    Returns None if the process is gone or /proc is not available.
+
+    """
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open("/proc/%d/stat" % (pid,)) as stat_file:
+            stat = stat_file.read()
+    except (IOError, OSError):
+        return None
+    # the command name may hold spaces, the fields after it don't
+    fields = stat[stat.rindex(")") + 2:].split()
+    # utime, stime, cutime and cstime
+    return sum(int(ticks) for ticks in fields[11:15]) / float(_CLOCK_TICKS)
+
+def _user_cpu_time(uid):
+    """Return the cpu seconds used by all processes of a user"""
+    if _CLOCK_TICKS is None:
+        return None
+    total = 0.0
+    try:
+        pids = [int(pid) for pid in os.listdir("/proc") if pid.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            if os.stat("/proc/%d" % (pid,)).st_uid != uid:
+                continue
+        except OSError:
+            continue
+        seconds = _cpu_time(pid)
+        if seconds is not None:
+            total += seconds
+    return total
+
+def _guard_monitor(jail):
+    guard_out = jail.command_process.stdout
+    for line, cut in _read_lines(guard_out):
         line = line.rstrip("\r\n")
         words = line.split(None, 2)
         if len(words) < 3:
@@ -51,11 +200,23 @@ def _guard_monitor(jail):
         ts = float(ts)
         data = unicode(data, errors="replace")
         if msg == "STDOUT":
-            jail.stdout_queue.put((time, data))
+            jail.stdout_queue.put((time, data), len(data))
+            if cut:
+                jail.stdout_queue.drop(cut)
         elif msg == "STDERR":
-            jail.stderr_queue.put((time, data))
+            jail.stderr_queue.put((time, data), len(data))
+            if cut:
+                jail.stderr_queue.drop(cut)
         elif msg == "SIGNALED":
             jail.resp_queue.put((time, data))
+        if jail.output_event is not None:
+            jail.output_event.set()
+    end_item = (time.time(), None)
+    jail.resp_queue.put(end_item)
+    jail.stdout_queue.put(end_item)
+    jail.stderr_queue.put(end_item)
+    if jail.output_event is not None:
+        jail.output_event.set()
 
 class Jail(object):
     """ Provide a secure sandbox to run arbitrary commands in.
@@ -63,13 +224,15 @@ class Jail(object):
     This will only function on specially prepared Ubuntu systems.
 
     """
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, output_event=None):
         """Initialize a new sandbox for the given working directory.
 
         working_directory: the directory in which the shell command should
                            be launched. Files from this directory are copied
                            into the secure space before the shell command is
                            executed.
+        output_event: a threading.Event set whenever the command writes a
+                      line or exits, may be shared by several sandboxes.
         """
         self.locked = False
         jail_base = "/srv/chroot"
@@ -93,14 +256,20 @@ class Jail(object):
         self.jchown = os.path.join(server_info["repo_path"], "worker/jail_own")
         self.base_dir = os.path.join(jail_base, jail)
         self.number = int(jail[len("jailuser"):])
+        try:
+            self.uid = pwd.getpwnam(self.name).pw_uid
+        except (KeyError, AttributeError):
+            self.uid = None
         self.chroot_cmd = "sudo -u {0} schroot -u {0} -c {0} -d {1} -- jailguard.py ".format(
                 self.name, "/home/jailuser")
 
         self._is_alive = False
         self.command_process = None
+        self.output_event = output_event
         self.resp_queue = Queue()
-        self.stdout_queue = Queue()
-        self.stderr_queue = Queue()
+        self.stdout_queue = OutputBuffer(*STDOUT_LIMITS,
+                                         keep=lambda item: _is_go(item[1]))
+        self.stderr_queue = OutputBuffer(*STDERR_LIMITS)
         self._prepare_with(working_directory)
 
     def __del__(self):
@@ -118,6 +287,13 @@ class Jail(object):
             self._is_alive = False
         return False
 
+    @property
+    def cpu_time(self):
+        """Cpu seconds used by all processes in the jail, or None if unknown"""
+        if self.uid is None:
+            return None
+        return _user_cpu_time(self.uid)
+
     def release(self):
         """Release the sandbox for further use
 
@@ -238,32 +414,35 @@ class Jail(object):
 
     def pause(self):
         """Pause the process by sending a SIGSTOP to the child"""
-        try:
-            self.command_process.stdin.write("STOP\n")
-            self.command_process.stdin.flush()
-        except IOError as exc:
-            if exc.errno == 32: # Broken pipe, guard exited
-                return
-            raise
-        item = self.resp_queue.get()
-        if item[1] != "STOP" and item[1] is not None:
-            raise SandboxError("Bad response from jailguard after pause, %s"
-                    % (item,))
-
+        if self._send_signal("pause"):
+            self._await_signal("pause")
 
     def resume(self):
         """Resume the process by sending a SIGCONT to the child"""
+        if self._send_signal("resume"):
+            self._await_signal("resume")
+
+    def _send_signal(self, action):
+        """Ask jailguard to pause or resume the child
+
+        Returns True if the response must be read with _await_signal.
+
+        """
         try:
-            self.command_process.stdin.write("CONT\n")
+            self.command_process.stdin.write(_GUARD_COMMANDS[action] + "\n")
             self.command_process.stdin.flush()
         except IOError as exc:
             if exc.errno == 32: # Broken pipe, guard exited
-                return
+                return False
             raise
+        return True
+
+    def _await_signal(self, action):
+        """Wait for jailguard to confirm a pause or resume"""
         item = self.resp_queue.get()
-        if item[1] != "CONT" and item[1] is not None:
-            raise SandboxError("Bad response from jailguard after resume, %s"
-                    % (item,))
+        if item[1] != _GUARD_COMMANDS[action] and item[1] is not None:
+            raise SandboxError("Bad response from jailguard after %s, %s"
+                    % (action, item))
 
     def write(self, data):
         """Write str to stdin of the process being run"""
@@ -316,6 +495,19 @@ class Jail(object):
         except Empty:
             return None
 
+    def reset_output(self):
+        """Let the command write a new quota of output"""
+        self.stdout_queue.reset()
+        self.stderr_queue.reset()
+
+    @property
+    def overflow(self):
+        """Lines and characters of output dropped for being over the quota"""
+        return {'stdout_lines': self.stdout_queue.dropped_lines,
+                'stdout_chars': self.stdout_queue.dropped_chars,
+                'stderr_lines': self.stderr_queue.dropped_lines,
+                'stderr_chars': self.stderr_queue.dropped_chars}
+
     def check_path(self, path, errors):
         resolved_path = os.path.join(self.home_dir, path)
         if not os.path.exists(resolved_path):
@@ -325,15 +517,18 @@ class Jail(object):
             return True
 
 
-def _monitor_file(fd, q):
-    while True:
-        line = fd.readline()
-        if not line:
-            q.put(None)
-            break
+def _monitor_file(fd, q, event=None):
+    for line, cut in _read_lines(fd):
         line = unicode(line, errors="replace")
         line = line.rstrip('\r\n')
-        q.put(line)
+        q.put(line, len(line))
+        if cut:
+            q.drop(cut)
+        if event is not None:
+            event.set()
+    q.put(None)
+    if event is not None:
+        event.set()
 
 class House:
     """Provide an insecure sandbox to run arbitrary commands in.
@@ -344,16 +539,19 @@ class House:
 
     """
 
-    def __init__(self, working_directory):
+    def __init__(self, working_directory, output_event=None):
         """Initialize a new sandbox for the given working directory.
 
         working_directory: the directory in which the shell command should
                            be launched.
+        output_event: a threading.Event set whenever the command writes a
+                      line or exits, may be shared by several sandboxes.
         """
         self._is_alive = False
         self.command_process = None
-        self.stdout_queue = Queue()
-        self.stderr_queue = Queue()
+        self.output_event = output_event
+        self.stdout_queue = OutputBuffer(*STDOUT_LIMITS, keep=_is_go)
+        self.stderr_queue = OutputBuffer(*STDERR_LIMITS)
         self.working_directory = working_directory
 
     @property
@@ -367,6 +565,18 @@ class House:
             self._is_alive = False
         return False
 
+    @property
+    def cpu_time(self):
+        """Cpu seconds used by the command, or None if unknown
+
+        Like pause, only the initial child process is counted, along with
+        any children it has waited for.
+
+        """
+        if self.command_process is None:
+            return None
+        return _cpu_time(self.command_process.pid)
+
     def start(self, shell_command):
         """Start a command running in the sandbox"""
         if self.is_alive:
@@ -385,11 +595,13 @@ class House:
             raise SandboxError('Failed to start {0}'.format(shell_command))
         self._is_alive = True
         stdout_monitor = Thread(target=_monitor_file,
-                                args=(self.command_process.stdout, self.stdout_queue))
+                                args=(self.command_process.stdout, self.stdout_queue,
+                                      self.output_event))
         stdout_monitor.daemon = True
         stdout_monitor.start()
         stderr_monitor = Thread(target=_monitor_file,
-                                args=(self.command_process.stderr, self.stderr_queue))
+                                args=(self.command_process.stderr, self.stderr_queue,
+                                      self.output_event))
         stderr_monitor.daemon = True
         stderr_monitor.start()
         Thread(target=self._child_writer).start()
@@ -451,6 +663,11 @@ class House:
         except (ValueError, AttributeError, OSError):
             pass
 
+    def _send_signal(self, action):
+        """Pause or resume the child, there is no response to wait for"""
+        getattr(self, action)()
+        return False
+
     def _child_writer(self):
         queue = self.child_queue
         stdin = self.command_process.stdin
@@ -511,6 +728,19 @@ class House:
         except Empty:
             return None
 
+    def reset_output(self):
+        """Let the command write a new quota of output"""
+        self.stdout_queue.reset()
+        self.stderr_queue.reset()
+
+    @property
+    def overflow(self):
+        """Lines and characters of output dropped for being over the quota"""
+        return {'stdout_lines': self.stdout_queue.dropped_lines,
+                'stdout_chars': self.stdout_queue.dropped_chars,
+                'stderr_lines': self.stderr_queue.dropped_lines,
+                'stderr_chars': self.stderr_queue.dropped_chars}
+
     def check_path(self, path, errors):
         resolved_path = os.path.join(self.working_directory, path)
         if not os.path.exists(resolved_path):
@@ -519,13 +749,32 @@ class House:
         else:
             return True
 
-def get_sandbox(working_dir, secure=None):
+def _signal_all(sandboxes, action):
+    """Send a pause or resume to all sandboxes before waiting for any of them"""
+    waiting = [sandbox for sandbox in sandboxes if sandbox._send_signal(action)]
+    for sandbox in waiting:
+        sandbox._await_signal(action)
+
+def pause_all(sandboxes):
+    """Pause the commands of several sandboxes at once
+
+    Jails are each asked to pause before the first confirmation is read,
+    so the time taken doesn't grow with the number of sandboxes.
+
+    """
+    _signal_all(sandboxes, "pause")
+
+def resume_all(sandboxes):
+    """Resume the commands of several sandboxes at once, like pause_all"""
+    _signal_all(sandboxes, "resume")
+
+def get_sandbox(working_dir, secure=None, output_event=None):
     if secure is None:
         secure = _SECURE_DEFAULT
     if secure:
-        return Jail(working_dir)
+        return Jail(working_dir, output_event)
     else:
-        return House(working_dir)
+        return House(working_dir, output_event)
 
 def main():
     parser = OptionParser(usage="usage: %prog [options] <command to run>")
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+    Checks that async_engine plays the same games as engine
+    python3 -m pytest test_async_engine.py
+
+    Games between the seeded sample bots, one of which crashes and one
+    of which times out, are played by engine.run_game and by
+    async_engine, alone and at the same time as each other.
+"""
+import asyncio
+import os
+import sys
+
+WORKER_DIR = os.path.dirname(os.path.abspath(__file__))
+ANTS_DIR = os.path.join(WORKER_DIR, '..', 'ants')
+sys.path.append(WORKER_DIR)
+sys.path.append(ANTS_DIR)
+from ants import Ants
+import engine
+import async_engine
+
+BOTS = ['HunterBot.py', 'GreedyBot.py', 'ErrorBot.py', 'TimeoutBot.py']
+
+def game_options(engine_seed):
+    with open(os.path.join(ANTS_DIR, 'maps', 'maze', 'maze_04p_01.map')) as f:
+        map_text = f.read()
+    return {'map': map_text, 'turns': 30, 'loadtime': 3000, 'turntime': 500,
+            'attack': 'focus', 'food': 'symmetric', 'viewradius2': 77,
+            'attackradius2': 5, 'spawnradius2': 1, 'engine_seed': engine_seed,
+            'player_seed': 7}
+
+def botcmds():
+    return [engine.get_cmd_wd('%s %s' % (sys.executable,
+                os.path.join(ANTS_DIR, 'dist', 'sample_bots', 'python', bot)))
+            for bot in BOTS]
+
+def comparable(result):
+    """ The result without the times the engine took """
+    result = dict(result)
+    del result['engine_time']
+    result['replaydata'] = dict(result['replaydata'])
+    result['replaydata'].pop('engine_time', None)
+    return result
+
+def test_game():
+    options = game_options(42)
+    expected = engine.run_game(Ants(options), botcmds(), dict(options))
+    result = asyncio.run(async_engine.run_game(Ants(options), botcmds(), dict(options)))
+    assert 'error' not in result, result.get('error')
+    assert result['status'] == ['survived', 'survived', 'crashed', 'timeout']
+    assert comparable(result) == comparable(expected)
+
+def test_games_at_once():
+    seeds = [1, 2, 3]
+    expected = [engine.run_game(Ants(game_options(seed)), botcmds(),
+                                dict(game_options(seed)))
+                for seed in seeds]
+    tasks = [(lambda seed=seed: Ants(game_options(seed)), botcmds(),
+              dict(game_options(seed)))
+             for seed in seeds]
+    results = asyncio.run(async_engine.run_games(tasks, len(seeds)))
+    assert [comparable(result) for result in results] == \
+        [comparable(result) for result in expected]
@@ -16,6 +16,7 @@ import unicodedata
 import traceback
 import tempfile
 from copy import copy, deepcopy
+from StringIO import StringIO
 
 from optparse import OptionParser
 
@@ -53,6 +54,9 @@ STATUS_UNPACK_ERROR = 60
 STATUS_COMPILE_ERROR = 70
 STATUS_TEST_ERROR = 80
 
+# replays larger than this are spooled to a file on disk
+REPLAY_SPOOL_SIZE = 1024 * 1024
+
 # get game from ants dir
 sys.path.append(os.path.join(server_info.get('repo_path', '..'), 'ants'))
 from ants import Ants
@@ -73,6 +77,53 @@ class CD(object):
     def __exit__(self, type, value, traceback):
         os.chdir(self.org_dir)
 
+class ResultBody(object):
+    """ Json text of a result, with the replay data read from a file
+
+        Reads like a file so urllib posts it in blocks, and has a length
+          for the Content-Length header.  The replay file holds the json
+          of the replay, which becomes the replaydata key of the result.
+    """
+    def __init__(self, result, replay_file=None):
+        text = json.dumps(result)
+        self.replay_file = replay_file
+        if replay_file is None:
+            self.head = text
+            self.tail = ''
+            self.replay_length = 0
+        else:
+            self.head = text[:-1] + (', ' if result else '') + '"replaydata": '
+            self.tail = '}'
+            replay_file.seek(0, os.SEEK_END)
+            self.replay_length = replay_file.tell()
+        self.seek(0)
+
+    def __len__(self):
+        return len(self.head) + self.replay_length + len(self.tail)
+
+    def __iter__(self):
+        self.seek(0)
+        block = self.read(8192)
+        while block:
+            yield block
+            block = self.read(8192)
+
+    def seek(self, offset):
+        if offset != 0:
+            raise ValueError("result bodies can only be read from the start")
+        self.parts = [StringIO(self.head), StringIO(self.tail)]
+        if self.replay_file is not None:
+            self.replay_file.seek(0)
+            self.parts.insert(1, self.replay_file)
+
+    def read(self, size=-1):
+        while self.parts:
+            data = self.parts[0].read(size)
+            if data:
+                return data
+            self.parts.pop(0)
+        return ''
+
 class GameAPIClient:
     def __init__(self, base_url, api_key):
         self.base_url = base_url
@@ -140,11 +191,15 @@ class GameAPIClient:
             log.error("Get map error: %s" % ex)
             return None
 
-    def post_result(self, method, result):
+    def post_result(self, method, result, replay_file=None):
         # save result in case of failure
         with open('last_post.json', 'w') as f:
             try:
-                f.write(json.dumps([method, result]))
+                body = ResultBody(result, replay_file)
+                f.write('[%s, ' % json.dumps(method))
+                for block in body:
+                    f.write(block)
+                f.write(']')
             except:
                 with open('bad_result', 'w') as br:
                     pickle.dump([method, result], br)
@@ -165,11 +220,14 @@ class GameAPIClient:
                     log.debug("Posting result %s: %s" % (method, json_log))
                 else:
                     log.warning("Posting attempt %s" % (i+1))
-                json_data = json.dumps(result)
-                hash = md5(json_data).hexdigest()
+                hash = md5()
+                for block in body:
+                    hash.update(block)
+                hash = hash.hexdigest()
                 if i == 0:
                     log.info("Posting hash: %s" % hash)
-                response = urllib.urlopen(url, json.dumps(result))
+                body.seek(0)
+                response = urllib.urlopen(url, body)
                 if response.getcode() == 200:
                     data = response.read()
                     try:
@@ -486,6 +544,7 @@ class Worker:
 
     def game(self, task, report_status=False):
         self.post_id += 1
+        replay_spool = None
         try:
             matchup_id = int(task["matchup_id"])
             log.info("Running game %s..." % matchup_id)
@@ -495,8 +554,13 @@ class Worker:
             if options == None:
                 options = copy(server_info["game_options"])
             options["map"] = self.get_map(task['map_filename'])
+            # reuse the symmetry and food sets of maps played before
+            options["map_cache"] = os.path.join(server_info["maps_path"], "cache")
             options["turns"] = task['max_turns']
             options["output_json"] = True
+            # write dead ants and removed food to the replay as the game
+            #   goes, instead of keeping them to the end
+            options["spool_replay"] = True
             game = Ants(options)
             bots = []
             for submission_id in task["submissions"]:
@@ -518,6 +582,9 @@ class Worker:
                     raise Exception('bot', 'Can not compile bot %s' % submission_id)
             options['game_id'] = matchup_id
             log.debug((game.__class__.__name__, task['submissions'], options, matchup_id))
+            # the replay is posted from a file, not kept in the result
+            replay_spool = tempfile.SpooledTemporaryFile(max_size=REPLAY_SPOOL_SIZE)
+            options['replay_spool'] = replay_spool
             # set worker debug logging
             if self.debug:
                 options['verbose_log'] = sys.stdout
@@ -528,6 +595,9 @@ class Worker:
                 # options['output_logs'] = [sys.stdout, sys.stdout]
                 # options['input_logs'] = [sys.stdout, sys.stdout]
             options['capture_errors'] = True
+            # time bots by their cpu time, so other games on the box don't
+            #   time them out
+            options['cpu_time'] = server_info.get('cpu_time', False)
             result = run_game(game, bots, options)
             if self.debug:
                 replay_log.close()
@@ -537,7 +607,9 @@ class Worker:
             result['matchup_id'] = matchup_id
             result['post_id'] = self.post_id
             if report_status:
-                return self.cloud.post_result('api_game_result', result)
+                if 'error' in result:
+                    return self.cloud.post_result('api_game_result', result)
+                return self.cloud.post_result('api_game_result', result, replay_spool)
         except Exception as ex:
             log.error(traceback.format_exc())
             result = {"post_id": self.post_id,
@@ -547,6 +619,9 @@ class Worker:
             # cleanup download dirs
             map(self.clean_download, map(int, task['submissions']))
             return success
+        finally:
+            if replay_spool is not None:
+                replay_spool.close()
 
     def task(self, last=False):
         task = self.cloud.get_task()